@@ -6,6 +6,8 @@ import sys
 
 from pinject import new_object_graph
 
+from save_message.dates import now
+from save_message.dates import pin_now
 from save_message.injector import SaveMessageBindingSpec
 from save_message._internal.argparse import create_parser
 
@@ -20,6 +22,11 @@ if __name__ == "__main__":
     parser = create_parser()
     args = parser.parse_args()
 
+    # every age comparison in the run (including in worker processes, which
+    # are given a copy of args) is made against the same time
+    args.now = args.now or now()
+    pin_now(args.now)
+
     # set og on args so the 'do' functions can access it easily
     args.og = new_object_graph(binding_specs=[SaveMessageBindingSpec(args)])
 
@@ -1,6 +1,7 @@
 import argparse
 import logging
 from save_message._internal import cli_do
+from save_message.dates import parse_date
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +22,13 @@ def create_parser():
         help="Be more verbose (x2 for more)",
     )
 
+    parser.add_argument(
+        "--now",
+        type=parse_date,
+        help="The time to treat as now when checking message ages, e.g. for "
+        + "reproducible runs (default: the time the run started)",
+    )
+
     parser.add_argument(
         "--force-deletes",
         action="store_true",
@@ -37,6 +45,24 @@ def create_parser():
     do_search.add_argument(
         "--from", dest="from_", help="From address (can include wildcards)"
     )
+    do_search.add_argument(
+        "--since", type=parse_date, help="Only messages dated at or after this"
+    )
+    do_search.add_argument(
+        "--until", type=parse_date, help="Only messages dated before this"
+    )
+    do_search.add_argument(
+        "--limit",
+        type=int,
+        help="Stop searching each maildir after finding this many messages",
+    )
+    do_search.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of maildirs to process in parallel",
+    )
     do_search.set_defaults(func=cli_do.do_search)
 
     do_delete = subparsers.add_parser("delete", help="Delete messages")
@@ -46,6 +72,12 @@ def create_parser():
     do_delete.add_argument(
         "--from", dest="from_", help="From address (can include wildcards)"
     )
+    do_delete.add_argument(
+        "--since", type=parse_date, help="Only messages dated at or after this"
+    )
+    do_delete.add_argument(
+        "--until", type=parse_date, help="Only messages dated before this"
+    )
     do_delete.set_defaults(func=cli_do.do_delete)
 
     do_apply_rules = subparsers.add_parser(
@@ -57,6 +89,31 @@ def create_parser():
     do_apply_rules.add_argument(
         "--from", dest="from_", help="From address (can include wildcards)"
     )
+    do_apply_rules.add_argument(
+        "--since", type=parse_date, help="Only messages dated at or after this"
+    )
+    do_apply_rules.add_argument(
+        "--until", type=parse_date, help="Only messages dated before this"
+    )
+    do_apply_rules.add_argument(
+        "--full",
+        action="store_true",
+        default=False,
+        help="Process every message, not just those new since the last run",
+    )
+    do_apply_rules.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of maildirs to process in parallel",
+    )
+    do_apply_rules.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        help="Number of processes to parse and match each maildir's messages with",
+    )
     do_apply_rules.set_defaults(func=cli_do.do_apply_rules)
 
     do_test_rule = subparsers.add_parser("test-rule", help="Test a rule's matchers")
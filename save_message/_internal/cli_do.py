@@ -1,54 +1,273 @@
+from argparse import Namespace
+from concurrent.futures import ProcessPoolExecutor
 import logging
 import traceback
+from typing import Any
+from typing import Callable
+from typing import Generator
 
+from pinject import new_object_graph
+
+from save_message.dates import pin_now
+from save_message.injector import SaveMessageBindingSpec
 from save_message.maildir import Maildir
 from save_message.maildir import Maildirs
 from save_message.maildir import MaildirMessage
+from save_message.pdf import PdfConverter
+from save_message.save import MessagePartSaver
 from save_message.save import MessageSaveException
 from save_message.rules import RulesMatcher
+from save_message.state import MaildirStates
 
 
 logger = logging.getLogger(__name__)
 
+# args for the current process, when running as a --jobs or --shards worker
+worker_args: Namespace | None = None
+
+# the number of keys each --shards worker is given at a time
+SHARD_SIZE = 500
+
+
+def init_worker(args: Namespace):
+    # the object graph can't be pickled, so each worker builds its own
+    global worker_args
+    worker_args = args
+    pin_now(args.now)
+    worker_args.og = new_object_graph(binding_specs=[SaveMessageBindingSpec(args)])
+
+
+def new_worker_pool(args, max_workers: int) -> ProcessPoolExecutor:
+    pool_args = Namespace(**{k: v for k, v in vars(args).items() if k != "og"})
+
+    return ProcessPoolExecutor(
+        max_workers=max_workers, initializer=init_worker, initargs=(pool_args,)
+    )
+
+
+def run_in_worker(func: Callable[[Namespace, Maildir], Any], index: int) -> Any:
+    maildir = worker_args.og.provide(Maildirs).get_maildirs()[index]
+    return func(worker_args, maildir)
+
+
+def for_each_maildir(args, func: Callable[[Namespace, Maildir], Any]) -> list[Any]:
+    """Call func(args, maildir) for each configured maildir, and return the
+    results in maildir order. With --jobs N, maildirs are handed out to a pool
+    of N processes as each finishes its previous one, so func and its result
+    must be picklable."""
+    maildirs: list[Maildir] = args.og.provide(Maildirs).get_maildirs()
+
+    if args.jobs <= 1 or len(maildirs) <= 1:
+        return [func(args, maildir) for maildir in maildirs]
+
+    with new_worker_pool(args, args.jobs) as executor:
+        futures = [
+            executor.submit(run_in_worker, func, index)
+            for index in range(len(maildirs))
+        ]
+        return [f.result() for f in futures]
+
+
+def match_rules_in_worker(
+    maildir_path: str, keys: list[str]
+) -> list[tuple[str, int | None]]:
+    maildir = next(
+        m
+        for m in worker_args.og.provide(Maildirs).get_maildirs()
+        if m.path == maildir_path
+    )
+    rules_matcher = worker_args.og.provide(RulesMatcher)
+
+    return [
+        (k, rules_matcher.match_save_rule_ordinal(m))
+        for k, m in maildir.search(
+            subject=worker_args.subject,
+            from_=worker_args.from_,
+            to=worker_args.to,
+            date=worker_args.date,
+            since=worker_args.since,
+            until=worker_args.until,
+            keys=keys,
+        )
+    ]
+
+
+def match_rules_sharded(
+    args, maildir: Maildir, skip_keys: set[str]
+) -> Generator[tuple[str, int | None], None, None]:
+    """Search the maildir and match each message to a rule, as for
+    maildir.search() and RulesMatcher.match_save_rule_ordinal(), but split the
+    work across a pool of --shards processes. Each process parses and matches
+    a slice of the keys, returning only (key, rule ordinal) pairs; these are
+    yielded in key order, so the caller can perform the actions itself."""
+    keys = [k for k in maildir.keys() if k not in skip_keys]
+
+    with new_worker_pool(args, args.shards) as executor:
+        # many more slices than workers, so workers that finish early keep busy
+        futures = [
+            executor.submit(
+                match_rules_in_worker, maildir.path, keys[i : i + SHARD_SIZE]
+            )
+            for i in range(0, len(keys), SHARD_SIZE)
+        ]
+
+        for future in futures:
+            yield from future.result()
+
+
+def describe_error(
+    k: str, m: MaildirMessage, ex: Exception
+) -> tuple[str, str, list[str]]:
+    """Summarise a failed message as plain strings, so it can be passed back
+    from a worker process."""
+    if isinstance(ex, MessageSaveException):
+        description = ex.message_name
+
+    elif m is None:
+        description = k
+
+    else:
+        description = f'{m["date"]} {m["from"]} {m["subject"]}'
+
+    return (k, description, traceback.format_exception(None, ex, ex.__traceback__))
+
 
 def do_delete(args):
     maildirs: list[Maildir] = args.og.provide(Maildirs).get_maildirs()
 
     for maildir in maildirs:
         for k, m in maildir.search(
-            subject=args.subject, from_=args.from_, to=args.to, date=args.date
+            subject=args.subject,
+            from_=args.from_,
+            to=args.to,
+            date=args.date,
+            since=args.since,
+            until=args.until,
         ):
             logger.info(f'deleting: {k}: {m["date"], m["from"], m["subject"]}')
-            maildir.delete(k)
+            maildir.delete(k, msg=m)
 
 
-def do_apply_rules(args):
-    maildirs: list[Maildir] = args.og.provide(Maildirs).get_maildirs()
-    exceptions: list[tuple[str, MaildirMessage, Exception]] = []
+def apply_rules_to_maildir(args, maildir: Maildir) -> list[tuple[str, str, list[str]]]:
+    maildir_states = args.og.provide(MaildirStates)
+    rules_matcher = args.og.provide(RulesMatcher)
+    # the (singleton) converter that saves queue conversions on
+    pdf_converter: PdfConverter = args.og.provide(MessagePartSaver).pdf_converter
+    errors: list[tuple[str, str, list[str]]] = []
 
-    for maildir in maildirs:
+    state = maildir_states.get_state(maildir.path)
+    dir_mtimes = maildir.get_dir_mtimes()
+
+    def undecide(k: str):
+        state.decided_keys.discard(k)
+        state.applied_ordinals.pop(k, None)
+
+    def on_failed(k: str, m: MaildirMessage, ex: Exception):
+        # a save that finished in the background (see PdfConverter) failed,
+        # so the message is not decided after all
+        errors.append(describe_error(k, m, ex))
+        undecide(k)
+
+    def apply_rule(k: str, m: MaildirMessage, ordinal: int | None):
+        # a message that could still come to match an age rule is matched
+        # again on later runs, but its rule is only applied when it changes
+        if k not in state.applied_ordinals or state.applied_ordinals[k] != ordinal:
+            logger.info(f'apply_rules: {k}: {m["date"], m["from"], m["subject"]}')
+            maildir.apply_rule(
+                k,
+                m,
+                rules_matcher.get_save_rule(ordinal),
+                on_failed=lambda ex: on_failed(k, m, ex),
+            )
+
+        if rules_matcher.is_final(ordinal):
+            state.decided_keys.add(k)
+            state.applied_ordinals.pop(k, None)
+        else:
+            state.applied_ordinals[k] = ordinal
+
+    if args.full:
+        state.decided_keys = set()
+        state.applied_ordinals = {}
+
+    # with age rules, the rule a message matches can change without the
+    # maildir changing, so it must be listed every time
+    elif state.is_unchanged(dir_mtimes) and not rules_matcher.has_time_dependent_rules:
+        logger.info("apply_rules: %s unchanged since last run", maildir.path)
+        return errors
+
+    if args.shards > 1:
+        for k, ordinal in match_rules_sharded(args, maildir, state.decided_keys):
+            m = None
+
+            try:
+                m = maildir.get_headers(k)
+                apply_rule(k, m, ordinal)
+
+            except Exception as ex:
+                errors.append(describe_error(k, m, ex))
+
+            pdf_converter.poll()
+
+    else:
         for k, m in maildir.search(
-            subject=args.subject, from_=args.from_, to=args.to, date=args.date
+            subject=args.subject,
+            from_=args.from_,
+            to=args.to,
+            date=args.date,
+            since=args.since,
+            until=args.until,
+            skip_keys=state.decided_keys,
         ):
             try:
-                logger.info(f'apply_rules: {k}: {m["date"], m["from"], m["subject"]}')
-                maildir.apply_rules(k)
+                apply_rule(k, m, rules_matcher.match_save_rule_ordinal(m))
 
             except Exception as ex:
-                exceptions.append((k, m, ex))
+                errors.append(describe_error(k, m, ex))
+
+            pdf_converter.poll()
+
+    # finish any saves still waiting on PDF conversions
+    pdf_converter.wait()
+
+    # nor are messages whose delete was declined (or could not be asked
+    # about, e.g. under cron), which would otherwise never be deleted
+    for k in maildir.skipped_deletes:
+        undecide(k)
 
-    if exceptions:
+    state.update(dir_mtimes, set(maildir.keys()))
+    state.save()
+
+    return errors
+
+
+def do_apply_rules(args):
+    if (
+        args.jobs > 1
+        and not args.force_deletes
+        and args.og.provide(RulesMatcher).needs_delete_confirmation()
+    ):
+        # worker processes have no terminal to ask on
+        raise SystemExit(
+            "apply-rules: --jobs can't ask before deleting messages; use "
+            + "--force-deletes, or set delete_confirmation: false on rules "
+            + "that delete"
+        )
+
+    errors = [
+        error
+        for maildir_errors in for_each_maildir(args, apply_rules_to_maildir)
+        for error in maildir_errors
+    ]
+
+    if errors:
         print("")
         print("The following messages encountered errors:")
 
-        for k, m, ex in exceptions:
-            if isinstance(ex, MessageSaveException):
-                print(ex.message_name)
+        for k, description, traceback_lines in errors:
+            print(description)
 
-            else:
-                print(m["date"], m["from"], m["subject"])
-
-            for line in traceback.format_exception(None, ex, ex.__traceback__):
+            for line in traceback_lines:
                 print("  " + line)
 
 
@@ -66,11 +285,24 @@ def do_test_rule(args):
                 )
 
 
-def do_search(args):
-    maildirs: list[Maildir] = args.og.provide(Maildirs).get_maildirs()
+def search_maildir(args, maildir: Maildir) -> int:
+    found = 0
 
-    for maildir in maildirs:
-        for k, m in maildir.search(
-            subject=args.subject, from_=args.from_, to=args.to, date=args.date
-        ):
-            logger.info(f'found: {k}: {m["date"], m["from"], m["subject"]}')
+    for k, m in maildir.search(
+        subject=args.subject,
+        from_=args.from_,
+        to=args.to,
+        date=args.date,
+        since=args.since,
+        until=args.until,
+        limit=args.limit,
+    ):
+        logger.info(f'found: {k}: {m["date"], m["from"], m["subject"]}')
+        found += 1
+
+    return found
+
+
+def do_search(args):
+    found = sum(for_each_maildir(args, search_maildir))
+    logger.info("found %d messages", found)
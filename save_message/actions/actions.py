@@ -1,6 +1,7 @@
 from email.message import EmailMessage
 import logging
 from typing import Any
+from typing import Callable
 
 from save_message.model import MessageAction
 from save_message.rules import RulesMatcher
@@ -9,6 +10,8 @@ from save_message.actions.save_and_delete_action import SaveAndDeleteRuleAction
 from save_message.actions.keep_action import KeepRuleAction
 from save_message.actions.ignore_action import IgnoreRuleAction
 from save_message.actions.delete_action import DeleteRuleAction
+from save_message.actions.move_action import MoveRuleAction
+from save_message.actions.copy_action import CopyRuleAction
 
 logger = logging.getLogger(__name__)
 
@@ -28,8 +31,11 @@ class RuleAction:
         messageKey: str,
         message: EmailMessage,
         rule: SaveRule,
+        on_failed: Callable[[Exception], None] | None = None,
     ) -> Any:
-        """Performs the action against the given message."""
+        """Performs the action against the given message. Actions that can
+        finish in the background (i.e. those that save) do so only if
+        on_failed is given, and call it if they fail after returning."""
         pass
 
 
@@ -40,6 +46,8 @@ class MessageActions:
         keep_rule_action: KeepRuleAction,
         ignore_rule_action: IgnoreRuleAction,
         delete_rule_action: DeleteRuleAction,
+        move_rule_action: MoveRuleAction,
+        copy_rule_action: CopyRuleAction,
         rules_matcher: RulesMatcher,
     ):
         self.actions = [
@@ -47,17 +55,41 @@ class MessageActions:
             keep_rule_action,
             ignore_rule_action,
             delete_rule_action,
+            move_rule_action,
+            copy_rule_action,
         ]
         self.rules_matcher = rules_matcher
 
-    def apply_rules(self, maildir, key: str):
-        msg = maildir.get(key)
+    def apply_rules(
+        self,
+        maildir,
+        key: str,
+        msg: EmailMessage | None = None,
+        on_failed: Callable[[Exception], None] | None = None,
+    ):
+        if msg is None:
+            msg = maildir.get(key)
+
         assert isinstance(msg, EmailMessage)
 
         rule = self.rules_matcher.match_save_rule(msg)
 
+        return self.apply_rule(maildir, key, msg, rule, on_failed=on_failed)
+
+    def apply_rule(
+        self,
+        maildir,
+        key: str,
+        msg: EmailMessage,
+        rule: SaveRule,
+        on_failed: Callable[[Exception], None] | None = None,
+    ):
+        """Perform the action of an already-matched rule on the message. See
+        RuleAction.perform_action() for on_failed."""
         for action in self.actions:
             if action.matches_message_action(rule.settings.action):
-                return action.perform_action(maildir, key, msg, rule)
+                return action.perform_action(
+                    maildir, key, msg, rule, on_failed=on_failed
+                )
 
         raise ValueError(f"unhandled MessageAction {rule.settings.action}")
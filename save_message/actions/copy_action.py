@@ -0,0 +1,28 @@
+from __future__ import annotations
+from email.message import EmailMessage
+import logging
+
+from save_message.model import MessageAction
+from save_message.rules import SaveRule
+from save_message.actions.move_action import get_target_maildir
+
+logger = logging.getLogger(__name__)
+
+
+class CopyRuleAction:
+    def matches_message_action(self, action: MessageAction) -> bool:
+        return action == MessageAction.COPY
+
+    def perform_action(
+        self,
+        maildir,  # Maildir, but must avoid type (and pass in, not
+        # inject), otherwise we get import cycles
+        messageKey: str,
+        message: EmailMessage,
+        rule: SaveRule,
+        on_failed=None,
+    ) -> None:
+        logger.debug(
+            "CopyRuleAction.perform_action: %s matches %s", messageKey, rule.matches
+        )
+        maildir.copy(messageKey, get_target_maildir(rule), msg=message)
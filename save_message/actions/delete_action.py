@@ -19,8 +19,13 @@ class DeleteRuleAction:
         messageKey: str,
         message: EmailMessage,
         rule: SaveRule,
-    ) -> None:
+        on_failed=None,
+    ) -> bool:
+        """Delete the message (see Maildir.delete()), returning True if it
+        was deleted."""
         logger.debug(
             "DeleteRuleAction.perform_action: %s matches %s", messageKey, rule.matches
         )
-        maildir.delete(messageKey, force=not rule.settings.delete_confirmation)
+        return maildir.delete(
+            messageKey, force=not rule.settings.delete_confirmation, msg=message
+        )
@@ -19,6 +19,7 @@ class IgnoreRuleAction:
         messageKey: str,
         message: EmailMessage,
         rule: SaveRule,
+        on_failed=None,
     ) -> None:
         logger.debug(
             "IgnoreRuleAction.perform_action: %s matches %s", messageKey, rule.matches
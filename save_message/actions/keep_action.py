@@ -32,13 +32,17 @@ class KeepRuleAction:
         messageKey: str,
         message: EmailMessage,
         rule: SaveRule,
+        on_failed=None,
+        then=None,
     ) -> KeepRuleActionResult:
+        """Save the message. See MessageSaver.save_message() for on_failed
+        and then."""
         logger.debug(
             "KeepRuleAction.perform_action: %s matches %s", messageKey, rule.matches
         )
 
         body_filename, attachment_filenames = self.message_saver.save_message(
-            message, rule
+            message, rule, then=then, on_failed=on_failed
         )
 
         return KeepRuleActionResult(
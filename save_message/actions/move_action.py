@@ -0,0 +1,35 @@
+from __future__ import annotations
+from email.message import EmailMessage
+import logging
+import os
+
+from save_message.model import MessageAction
+from save_message.rules import SaveRule
+
+logger = logging.getLogger(__name__)
+
+
+def get_target_maildir(rule: SaveRule) -> str:
+    if not rule.settings.target_maildir:
+        raise ValueError(f"{rule.settings.action} rule has no target_maildir")
+
+    return os.path.expanduser(os.path.expandvars(rule.settings.target_maildir))
+
+
+class MoveRuleAction:
+    def matches_message_action(self, action: MessageAction) -> bool:
+        return action == MessageAction.MOVE
+
+    def perform_action(
+        self,
+        maildir,  # Maildir, but must avoid type (and pass in, not
+        # inject), otherwise we get import cycles
+        messageKey: str,
+        message: EmailMessage,
+        rule: SaveRule,
+        on_failed=None,
+    ) -> None:
+        logger.debug(
+            "MoveRuleAction.perform_action: %s matches %s", messageKey, rule.matches
+        )
+        maildir.move(messageKey, get_target_maildir(rule), msg=message)
@@ -35,25 +35,32 @@ class SaveAndDeleteRuleAction:
         messageKey: str,
         message: EmailMessage,
         rule: SaveRule,
+        on_failed=None,
     ) -> SaveAndDeleteRuleActionResult:
+        """Save the message, then delete it. If on_failed is given, saving
+        may finish later (see MessageSaver.save_message()), and the message
+        is only deleted once it has."""
         logger.debug(
             "SaveAndDeleteRuleAction.perform_action: %s matches %s",
             messageKey,
             rule.matches,
         )
 
-        keep_result = self.keep_rule_action.perform_action(
-            maildir,
-            messageKey,
-            message,
-            rule,
-        )
+        def delete():
+            self.delete_rule_action.perform_action(
+                maildir,
+                messageKey,
+                message,
+                rule,
+            )
 
-        self.delete_rule_action.perform_action(
+        keep_result = self.keep_rule_action.perform_action(
             maildir,
             messageKey,
             message,
             rule,
+            on_failed=on_failed,
+            then=delete,
         )
 
         return SaveAndDeleteRuleActionResult(
@@ -0,0 +1,127 @@
+import errno
+import logging
+import os
+import sqlite3
+from typing import Iterable
+
+from save_message.fileops import move_no_replace
+from save_message.model import DedupeLink
+
+logger = logging.getLogger(__name__)
+
+# the store's directory, under the save path
+STORE_DIR = ".attachments"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL
+);
+"""
+
+
+def relative_symlink(target: str, link_path: str):
+    os.symlink(os.path.relpath(target, os.path.dirname(link_path)), link_path)
+
+
+def move_link(src: str, dst: str):
+    """Move a file saved by AttachmentStore.link() to dst, which must not
+    exist (FileExistsError is raised if it does). A relative symlink is
+    re-pointed, as its target is relative to the directory it is in; anything
+    else is just renamed (see move_no_replace())."""
+    if os.path.islink(src):
+        target = os.path.join(os.path.dirname(src), os.readlink(src))
+        relative_symlink(os.path.normpath(target), dst)
+        os.remove(src)
+
+    else:
+        move_no_replace(src, dst)
+
+
+class AttachmentStore:
+    """A content-addressed store of saved attachments, kept in STORE_DIR under
+    a save path. Each distinct attachment (by SHA-256 of its decoded content)
+    is stored once, as a blob, and every saved copy of it is a hard link or
+    symlink to that blob.
+
+    A small SQLite index in the store maps each hash to its blob's path. It
+    uses SQLite's default rollback journal rather than WAL, as save paths are
+    often on network filesystems, where WAL is not safe."""
+
+    def __init__(self):
+        # store directory -> connection
+        self.conns: dict[str, sqlite3.Connection] = {}
+
+    def __connect__(self, store_dir: str) -> sqlite3.Connection:
+        conn = self.conns.get(store_dir)
+
+        if conn is None:
+            os.makedirs(store_dir, exist_ok=True)
+            conn = sqlite3.connect(
+                os.path.join(store_dir, "index.sqlite"),
+                timeout=60,
+                isolation_level=None,
+            )
+            conn.executescript(SCHEMA)
+            self.conns[store_dir] = conn
+
+        return conn
+
+    def find(self, save_path: str, digest: str) -> str | None:
+        """Return the path of the blob with the given hash, or None if there
+        isn't one."""
+        store_dir = os.path.join(save_path, STORE_DIR)
+        row = (
+            self.__connect__(store_dir)
+            .execute("SELECT path FROM blobs WHERE hash = ?", (digest,))
+            .fetchone()
+        )
+
+        if row is None:
+            return None
+
+        blob_path = os.path.join(store_dir, row[0])
+        return blob_path if os.path.exists(blob_path) else None
+
+    def add(self, save_path: str, digest: str, chunks: Iterable[bytes]) -> str:
+        """Write a blob with the given hash and content, and return its path.
+        The blob is written to a temporary file and renamed into place, so
+        concurrent runs adding the same blob are safe."""
+        store_dir = os.path.join(save_path, STORE_DIR)
+        relative_path = os.path.join(digest[:2], digest)
+        blob_path = os.path.join(store_dir, relative_path)
+        temp_path = f"{blob_path}.{os.getpid()}.tmp"
+
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+
+        size = 0
+        with open(temp_path, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+                size += len(chunk)
+
+        os.replace(temp_path, blob_path)
+
+        self.__connect__(store_dir).execute(
+            "INSERT OR REPLACE INTO blobs VALUES (?, ?, ?)",
+            (digest, relative_path, size),
+        )
+        logger.debug("stored blob %s (%d bytes)", digest, size)
+
+        return blob_path
+
+    def link(self, blob_path: str, dest_path: str, how: DedupeLink):
+        """Make dest_path a link to the blob at blob_path. Hard links fall
+        back to symlinks where they are not possible (e.g. the blob has
+        reached the filesystem's link limit)."""
+        if how == DedupeLink.HARDLINK:
+            try:
+                os.link(blob_path, dest_path)
+                return
+
+            except OSError as ex:
+                if ex.errno not in (errno.EMLINK, errno.EXDEV, errno.EPERM):
+                    raise
+
+        relative_symlink(blob_path, dest_path)
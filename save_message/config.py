@@ -31,6 +31,8 @@ def load_config(config_file):
                         MessageAction.DELETE,
                         MessageAction.SAVE_AND_DELETE,
                         MessageAction.IGNORE,
+                        MessageAction.MOVE,
+                        MessageAction.COPY,
                     ]
                 ]
             )
@@ -0,0 +1,57 @@
+from datetime import datetime
+from datetime import timezone
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+
+from dateutil.parser import parse
+
+# the reference time for the run (see pin_now())
+pinned_now: datetime | None = None
+
+
+@lru_cache(maxsize=8192)
+def parse_date_str(value: str) -> datetime:
+    try:
+        result = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        # not RFC 5322; dateutil is much slower, but copes with almost
+        # anything (including dates from the config file)
+        return parse(value)
+
+    # email.utils leaves dates in -0000 (i.e. UTC, with no local zone given)
+    # or with no zone at all naive, which never compare equal to aware ones
+    if result.tzinfo is None:
+        result = result.replace(tzinfo=timezone.utc)
+
+    return result
+
+
+def parse_date(value) -> datetime:
+    """Parse a date, e.g. from a Date header. RFC 5322 dates (i.e. nearly all
+    of them) are parsed with email.utils, with dateutil as a fallback for
+    everything else. Results are remembered, keyed on the raw string, as many
+    messages share a Date header value and the same message's date may be
+    asked for more than once.
+
+    Raises ValueError if the date cannot be parsed, and TypeError if value is
+    None."""
+    if value is None:
+        raise TypeError("no date to parse")
+
+    return parse_date_str(str(value))
+
+
+def pin_now(when: datetime | None):
+    """Fix the value now() returns, so that every age comparison in a run
+    (including in worker processes) uses the same reference time. Passing
+    None unpins it."""
+    global pinned_now
+    pinned_now = when
+
+
+def now() -> datetime:
+    """The current time (timezone-aware), or the pinned time if there is one."""
+    if pinned_now is not None:
+        return pinned_now
+
+    return datetime.now().astimezone()
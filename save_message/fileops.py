@@ -0,0 +1,226 @@
+import errno
+import logging
+import os
+import shutil
+from typing import Callable
+from typing import Iterable
+
+try:
+    import fcntl
+except ImportError:  # not on POSIX
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# errors from os.link() meaning we should fall back to copying the file
+LINK_UNSUPPORTED_ERRNOS = (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.EOPNOTSUPP)
+
+# errors from FICLONE and copy_file_range() meaning the filesystem (or
+# kernel) can't do it for these files, and we should try something else
+COPY_UNSUPPORTED_ERRNOS = (
+    errno.EXDEV,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.ENOTTY,
+    errno.EOPNOTSUPP,
+    errno.EBADF,
+)
+
+# ioctl to clone (reflink) a whole file on Linux, from linux/fs.h
+FICLONE = 0x40049409
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+def try_reflink(src_fd: int, dest_fd: int) -> bool:
+    if fcntl is None:
+        return False
+
+    try:
+        fcntl.ioctl(dest_fd, FICLONE, src_fd)
+        return True
+
+    except OSError as ex:
+        if ex.errno not in COPY_UNSUPPORTED_ERRNOS:
+            raise
+
+        return False
+
+
+def try_copy_file_range(src_fd: int, dest_fd: int) -> bool:
+    if not hasattr(os, "copy_file_range"):
+        return False
+
+    try:
+        while os.copy_file_range(src_fd, dest_fd, COPY_BUFFER_SIZE * 64):
+            pass
+
+        return True
+
+    except OSError as ex:
+        if ex.errno not in COPY_UNSUPPORTED_ERRNOS:
+            raise
+
+        # start again from scratch
+        os.ftruncate(dest_fd, 0)
+        os.lseek(src_fd, 0, os.SEEK_SET)
+        os.lseek(dest_fd, 0, os.SEEK_SET)
+        return False
+
+
+def copy_file_contents(src: str, dest: str):
+    """Copy the bytes of the file at src to a new file dest, which must not
+    exist. The copy is made by the cheapest means available: a reflink
+    (copy-on-write clone), then copy_file_range() (which stays in the kernel,
+    and which some filesystems do server-side), then a plain buffered copy."""
+    with open(src, "rb") as fsrc, open(dest, "xb") as fdest:
+        if try_reflink(fsrc.fileno(), fdest.fileno()):
+            logger.debug("reflinked %s to %s", src, dest)
+
+        elif try_copy_file_range(fsrc.fileno(), fdest.fileno()):
+            logger.debug("copy_file_range %s to %s", src, dest)
+
+        else:
+            shutil.copyfileobj(fsrc, fdest, COPY_BUFFER_SIZE)
+            logger.debug("copied %s to %s", src, dest)
+
+
+def link_or_copy(src: str, dest: str):
+    """Make dest, which must not exist, a hard link to src if possible (same
+    filesystem, and one that supports hard links), otherwise a copy of it
+    (see copy_file_contents()). Either way src's bytes are never read into
+    Python unless there is no cheaper way."""
+    try:
+        os.link(src, dest)
+        logger.debug("linked %s to %s", src, dest)
+        return
+
+    except OSError as ex:
+        if ex.errno not in LINK_UNSUPPORTED_ERRNOS:
+            raise
+
+    copy_file_contents(src, dest)
+
+
+def make_dir(path: str):
+    """Create the directory path, which must not exist (so that, as with
+    O_EXCL, only one of several processes creating it succeeds), creating
+    its parents if they do not exist."""
+    try:
+        os.mkdir(path)
+
+    except FileNotFoundError:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.mkdir(path)
+
+
+def move_no_replace(src: str, dst: str):
+    """Rename src to dst, which must not exist; if it does, FileExistsError
+    is raised and src is left where it is. Where hard links are not
+    possible, dst is created with O_EXCL and src renamed over it."""
+    try:
+        os.link(src, dst)
+
+    except OSError as ex:
+        if ex.errno not in LINK_UNSUPPORTED_ERRNOS:
+            raise
+
+        os.close(os.open(dst, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        os.replace(src, dst)
+        return
+
+    os.remove(src)
+
+
+class DestinationNames:
+    """The names taken in each destination directory, so that unique names
+    can be picked without probing the filesystem for each candidate. A
+    directory is listed once, the first time a name is wanted in it, and the
+    listing kept up to date with the names we take.
+
+    Other processes may take names behind our backs, so the directory or file
+    for a name is created exclusively (see make_dir() and move_no_replace());
+    if that finds the name taken, the next candidate is tried."""
+
+    def __init__(self):
+        # directory -> names taken in it
+        self.listings: dict[str, set[str]] = {}
+
+    def __listing__(self, dir: str) -> set[str]:
+        listing = self.listings.get(dir)
+
+        if listing is None:
+            try:
+                with os.scandir(dir) as it:
+                    listing = {entry.name for entry in it}
+
+            except FileNotFoundError:
+                listing = set()
+
+            self.listings[dir] = listing
+
+        return listing
+
+    def names(self, dir: str) -> set[str]:
+        """Return the names taken in dir, which must not be modified."""
+        return self.__listing__(dir)
+
+    def create(
+        self, dir: str, candidates: Iterable[str], make: Callable[[str], None]
+    ) -> str:
+        """Call make() with the path in dir of the first of candidates not
+        taken, returning that path. make() must create the path, raising
+        FileExistsError if it already exists."""
+        listing = self.__listing__(dir)
+
+        for name in candidates:
+            if name in listing:
+                continue
+
+            path = os.path.join(dir, name)
+
+            try:
+                make(path)
+
+            except FileExistsError:
+                logger.debug("%s was taken by someone else", path)
+                listing.add(name)
+                continue
+
+            listing.add(name)
+            return path
+
+        raise ValueError(f"no candidate name is free in {dir}")
+
+    def mkdir(self, dir: str, candidates: Iterable[str]) -> str:
+        """Create a directory in dir named after the first of candidates not
+        taken, returning its path. The new directory is known to be empty, so
+        names can be taken in it without listing it."""
+        path = self.create(dir, candidates, make_dir)
+        self.listings[path] = set()
+
+        return path
+
+    def take(self, dir: str, candidates: Iterable[str]) -> str:
+        """Return the path in dir of the first of candidates not taken,
+        marking it taken, without creating anything. This is only safe in a
+        directory nobody else writes to, e.g. one made by mkdir()."""
+        listing = self.__listing__(dir)
+
+        for name in candidates:
+            if name not in listing:
+                listing.add(name)
+                return os.path.join(dir, name)
+
+        raise ValueError(f"no candidate name is free in {dir}")
+
+    def discard(self, path: str):
+        """Mark the name of path free again, once we have removed it."""
+        listing = self.listings.get(os.path.dirname(path))
+
+        if listing is not None:
+            listing.discard(os.path.basename(path))
+
+    def forget(self, dir: str):
+        """Drop the listing for dir, e.g. once we are done saving to it."""
+        self.listings.pop(dir, None)
@@ -0,0 +1,132 @@
+from email.message import EmailMessage
+import logging
+import os
+import sqlite3
+
+from save_message.model import Config
+
+logger = logging.getLogger(__name__)
+
+# the headers held in the index; messages built from the index know the
+# values of these without touching the message file
+INDEXED_HEADERS = ["subject", "from", "to", "date", "message-id"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    maildir TEXT NOT NULL,
+    key TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    subject TEXT,
+    from_ TEXT,
+    to_ TEXT,
+    date TEXT,
+    date_epoch REAL,
+    message_id TEXT,
+    PRIMARY KEY (maildir, key)
+);
+"""
+
+
+def header_str(msg: EmailMessage, name: str) -> str | None:
+    value = msg[name]
+    return None if value is None else str(value)
+
+
+def header_epoch(msg: EmailMessage) -> float | None:
+    date = msg["date"]
+    dt = getattr(date, "datetime", None)
+    return None if dt is None else dt.timestamp()
+
+
+class HeaderIndex:
+    """A persistent SQLite index of the headers we match on, for every message
+    in every maildir.
+
+    Rows are keyed by maildir and the message's unique name (the part before
+    ':2,'), so they survive flag changes, and are considered current as long
+    as the file's size and mtime are unchanged. The index is only used if
+    `index` is set in the config."""
+
+    def __init__(self, config: Config):
+        self.config = config
+        self.conn = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.config.index is not None
+
+    def __connect__(self) -> sqlite3.Connection:
+        if self.conn is None:
+            path = os.path.expanduser(os.path.expandvars(self.config.index.path))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            # several processes may share the index (see --jobs), so every
+            # write is its own short transaction (cheap with WAL and
+            # synchronous=NORMAL), and we wait for locks rather than failing
+            self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.executescript(SCHEMA)
+
+        return self.conn
+
+    def get(self, maildir: str, key: str, size: int, mtime_ns: int) -> dict | None:
+        """Return the indexed headers for the message, as a dict of header
+        name -> value, or None if the message is not indexed or has changed
+        since it was indexed."""
+        row = (
+            self.__connect__()
+            .execute(
+                "SELECT size, mtime_ns, subject, from_, to_, date, message_id "
+                + "FROM messages WHERE maildir = ? AND key = ?",
+                (maildir, key),
+            )
+            .fetchone()
+        )
+
+        if row is None or row[0] != size or row[1] != mtime_ns:
+            return None
+
+        return dict(zip(INDEXED_HEADERS, row[2:]))
+
+    def put(self, maildir: str, key: str, size: int, mtime_ns: int, msg: EmailMessage):
+        self.__connect__().execute(
+            "INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                maildir,
+                key,
+                size,
+                mtime_ns,
+                header_str(msg, "subject"),
+                header_str(msg, "from"),
+                header_str(msg, "to"),
+                header_str(msg, "date"),
+                header_epoch(msg),
+                header_str(msg, "message-id"),
+            ),
+        )
+
+    def remove(self, maildir: str, key: str):
+        self.__connect__().execute(
+            "DELETE FROM messages WHERE maildir = ? AND key = ?", (maildir, key)
+        )
+
+    def begin_scan(self, maildir: str):
+        """Start tracking the keys seen in a full scan of maildir, so that
+        end_scan() can drop rows for messages that no longer exist. Seen keys
+        are kept in a temporary table rather than in memory."""
+        conn = self.__connect__()
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS seen (key TEXT PRIMARY KEY)")
+        conn.execute("DELETE FROM seen")
+
+    def seen(self, key: str):
+        self.__connect__().execute("INSERT OR IGNORE INTO seen VALUES (?)", (key,))
+
+    def end_scan(self, maildir: str):
+        cursor = self.__connect__().execute(
+            "DELETE FROM messages WHERE maildir = ? "
+            + "AND key NOT IN (SELECT key FROM seen)",
+            (maildir,),
+        )
+        logger.debug("pruned %d stale index entries for %s", cursor.rowcount, maildir)
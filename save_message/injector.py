@@ -2,6 +2,7 @@ import logging
 import pinject
 
 from save_message.config import load_config
+from save_message.pdf import PdfConverter
 
 
 logger = logging.getLogger(__name__)
@@ -15,3 +16,7 @@ class SaveMessageBindingSpec(pinject.BindingSpec):
     def configure(self, bind):
         bind("config", to_instance=self.config)
         bind("args", to_instance=self.args)
+
+        # one converter for the whole run, so apply-rules can wait on every
+        # conversion queued while saving
+        bind("pdf_converter", to_class=PdfConverter, in_scope=pinject.SINGLETON)
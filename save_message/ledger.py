@@ -0,0 +1,133 @@
+from email.message import EmailMessage
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+
+from save_message.model import Config
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS saved (
+    message_key TEXT NOT NULL,
+    save_path TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    dest TEXT NOT NULL,
+    body_filename TEXT,
+    attachment_filenames TEXT NOT NULL,
+    saved_at REAL NOT NULL,
+    PRIMARY KEY (message_key, save_path, content_hash)
+);
+"""
+
+HASH_BUFFER_SIZE = 1024 * 1024
+
+
+def content_hash(msg: EmailMessage) -> str:
+    """Return a hash of a message's content (the message file as is, if it
+    came from one)."""
+    digest = hashlib.sha256()
+    path = getattr(msg, "path", None)
+
+    if path is not None:
+        with open(path, "rb") as f:
+            while chunk := f.read(HASH_BUFFER_SIZE):
+                digest.update(chunk)
+
+    else:
+        digest.update(msg.as_bytes())
+
+    return digest.hexdigest()
+
+
+def ledger_key(msg: EmailMessage, message_hash: str | None = None) -> str:
+    """Return the key a message is recorded under in the ledger: its
+    Message-ID, or for a message without one, its content_hash() (which is
+    worked out unless given as message_hash)."""
+    message_id = msg["message-id"]
+    if message_id is not None and str(message_id).strip():
+        return "message-id:" + str(message_id).strip()
+
+    return "sha256:" + (message_hash or content_hash(msg))
+
+
+class SaveLedger:
+    """A persistent SQLite record of the messages we have saved, and where,
+    so that saving a message again (e.g. on re-running apply-rules after a
+    crash, or over messages kept by a KEEP rule) can be skipped.
+
+    Rows are keyed by ledger_key() and the save path the message was saved
+    under, so a message is saved again if a rule's path changes. Each row
+    also records the message's content_hash(), and only counts for a message
+    with the same content, as some senders reuse Message-IDs for different
+    messages. A row only counts while the directory (or flattened file) it
+    records still exists. The ledger is only used if `ledger` is set in the
+    config."""
+
+    def __init__(self, config: Config):
+        self.config = config
+        self.conn = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.config.ledger is not None
+
+    def __connect__(self) -> sqlite3.Connection:
+        if self.conn is None:
+            path = os.path.expanduser(os.path.expandvars(self.config.ledger.path))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            # as for HeaderIndex, worker processes (see --jobs) share the
+            # ledger, so use WAL and autocommit, and wait on locks
+            self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.executescript(SCHEMA)
+
+        return self.conn
+
+    def get(
+        self, message_key: str, save_path: str, content_hash: str
+    ) -> tuple[str | None, list[str]] | None:
+        """Return ( body_filename, attachment_filenames ) as recorded when
+        the message was saved under save_path, or None if it has not been
+        saved there (or what was saved has since gone)."""
+        row = (
+            self.__connect__()
+            .execute(
+                "SELECT dest, body_filename, attachment_filenames FROM saved "
+                + "WHERE message_key = ? AND save_path = ? AND content_hash = ?",
+                (message_key, save_path, content_hash),
+            )
+            .fetchone()
+        )
+
+        if row is None or not os.path.exists(row[0]):
+            return None
+
+        return row[1], json.loads(row[2])
+
+    def put(
+        self,
+        message_key: str,
+        save_path: str,
+        content_hash: str,
+        dest: str,
+        body_filename: str | None,
+        attachment_filenames: list[str],
+    ):
+        self.__connect__().execute(
+            "INSERT OR REPLACE INTO saved VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                message_key,
+                save_path,
+                content_hash,
+                dest,
+                body_filename,
+                json.dumps(attachment_filenames),
+                time.time(),
+            ),
+        )
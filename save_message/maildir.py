@@ -4,15 +4,27 @@ from email import message_from_string
 from email.message import EmailMessage
 from email import message_from_binary_file
 from email.policy import default
+import errno
 import logging
 import mailbox
+import os
+import shutil
 from mailbox import MaildirMessage
+from typing import Callable
 from typing import Generator
+from typing import Iterable
 
+from save_message.fileops import LINK_UNSUPPORTED_ERRNOS
+from save_message.fileops import copy_file_contents
+from save_message.index import HeaderIndex
+from save_message.matchers import AndMatcher
+from save_message.matchers import DateRangeMatcher
 from save_message.matchers import rule_matches_to_matcher
+from save_message.message import LazyEmailMessage
 from save_message.model import Config
 from save_message.model import MessageAction
 from save_message.model import RuleMatch
+from save_message.model import SaveRule
 from save_message.rules import RulesMatcher
 from save_message.actions.actions import MessageActions
 
@@ -25,6 +37,51 @@ def make_EmailMessage(f):
     return message_from_binary_file(f, policy=default)
 
 
+def file_into_maildir(path: str, dest_maildir: str, move: bool) -> str:
+    """Move or copy the message file at path into the maildir dest_maildir
+    (creating it if needed), keeping its name, and so its unique name and
+    flags, and whether it is in new/ or cur/. Returns the new path.
+
+    The file itself is never rewritten: a move is a rename and a copy is a
+    hard link, unless dest_maildir is on another filesystem (or doesn't
+    support hard links), in which case the bytes are copied into tmp/ (see
+    copy_file_contents()) and renamed into place, as for any maildir
+    delivery.
+
+    Raises FileExistsError if the message is already in dest_maildir."""
+    subdir = os.path.basename(os.path.dirname(path))
+    name = os.path.basename(path)
+
+    for d in ["tmp", "new", "cur"]:
+        os.makedirs(os.path.join(dest_maildir, d), exist_ok=True)
+
+    dest_path = os.path.join(dest_maildir, subdir, name)
+    if os.path.exists(dest_path):
+        raise FileExistsError(errno.EEXIST, "message already exists", dest_path)
+
+    try:
+        if move:
+            os.rename(path, dest_path)
+        else:
+            os.link(path, dest_path)
+
+        return dest_path
+
+    except OSError as ex:
+        if ex.errno not in LINK_UNSUPPORTED_ERRNOS:
+            raise
+
+    temp_path = os.path.join(dest_maildir, "tmp", name)
+    copy_file_contents(path, temp_path)
+    shutil.copystat(path, temp_path)  # keep the mtime, i.e. delivery time
+    os.rename(temp_path, dest_path)
+
+    if move:
+        os.remove(path)
+
+    return dest_path
+
+
 class Maildir:
     def __init__(
         self,
@@ -32,10 +89,18 @@ class Maildir:
         args: Namespace,
         rules_matcher: RulesMatcher,
         message_actions: MessageActions,
+        header_index: HeaderIndex | None = None,
+        trust_delivery_time: bool = False,
     ):
+        self.path = os.path.abspath(os.path.expanduser(path))
         self.args = args
         self.rules_matcher = rules_matcher
         self.message_actions = message_actions
+        self.header_index = header_index
+        self.trust_delivery_time = trust_delivery_time
+
+        # keys of messages delete() was asked to delete, but did not
+        self.skipped_deletes: set[str] = set()
 
         self.maildir = mailbox.Maildir(
             dirname=path, create=False, factory=make_EmailMessage
@@ -44,26 +109,149 @@ class Maildir:
     def get(self, key: str):
         return self.maildir.get(key)
 
-    def delete(self, key: str, force: bool = False):
-        if force or self.args.force_deletes:
+    def get_path(self, key: str) -> str:
+        # mailbox.Maildir has no public API for this, but its table of contents
+        # already maps each key to the message's path relative to the maildir
+        return os.path.join(self.maildir._path, self.maildir._lookup(key))
+
+    def scan(self) -> Generator[tuple[str, os.DirEntry], None, None]:
+        """Yield (key, directory entry) for each message in new/ and then
+        cur/, as the directories are read.
+
+        Unlike mailbox.Maildir's iterkeys(), nothing is collected up front
+        (mailbox.Maildir lists both directories into a table of contents
+        before yielding the first key), so the first messages are available
+        straight away, memory use does not grow with the size of the maildir,
+        and stopping early saves reading the rest of it."""
+        for subdir in ["new", "cur"]:
+            with os.scandir(os.path.join(self.path, subdir)) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        continue
+
+                    yield entry.name.split(self.maildir.colon)[0], entry
+
+    def keys(self) -> Generator[str, None, None]:
+        return (key for key, _ in self.scan())
+
+    def get_dir_mtimes(self) -> dict[str, int]:
+        return {
+            subdir: os.stat(os.path.join(self.path, subdir)).st_mtime_ns
+            for subdir in ["new", "cur"]
+        }
+
+    def get_headers(
+        self, key: str, entry: os.DirEntry | None = None
+    ) -> LazyEmailMessage:
+        """Return the message with the given key, with only its headers
+        parsed. If the header index is enabled, headers are taken from the
+        index where the message is unchanged since it was indexed. entry, if
+        given, is the message's entry from scan(), which saves looking up
+        the message's path (and, on most platforms, a stat() call)."""
+        path = self.get_path(key) if entry is None else entry.path
+
+        if self.header_index is None:
+            return LazyEmailMessage(path, trust_delivery_time=self.trust_delivery_time)
+
+        st = os.stat(path) if entry is None else entry.stat()
+        headers = self.header_index.get(self.path, key, st.st_size, st.st_mtime_ns)
+
+        if headers is not None:
+            return LazyEmailMessage(
+                path, headers=headers, trust_delivery_time=self.trust_delivery_time
+            )
+
+        msg = LazyEmailMessage(path, trust_delivery_time=self.trust_delivery_time)
+        self.header_index.put(self.path, key, st.st_size, st.st_mtime_ns, msg)
+        return msg
+
+    def __remove__(self, key: str, msg: EmailMessage | None = None):
+        # messages from search() know their path, which saves looking it up
+        path = getattr(msg, "path", None)
+
+        if path is None:
             self.maildir.remove(key)
+        else:
+            os.remove(path)
+
+        if self.header_index is not None:
+            self.header_index.remove(self.path, key)
+
+    def delete(
+        self, key: str, force: bool = False, msg: EmailMessage | None = None
+    ) -> bool:
+        """Delete the message, asking first unless force or --force-deletes
+        is set. msg, if given, is the already-loaded message, used to
+        describe it when asking. Returns True if the message was deleted;
+        keys of messages that were not are added to skipped_deletes."""
+        if force or self.args.force_deletes:
+            self.__remove__(key, msg)
+            return True
 
         else:
-            msg = self.get(key)
+            if msg is None:
+                msg = self.get(key)
 
             print()
             print(msg["date"], msg["from"], msg["subject"])
-            response = input("Really delete this message? (type YES to proceed) ")
+
+            try:
+                response = input("Really delete this message? (type YES to proceed) ")
+            except EOFError:
+                # no terminal to ask on (apply-rules refuses to run --jobs
+                # workers, which have none, if they would need to ask)
+                response = None
+
             print()
 
             if response == "YES":
-                self.maildir.remove(key)
+                self.__remove__(key, msg)
                 print("  deleted")
-            else:
-                print("  skipped delete")
+                return True
+
+            print("  skipped delete")
+            self.skipped_deletes.add(key)
+            return False
+
+    def move(self, key: str, dest_maildir: str, msg: EmailMessage | None = None):
+        """Move the message into dest_maildir, as is (see
+        file_into_maildir())."""
+        path = getattr(msg, "path", None) or self.get_path(key)
+        file_into_maildir(path, dest_maildir, move=True)
+
+        if self.header_index is not None:
+            self.header_index.remove(self.path, key)
 
-    def apply_rules(self, key):
-        self.message_actions.apply_rules(self, key)
+    def copy(self, key: str, dest_maildir: str, msg: EmailMessage | None = None):
+        """Copy the message into dest_maildir, as is (see file_into_maildir()).
+        Messages already copied there are left alone."""
+        path = getattr(msg, "path", None) or self.get_path(key)
+
+        try:
+            file_into_maildir(path, dest_maildir, move=False)
+        except FileExistsError:
+            logger.debug("%s already in %s", key, dest_maildir)
+
+    def apply_rules(
+        self,
+        key: str,
+        msg: EmailMessage | None = None,
+        on_failed: Callable[[Exception], None] | None = None,
+    ):
+        """Match the message to a rule and perform its action. msg, if given,
+        should be the message as returned by search(), which saves reading
+        and parsing it again. on_failed, if given, lets the action finish in
+        the background (see RuleAction.perform_action())."""
+        self.message_actions.apply_rules(self, key, msg, on_failed=on_failed)
+
+    def apply_rule(
+        self,
+        key: str,
+        msg: EmailMessage,
+        rule: SaveRule,
+        on_failed: Callable[[Exception], None] | None = None,
+    ):
+        self.message_actions.apply_rule(self, key, msg, rule, on_failed=on_failed)
 
     def search(
         self,
@@ -71,8 +259,27 @@ class Maildir:
         from_: str | None = None,
         to: str | None = None,
         date: datetime | None = None,
+        skip_keys: set[str] | None = None,
+        keys: Iterable[str] | None = None,
+        since: datetime | None = None,
+        until: datetime | None = None,
+        limit: int | None = None,
     ) -> Generator[MaildirMessage, None, None]:
+        """Yield (key, message) for messages matching all the given criteria.
+        Messages whose keys are in skip_keys are not read at all. If keys is
+        given, only those messages are searched, rather than the whole
+        maildir.
+
+        since and until limit the search to messages dated at or after since
+        and before until. If the maildir has trust_delivery_time set,
+        messages delivered well outside that range are skipped without being
+        opened (see MessageView.compare_date()).
+
+        The maildir is read as it is searched (see scan()), so the first
+        results are yielded straight away. If limit is given, the search
+        stops once that many messages have been found."""
         counter = 0
+        found = 0
 
         save_rule_matcher = rule_matches_to_matcher(
             [
@@ -85,10 +292,41 @@ class Maildir:
             ]
         )
 
-        for k, m in self.maildir.iteritems():
+        if since is not None or until is not None:
+            save_rule_matcher = AndMatcher(
+                [DateRangeMatcher(since=since, until=until), save_rule_matcher]
+            )
+
+        # only a scan of the whole maildir can tell the index which keys
+        # no longer exist
+        full_scan = self.header_index is not None and keys is None
+
+        if full_scan:
+            self.header_index.begin_scan(self.path)
+
+        entries = self.scan() if keys is None else ((k, None) for k in keys)
+
+        for k, entry in entries:
+            m = None
+
+            if full_scan:
+                self.header_index.seen(k)
+
+            if skip_keys and k in skip_keys:
+                continue
+
             try:
+                # nothing is parsed here; the headers (and then the body) are
+                # parsed when a matcher (or the caller) first needs them
+                m = self.get_headers(k, entry)
+
                 if save_rule_matcher.matches(m):
                     yield (k, m)
+                    found += 1
+
+                    if limit is not None and found >= limit:
+                        # not a full scan, so leave the index as it is
+                        return
 
                 counter += 1
 
@@ -96,6 +334,10 @@ class Maildir:
                     logger.debug("scanned %d messages", counter)
 
             except Exception as ex:
+                if m is None or isinstance(ex, OSError):
+                    logger.error("error reading message: key=%s ex='%s'", k, ex)
+                    continue
+
                 logger.error(
                     "error processing message: type=%s date='%s' "
                     + "from='%s' to='%s' subject='%s' ex='%s'",
@@ -109,6 +351,10 @@ class Maildir:
 
                 # raise ex
 
+        if full_scan:
+            # we saw every key, so can drop index entries for any others
+            self.header_index.end_scan(self.path)
+
 
 class Maildirs:
     def __init__(
@@ -117,11 +363,13 @@ class Maildirs:
         args: Namespace,
         rules_matcher: RulesMatcher,
         message_actions: MessageActions,
+        header_index: HeaderIndex,
     ):
         self.config = config
         self.args = args
         self.rules_matcher = rules_matcher
         self.message_actions = message_actions
+        self.header_index = header_index if header_index.enabled else None
 
     def get_maildirs(self) -> list[Maildir]:
         return [
@@ -130,6 +378,8 @@ class Maildirs:
                 args=self.args,
                 rules_matcher=self.rules_matcher,
                 message_actions=self.message_actions,
+                header_index=self.header_index,
+                trust_delivery_time=m.trust_delivery_time,
             )
             for m in self.config.maildirs
         ]
@@ -1,14 +1,15 @@
 from datetime import datetime
 from datetime import timedelta
-from dateutil.parser import parse
 from email.header import Header
 from email.message import EmailMessage
-from email.utils import parseaddr
 from mailbox import MaildirMessage
 import pudb
 import re
 import pytimeparse
 
+from save_message.dates import now
+from save_message.dates import parse_date
+from save_message.message import MessageView
 from save_message.model import RuleMatch
 
 
@@ -21,6 +22,10 @@ def replace_all_items(s: str, replacements: dict) -> str:
 
 
 class Matcher:
+    # a rough relative cost of calling matches(), so that conjunctions can
+    # run their cheapest matchers first (see order_by_cost())
+    cost = 1
+
     def matches(self, msg: MaildirMessage) -> bool:
         pass
 
@@ -98,19 +103,23 @@ class WildcardMatcher(Matcher):
 
 
 class SubjectMatcher(WildcardMatcher):
+    # one regex match against an already-decoded header
+    cost = 1
+
     def __init__(self, match_subject):
-        super().__init__(
-            match_subject,
-            replacements={
-                "\n.*": "",  # strip newlines
-            },
-        )
+        # no replacements needed, as MessageView.subject already strips
+        # everything after the first newline
+        super().__init__(match_subject)
 
     def __repr__(self):
         return f"SubjectMatcher(to={self.match_criteria})"
 
+    @staticmethod
+    def field_values(view: MessageView) -> tuple:
+        return (view.subject,)
+
     def matches(self, msg: MaildirMessage) -> bool:
-        return self.__matches_value__(msg["subject"])
+        return self.__matches_value__(MessageView.of(msg).subject)
 
     def __eq__(self, other) -> bool:
         return (
@@ -121,6 +130,9 @@ class SubjectMatcher(WildcardMatcher):
 
 
 class BodyMatcher(WildcardMatcher):
+    # loading, walking and decoding the whole message body on first use
+    cost = 100
+
     def __init__(self, match_body: str):
         super().__init__(
             match_body,
@@ -132,24 +144,9 @@ class BodyMatcher(WildcardMatcher):
         return f"BodyMatcher(to={self.match_criteria})"
 
     def matches(self, msg: EmailMessage) -> bool:
-        # First collate the 'body parts', i.e. non-attachments, which
-        # make up the body of the messge. We aim to save only one of
-        # these
-        body_parts = {
-            x.get_content_type(): x
-            for x in filter(lambda x: not x.is_attachment(), msg.walk())
-        }
-
-        # lifted from save.MessageSaver/MessagePartSaver
-        for preferred_content_type in ["text/html", "text/plain"]:
-            if preferred_content_type in body_parts.keys():
-                part = body_parts[preferred_content_type]
-
-                payload = part.get_payload(decode=True)
-                return self.__matches_value__(payload.decode())
-
-        # if we get here, no payloads  matched our desired mime types, so no match
-        return False
+        # if there is no body in our desired mime types, body_text is None, so
+        # no match
+        return self.__matches_value__(MessageView.of(msg).body_text)
 
     def __eq__(self, other) -> bool:
         return (
@@ -160,16 +157,25 @@ class BodyMatcher(WildcardMatcher):
 
 
 class FromMatcher(WildcardMatcher):
+    # parseaddr() on first use, then up to two regex matches
+    cost = 2
+
     def __init__(self, match_from):
         super().__init__(match_from)
 
     def __repr__(self):
         return f"FromMatcher(to={self.match_criteria})"
 
+    @staticmethod
+    def field_values(view: MessageView) -> tuple:
+        """The values we match against: the bare address, then the header
+        as written (e.g. 'Name <address>')."""
+        return (view.from_parts[1], view["from"])
+
     def matches(self, msg: MaildirMessage) -> bool:
-        from_parts = parseaddr(msg["from"])
-        return self.__matches_value__(from_parts[1]) or self.__matches_value__(
-            msg["from"]
+        view = MessageView.of(msg)
+        return self.__matches_value__(view.from_parts[1]) or self.__matches_value__(
+            view["from"]
         )
 
     def __eq__(self, other) -> bool:
@@ -181,15 +187,26 @@ class FromMatcher(WildcardMatcher):
 
 
 class ToMatcher(WildcardMatcher):
+    # parseaddr() on first use, then up to two regex matches
+    cost = 2
+
     def __init__(self, match_to):
         super().__init__(match_to)
 
     def __repr__(self):
         return f"ToMatcher(to={self.match_criteria})"
 
+    @staticmethod
+    def field_values(view: MessageView) -> tuple:
+        """The values we match against: the bare address, then the header
+        as written (e.g. 'Name <address>')."""
+        return (view.to_parts[1], view["to"])
+
     def matches(self, msg: MaildirMessage) -> bool:
-        to_parts = parseaddr(msg["to"])
-        return self.__matches_value__(to_parts[1]) or self.__matches_value__(msg["to"])
+        view = MessageView.of(msg)
+        return self.__matches_value__(view.to_parts[1]) or self.__matches_value__(
+            view["to"]
+        )
 
     def __eq__(self, other) -> bool:
         return (
@@ -200,19 +217,20 @@ class ToMatcher(WildcardMatcher):
 
 
 class DateMatcher(Matcher):
+    # parsing the Date header on first use
+    cost = 5
+
     def __init__(self, match_date: datetime):
         if isinstance(match_date, datetime):
             self.match_date = match_date
         else:
-            self.match_date = parse(match_date)
+            self.match_date = parse_date(match_date)
 
     def __repr__(self):
         return f"DateMatcher(match_date={self.match_date})"
 
     def matches(self, msg: MaildirMessage) -> bool:
-        msg_date = parse(msg["date"])
-
-        return self.match_date == msg_date
+        return self.match_date == MessageView.of(msg).date
 
     def __eq__(self, other) -> bool:
         return (
@@ -223,19 +241,21 @@ class DateMatcher(Matcher):
 
 
 class AgeMatcher(Matcher):
+    # often decided from the file name (see MessageView.compare_date());
+    # otherwise as for DateMatcher
+    cost = 1
+
     def __init__(self, spec: str):
-        print(spec, pytimeparse.parse(spec))
-        self.match_date = datetime.now() - timedelta(seconds=pytimeparse.parse(spec))
+        self.match_date = now() - timedelta(seconds=pytimeparse.parse(spec))
 
     def __repr__(self):
         return f"AgeMatcher(match_date={self.match_date})"
 
     def matches(self, msg: MaildirMessage) -> bool:
-        msg_date = parse(msg["date"])
-
-        # need to compare timestamps, otherwise we get
-        # "can't compare offset-aware and offset-naive datetimes"
-        return self.match_date.timestamp() >= msg_date.timestamp()
+        # compare_date() compares timestamps, so we don't get "can't compare
+        # offset-aware and offset-naive datetimes"; it can often tell from
+        # the message's delivery time alone
+        return MessageView.of(msg).compare_date(self.match_date) <= 0
 
     def __eq__(self, other) -> bool:
         return (
@@ -245,6 +265,36 @@ class AgeMatcher(Matcher):
         )
 
 
+class DateRangeMatcher(Matcher):
+    # often decided from the file name (see MessageView.compare_date());
+    # otherwise as for DateMatcher
+    cost = 1
+
+    def __init__(self, since: datetime | None = None, until: datetime | None = None):
+        """Matches messages dated at or after since, and before until (either
+        may be None)."""
+        self.since = since
+        self.until = until
+
+    def __repr__(self):
+        return f"DateRangeMatcher(since={self.since}, until={self.until})"
+
+    def matches(self, msg: MaildirMessage) -> bool:
+        view = MessageView.of(msg)
+
+        return (self.since is None or view.compare_date(self.since) >= 0) and (
+            self.until is None or view.compare_date(self.until) < 0
+        )
+
+    def __eq__(self, other) -> bool:
+        return (
+            other is not None
+            and type(other) is DateRangeMatcher
+            and other.since == self.since
+            and other.until == self.until
+        )
+
+
 class AndMatcher(Matcher):
     def __init__(
         self,
@@ -255,6 +305,14 @@ class AndMatcher(Matcher):
     def __repr__(self):
         return f"AndMatcher(matchers={self.matchers})"
 
+    @property
+    def cost(self):
+        return sum(m.cost for m in self.matchers)
+
+    def without(self, matcher: Matcher) -> "AndMatcher":
+        """Return a conjunction of the same kind over our other matchers."""
+        return type(self)([m for m in self.matchers if m is not matcher])
+
     def matches(self, msg):
         for matcher in self.matchers:
             if not matcher.matches(msg):
@@ -270,6 +328,66 @@ class AndMatcher(Matcher):
         )
 
 
+class AdaptiveAndMatcher(AndMatcher):
+    """An AndMatcher that also reorders its matchers as it goes.
+
+    Each matcher's rejection rate (how often it returns False when it is
+    evaluated) is counted. Every REORDER_EVERY calls, the matchers are
+    re-sorted by cost per rejection, so that a cheap matcher that rarely
+    rejects does not keep running ahead of a slightly dearer one that
+    rejects most messages."""
+
+    REORDER_EVERY = 100
+
+    def __init__(
+        self,
+        matchers: list[Matcher] = [],
+    ):
+        super().__init__(order_by_cost(matchers))
+
+        # [evaluated, rejected] for each of self.matchers, in the same order
+        self.stats = [[0, 0] for _ in self.matchers]
+        self.calls = 0
+
+    def __repr__(self):
+        return f"AdaptiveAndMatcher(matchers={self.matchers})"
+
+    def matches(self, msg):
+        result = True
+
+        for matcher, stats in zip(self.matchers, self.stats):
+            stats[0] += 1
+
+            if not matcher.matches(msg):
+                stats[1] += 1
+                result = False
+                break
+
+        self.calls += 1
+        if self.calls % self.REORDER_EVERY == 0:
+            self.__reorder__()
+
+        return result
+
+    def __reorder__(self):
+        def cost_per_rejection(item):
+            matcher, (evaluated, rejected) = item
+            # smoothed, so a matcher that has never been run (or never
+            # rejected anything) still gets a finite, sensible rank
+            return matcher.cost * (evaluated + 2) / (rejected + 1)
+
+        ordered = sorted(zip(self.matchers, self.stats), key=cost_per_rejection)
+        self.matchers = [matcher for matcher, _ in ordered]
+        self.stats = [stats for _, stats in ordered]
+
+    def __eq__(self, other) -> bool:
+        return (
+            other is not None
+            and type(other) is AdaptiveAndMatcher
+            and other.matchers == self.matchers
+        )
+
+
 class OrMatcher(Matcher):
     def __init__(
         self,
@@ -280,6 +398,10 @@ class OrMatcher(Matcher):
     def __repr__(self):
         return f"OrMatcher(matchers={self.matchers})"
 
+    @property
+    def cost(self):
+        return sum(m.cost for m in self.matchers)
+
     def matches(self, msg):
         for matcher in self.matchers:
             if matcher.matches(msg):
@@ -295,6 +417,24 @@ class OrMatcher(Matcher):
         )
 
 
+def is_time_dependent(matcher: Matcher) -> bool:
+    """Return True if matcher (or any matcher within it) is an AgeMatcher,
+    so that a message it doesn't match now may match later, as it ages."""
+    if isinstance(matcher, AgeMatcher):
+        return True
+
+    if isinstance(matcher, (AndMatcher, OrMatcher)):
+        return any(is_time_dependent(m) for m in matcher.matchers)
+
+    return False
+
+
+def order_by_cost(matchers: list[Matcher]) -> list[Matcher]:
+    """Return matchers sorted cheapest first. The sort is stable, so matchers
+    of equal cost keep the order they were given in."""
+    return sorted(matchers, key=lambda m: m.cost)
+
+
 def rule_matches_to_matcher(rule_matches: list[RuleMatch]) -> Matcher:
     """Creates a matcher that matches on the rules given in the
     list of RuleMatches. Each RuleMatch is treated as an OR, and
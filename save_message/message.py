@@ -0,0 +1,295 @@
+from datetime import datetime
+from email import message_from_binary_file
+from email.message import EmailMessage
+from email.parser import BytesParser
+from email.policy import default
+from email.utils import parseaddr
+from functools import cached_property
+import os
+import re
+
+from save_message.dates import parse_date
+
+# how far apart (in seconds) a message's Date header and its delivery to the
+# maildir are assumed to be, at most; messages delivered closer than this to
+# a date we're comparing with have their Date header checked
+DELIVERY_SLACK = 2 * 24 * 60 * 60
+
+
+def read_header_block(f) -> bytes:
+    """Read lines from the binary file f up to and including the blank line
+    that ends the header block, leaving the body unread."""
+    lines = []
+
+    for line in f:
+        lines.append(line)
+
+        if line in (b"\n", b"\r\n"):
+            break
+
+    return b"".join(lines)
+
+
+class LazyEmailMessage(EmailMessage):
+    """An EmailMessage backed by a file on disk, of which only the header
+    block is parsed, the first time a header is asked for.
+
+    The body (and the MIME tree beneath it) is parsed the first time something
+    asks for it, e.g. a BodyMatcher walking the message or a save action
+    writing it out. Matching on headers alone therefore never reads, or holds
+    in memory, the message's attachments.
+
+    If headers is given (a dict of header name -> value, e.g. from the
+    HeaderIndex), the file is not opened at all until a header not in that
+    dict, or the body, is needed.
+
+    trust_delivery_time is as for the message's maildir (see ConfigMaildir)."""
+
+    def __init__(
+        self,
+        path: str,
+        policy=default,
+        headers: dict | None = None,
+        trust_delivery_time: bool = False,
+    ):
+        super().__init__(policy=policy)
+        self.path = path
+        self._body_loaded = False
+
+        # whether the maildir delivery time may stand in for the Date header
+        # (see MessageView.compare_date())
+        self.trust_delivery_time = trust_delivery_time
+
+        # lower-cased names of the headers we were given, or None once the
+        # real header block has been parsed
+        self._known_headers = set()
+
+        if headers is not None:
+            for name, value in headers.items():
+                if value is not None:
+                    self[name] = value
+
+            self._known_headers = {name.lower() for name in headers}
+
+    def _load_headers(self):
+        with open(self.path, "rb") as f:
+            headers = BytesParser(policy=self.policy).parsebytes(
+                read_header_block(f), headersonly=True
+            )
+
+        self._headers = headers._headers
+        self._unixfrom = headers._unixfrom
+        self.defects = headers.defects
+        self._known_headers = None
+
+    def _ensure_header(self, name: str | None = None):
+        """Parse the real header block if we only know a subset of headers,
+        and name is not one of them (or is None, meaning all headers are
+        needed)."""
+        if self._known_headers is not None and (
+            name is None or name.lower() not in self._known_headers
+        ):
+            self._load_headers()
+
+    def _load_body(self):
+        if self._body_loaded:
+            return
+
+        with open(self.path, "rb") as f:
+            msg = message_from_binary_file(f, policy=self.policy)
+
+        # adopt the fully-parsed message's state wholesale; this re-reads the
+        # headers too, but guarantees they agree with the payload
+        self.__dict__.update(msg.__dict__)
+        self._known_headers = None
+        self._body_loaded = True
+
+    # Header access all funnels through these methods (__getitem__ uses
+    # get(), get_content_type() etc. use get() or get_all())
+
+    def get(self, name, failobj=None):
+        self._ensure_header(name)
+        return super().get(name, failobj)
+
+    def get_all(self, name, failobj=None):
+        self._ensure_header(name)
+        return super().get_all(name, failobj)
+
+    def __contains__(self, name):
+        self._ensure_header(name)
+        return super().__contains__(name)
+
+    def __len__(self):
+        self._ensure_header()
+        return super().__len__()
+
+    def __iter__(self):
+        self._ensure_header()
+        return super().__iter__()
+
+    def keys(self):
+        self._ensure_header()
+        return super().keys()
+
+    def values(self):
+        self._ensure_header()
+        return super().values()
+
+    def items(self):
+        self._ensure_header()
+        return super().items()
+
+    # Everything that reaches the payload goes through one of the methods
+    # below (walk(), iter_parts(), get_body() etc. are built on them), so
+    # these are the only places we need to trigger a full parse.
+
+    def is_multipart(self):
+        self._load_body()
+        return super().is_multipart()
+
+    def get_payload(self, *args, **kwargs):
+        self._load_body()
+        return super().get_payload(*args, **kwargs)
+
+    def set_payload(self, *args, **kwargs):
+        self._load_body()
+        return super().set_payload(*args, **kwargs)
+
+    def attach(self, *args, **kwargs):
+        self._load_body()
+        return super().attach(*args, **kwargs)
+
+    def as_string(self, *args, **kwargs):
+        self._load_body()
+        return super().as_string(*args, **kwargs)
+
+    def as_bytes(self, *args, **kwargs):
+        self._load_body()
+        return super().as_bytes(*args, **kwargs)
+
+
+def maildir_delivery_time(path: str) -> float | None:
+    """Return when the maildir message at path was delivered, as a Unix
+    timestamp: the time at the start of its unique name (see
+    https://cr.yp.to/proto/maildir.html), or failing that its mtime. Returns
+    None if neither is available."""
+    name = os.path.basename(path)
+    epoch = name[: name.find(".")]
+
+    if epoch.isdigit():
+        return float(epoch)
+
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+class MessageView:
+    """Fields derived from a message (parsed addresses, normalised subject,
+    parsed date, decoded body text), each computed the first time it is asked
+    for and then remembered.
+
+    Use MessageView.of(msg) to get the view for a message: the view is stored
+    on the message, so every matcher (and anything else) looking at the same
+    message shares the same view, and each derivation is paid for once."""
+
+    def __init__(self, msg: EmailMessage):
+        self.msg = msg
+
+    def __repr__(self):
+        return f"MessageView(msg={self.msg!r})"
+
+    @classmethod
+    def of(cls, msg) -> "MessageView":
+        if isinstance(msg, MessageView):
+            return msg
+
+        view = getattr(msg, "_message_view", None)
+
+        if not isinstance(view, MessageView):
+            view = cls(msg)
+
+            try:
+                msg._message_view = view
+            except AttributeError:
+                pass  # e.g. a plain dict; the view just won't be shared
+
+        return view
+
+    def __getitem__(self, name):
+        return self.msg[name]
+
+    @cached_property
+    def subject(self) -> str | None:
+        """The subject, up to the first newline (some senders, e.g. AWS,
+        include newlines in subjects)."""
+        subject = self.msg["subject"]
+        return None if subject is None else re.sub("\n.*", "", str(subject))
+
+    @cached_property
+    def from_parts(self) -> tuple[str, str]:
+        """(name, address) from the From header, as per parseaddr()."""
+        return parseaddr(self.msg["from"])
+
+    @cached_property
+    def to_parts(self) -> tuple[str, str]:
+        """(name, address) from the To header, as per parseaddr()."""
+        return parseaddr(self.msg["to"])
+
+    @cached_property
+    def date(self) -> datetime:
+        return parse_date(self.msg["date"])
+
+    @cached_property
+    def delivery_time(self) -> float | None:
+        """When the message was delivered to its maildir (see
+        maildir_delivery_time()), or None if it is not a maildir message, or
+        its maildir's delivery times are not to be trusted."""
+        path = getattr(self.msg, "path", None)
+
+        if path is None or not getattr(self.msg, "trust_delivery_time", False):
+            return None
+
+        return maildir_delivery_time(path)
+
+    def compare_date(self, when: datetime) -> int:
+        """Compare the message's date with when, returning a negative number,
+        zero or a positive number as it is earlier, the same or later.
+
+        If the message's maildir has trust_delivery_time set, its Date header
+        is assumed to be within DELIVERY_SLACK of its delivery time, so if
+        the delivery time is further than that from when, the answer comes
+        from it alone, without reading the message (or even its headers).
+        That does not hold for messages synced or imported into a maildir,
+        whose files are named for when that happened."""
+        when = when.timestamp()
+
+        if self.delivery_time is not None:
+            if self.delivery_time > when + DELIVERY_SLACK:
+                return 1
+            if self.delivery_time < when - DELIVERY_SLACK:
+                return -1
+
+        date = self.date.timestamp()
+        return (date > when) - (date < when)
+
+    @cached_property
+    def body_text(self) -> str | None:
+        """The decoded text of the message body, preferring HTML over plain
+        text, or None if there is no body in either format."""
+        # First collate the 'body parts', i.e. non-attachments, which
+        # make up the body of the message
+        body_parts = {
+            x.get_content_type(): x
+            for x in filter(lambda x: not x.is_attachment(), self.msg.walk())
+        }
+
+        # lifted from save.MessageSaver/MessagePartSaver
+        for preferred_content_type in ["text/html", "text/plain"]:
+            if preferred_content_type in body_parts.keys():
+                part = body_parts[preferred_content_type]
+
+                return part.get_payload(decode=True).decode()
+
+        return None
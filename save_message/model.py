@@ -99,13 +99,33 @@ class MessageAction(str, Enum):
     # save_and_delete  (save, delete from inbox)
     SAVE_AND_DELETE = "SAVE_AND_DELETE"
 
+    # move  (file the message, as is, into another maildir)
+    MOVE = "MOVE"
+
+    # copy  (file a copy of the message, as is, into another maildir; leave
+    # it in inbox)
+    COPY = "COPY"
+
+
+class DedupeLink(str, Enum):
+    # hardlink  (saved attachments are hard links to the stored copy)
+    HARDLINK = "HARDLINK"
+
+    # symlink  (saved attachments are relative symlinks to the stored copy)
+    SYMLINK = "SYMLINK"
+
 
 class RuleSaveSettings(BaseModel):
     class Config:
         extra = "forbid"
 
     # The location to save the message to, which should be a folder. Environment
-    # variables can be used here. The location must already exist.
+    # variables can be used here. The location must already exist. Any of the
+    # message_name fields can also be used (e.g. '~/Mail/{year}/{month}'), to
+    # save each message under folders named for it, which are created as
+    # needed. Each field gives one folder name at most: path separators in
+    # its value are replaced, and an empty value, '.' or '..' becomes
+    # 'unknown'.
     path: str = None
 
     # If True, save full messages (as .eml files) in addition to
@@ -119,6 +139,11 @@ class RuleSaveSettings(BaseModel):
     # and last characters are forward-slashes, a regex.
     save_attachments: str | None = "*"
 
+    # If set, store each distinct attachment once, in a content-addressed
+    # store in '.attachments' under 'path', and save attachments as links
+    # (HARDLINK or SYMLINK) to the stored copy.
+    dedupe_attachments: DedupeLink | None = None
+
     # If set, this should be a command which reads an HTML file from the
     # path $in and writes a PDF to the path $out.
     html_pdf_transform_command: str | None = None
@@ -132,9 +157,16 @@ class RuleSaveSettings(BaseModel):
     # message's files are saved in, and the name of body-part files. If
     # flattening is enabled, this determines the name of the single file.
     # Available fields are {from_name}, {from_addr}, {to_name}, {to_addr},
-    #   {subject}, {month_year}, {date} (day, month, year)
+    #   {subject}, {month_year}, {date} (day, month, year), {year}, {month}
+    #   (01 to 12) and {sender_domain} (the domain of the From address, or
+    #   'unknown')
     message_name: str = "{from_name} {subject} {month_year}"
 
+    # If set, the most entries to save in any one folder. Messages are saved
+    # in numbered folders (0001, 0002, ...) under 'path', each filled in turn
+    # until it holds this many, so no folder grows without bound.
+    shard_size: int | None = None
+
 
 class RuleSettings(BaseModel):
     class Config:
@@ -150,6 +182,11 @@ class RuleSettings(BaseModel):
     # settings for saving (if action includes this)
     save_settings: RuleSaveSettings | None = None
 
+    # for MOVE and COPY actions, the maildir to file messages into.
+    # Environment variables can be used here. The maildir is created if it
+    # does not exist.
+    target_maildir: str | None = None
+
 
 class RuleMatch(BaseModel):
     class Config:
@@ -163,6 +200,10 @@ class RuleMatch(BaseModel):
     from_: str | None = None
     to: str | None = None
     date: str | None = None
+
+    # match messages older than this, e.g. '90d'. Ages are worked out from
+    # each message's Date header, or, in maildirs with trust_delivery_time
+    # set, from its delivery time where that is well away from the cutoff
     age: str | None = None
     body: str | None = None
 
@@ -225,6 +266,70 @@ class ConfigMaildir(BaseModel):
 
     path: str
 
+    # If true, assume each message was delivered to this maildir within two
+    # days of its Date header, so age and date comparisons (age rules,
+    # --since and --until) can often be made from the delivery time in the
+    # message's file name, without reading the message. Leave this off for
+    # maildirs filled by syncing or importing (e.g. mbsync or offlineimap),
+    # where files are named for when they were synced.
+    trust_delivery_time: bool = False
+
+
+class ConfigIndex(BaseModel):
+    class Config:
+        extra = "forbid"
+
+    # The location of the SQLite header index. Environment variables can be
+    # used here. The file (and its parent directory) is created if needed.
+    path: str = "~/.cache/save-message/index.sqlite"
+
+
+class ConfigState(BaseModel):
+    class Config:
+        extra = "forbid"
+
+    # The directory holding apply-rules state (one file per maildir), which
+    # records the messages already processed so that later runs can skip them.
+    # Environment variables can be used here.
+    path: str = "~/.cache/save-message/state"
+
+
+class ConfigPdfCache(BaseModel):
+    class Config:
+        extra = "forbid"
+
+    # The directory holding cached PDFs. Environment variables can be used
+    # here. The directory is created if needed.
+    path: str = "~/.cache/save-message/pdf"
+
+    # The size (in bytes) the cache may grow to before the least recently
+    # used PDFs are evicted
+    max_size: int = 1024 * 1024 * 1024
+
+
+class ConfigPdf(BaseModel):
+    class Config:
+        extra = "forbid"
+
+    # How many html_pdf_transform_command processes to run at once. During
+    # apply-rules, messages are converted in the background while later
+    # messages are processed, and a SAVE_AND_DELETE message is only deleted
+    # once its conversion has succeeded.
+    jobs: int = 4
+
+    # If set, keep a cache of converted PDFs, keyed by the HTML and
+    # html_pdf_transform_command, so identical HTML is only converted once
+    cache: ConfigPdfCache | None = None
+
+
+class ConfigLedger(BaseModel):
+    class Config:
+        extra = "forbid"
+
+    # The location of the SQLite save ledger. Environment variables can be
+    # used here. The file (and its parent directory) is created if needed.
+    path: str = "~/.cache/save-message/ledger.sqlite"
+
 
 class Config(BaseModel):
     class Config:
@@ -234,6 +339,24 @@ class Config(BaseModel):
 
     maildirs: list[ConfigMaildir] = []
 
+    # If set, keep an on-disk index of message headers, so that repeat scans
+    # of a maildir only need to parse new or changed messages
+    index: ConfigIndex | None = None
+
+    state: ConfigState = ConfigState()
+
+    # If set, record every message saved (by Message-ID, or a hash of the
+    # message if it has none) and where, so that messages already saved are
+    # not saved again
+    ledger: ConfigLedger | None = None
+
+    pdf: ConfigPdf = ConfigPdf()
+
+    # If true, the matchers within each rule are reordered as messages are
+    # matched, according to how often each one rejects a message, rather than
+    # only by their fixed cost estimates
+    adaptive_match_ordering: bool = False
+
     body: ConfigBody = None
 
     save_rules: List[SaveRule] = []
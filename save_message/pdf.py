@@ -0,0 +1,324 @@
+from concurrent.futures import Future
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+import contextlib
+import hashlib
+import logging
+import os
+import shlex
+import shutil
+import subprocess
+import threading
+from typing import Callable
+from typing import Iterable
+
+from save_message.fileops import copy_file_contents
+from save_message.model import Config
+
+logger = logging.getLogger(__name__)
+
+# how many conversions may be queued per converter process before submit()
+# waits for some to finish, which bounds the HTML waiting in temp files
+QUEUED_PER_JOB = 4
+
+# when the PDF cache grows past its max_size, evict down to this fraction of
+# it, so that eviction (which lists the whole cache) isn't needed every time
+EVICT_TO = 0.9
+
+
+def pdf_cache_key(html_pdf_transform_command: str, html: Iterable[bytes]) -> str:
+    """Return the PdfCache key for converting html (given as chunks) with
+    html_pdf_transform_command."""
+    digest = hashlib.sha256(html_pdf_transform_command.encode() + b"\0")
+
+    for chunk in html:
+        digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def run_html_pdf_transform_command(
+    html_pdf_transform_command: str, input_filename: str, dest_path: str
+):
+    subprocess.run(
+        shlex.split(
+            html_pdf_transform_command.replace("$in", f'"{input_filename}"').replace(
+                "$out", f'"{dest_path}"'
+            )
+        ),
+        check=True,
+    )
+
+
+def copy_result(converted: Future, src_path: str, dest_path: str, future: Future):
+    """Complete future with the outcome of copying the PDF made by converted
+    (a finished conversion) from src_path to dest_path."""
+    try:
+        if converted.exception() is not None:
+            raise converted.exception()
+
+        copy_file_contents(src_path, dest_path)
+        future.set_result(None)
+
+    except Exception as ex:
+        future.set_exception(ex)
+
+
+class PdfCache:
+    """A local cache of converted PDFs, keyed by pdf_cache_key(), i.e. by the
+    HTML and the command that converted it, so that byte-identical HTML
+    (newsletters, notifications, or everything on a rerun) is only converted
+    once.
+
+    Hits are copied to the destination (see copy_file_contents()) and touch
+    the cached file's mtime; once the cache grows past max_size, the least
+    recently used files are evicted. Saved PDFs are copies rather than hard
+    links, so touching the cache never touches saved files. The cache is
+    only used if pdf.cache is set in the config."""
+
+    def __init__(self, config: Config):
+        self.config = config
+        self.lock = threading.Lock()
+
+        # the total size of the cached files, once known
+        self.size: int | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.config.pdf.cache is not None
+
+    @property
+    def cache_dir(self) -> str:
+        return os.path.expanduser(os.path.expandvars(self.config.pdf.cache.path))
+
+    def __path__(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.pdf")
+
+    def fetch(self, key: str, dest_path: str) -> bool:
+        """Copy the cached PDF for key to dest_path, returning False if there
+        isn't one."""
+        path = self.__path__(key)
+
+        try:
+            # touch first, so a concurrent eviction can't leave us with a
+            # half-copied file
+            os.utime(path)
+            copy_file_contents(path, dest_path)
+
+        except FileNotFoundError:
+            return False
+
+        logger.debug("PDF cache hit for %s", os.path.basename(dest_path))
+        return True
+
+    def store(self, key: str, pdf_path: str):
+        """Copy the PDF at pdf_path into the cache under key, evicting older
+        PDFs if the cache is now too big."""
+        path = self.__path__(key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        copy_file_contents(pdf_path, temp_path)
+        os.replace(temp_path, path)
+
+        with self.lock:
+            if self.size is None:
+                self.size = sum(size for _, size, _ in self.__entries__())
+            else:
+                self.size += os.stat(path).st_size
+
+            if self.size > self.config.pdf.cache.max_size:
+                self.__evict__()
+
+    def __entries__(self) -> list[tuple[float, int, str]]:
+        """Return (mtime, size, path) for each cached PDF."""
+        entries = []
+
+        for root, _, filenames in os.walk(self.cache_dir):
+            for filename in filenames:
+                if not filename.endswith(".pdf"):
+                    continue
+
+                path = os.path.join(root, filename)
+
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue  # evicted by another process
+
+                entries.append((st.st_mtime, st.st_size, path))
+
+        return entries
+
+    def __evict__(self):
+        entries = sorted(self.__entries__())
+        self.size = sum(size for _, size, _ in entries)
+        target = self.config.pdf.cache.max_size * EVICT_TO
+
+        for _, size, path in entries:
+            if self.size <= target:
+                break
+
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+
+            self.size -= size
+
+        logger.debug("evicted PDF cache down to %d bytes", self.size)
+
+
+class PdfConverter:
+    """Runs html_pdf_transform_command conversions on a pool of pdf.jobs
+    threads, each of which waits on one converter process at a time, so that
+    the caller can carry on with other messages while conversions run.
+
+    Each conversion's on_done callback is called with None (on success) or
+    the exception, on the thread that calls poll() or wait(), never on a pool
+    thread; callbacks are free to touch maildirs or prompt the user, but must
+    not raise.
+
+    Conversions given a cache_key (see pdf_cache_key()) are looked up in, and
+    added to, the PdfCache; hits are copied into place without running the
+    command (or using a pool thread). A conversion with the same key as one
+    still running is not run either, but copies that one's PDF (in poll(),
+    before that one is reported), so identical HTML in one run is only converted once even if the
+    cache is not enabled."""
+
+    def __init__(self, config: Config, pdf_cache: PdfCache):
+        self.config = config
+        self.pdf_cache = pdf_cache
+        self.executor = None
+
+        # (future, on_done) for each conversion not yet reported, in the
+        # order submitted
+        self.pending: list[tuple[Future, Callable[[Exception | None], None]]] = []
+
+        # cache key -> (future, dest_path) of the conversion running for that
+        # key, until it is reported (after which dest_path may be moved)
+        self.in_flight: dict[str, tuple[Future, str]] = {}
+
+        # conversion future -> (src_path, dest_path, future) for each
+        # conversion waiting to copy that one's PDF
+        self.copies: dict[Future, list[tuple[str, str, Future]]] = {}
+
+    def submit(
+        self,
+        html_pdf_transform_command: str,
+        input_filename: str,
+        dest_path: str,
+        temp_dir: str,
+        on_done: Callable[[Exception | None], None],
+        cache_key: str | None = None,
+    ):
+        """Queue a conversion of input_filename to dest_path. temp_dir (which
+        holds input_filename) is removed once the conversion has run. If the
+        queue is full, this first waits for a conversion to finish."""
+        if self.__fetch__(cache_key, dest_path):
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+            # reported by poll(), as for any other conversion
+            future = Future()
+            future.set_result(None)
+            self.pending.append((future, on_done))
+            return
+
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(
+                max_workers=self.config.pdf.jobs, thread_name_prefix="pdf"
+            )
+
+        while len(self.pending) >= self.config.pdf.jobs * QUEUED_PER_JOB:
+            wait([f for f, _ in self.pending], return_when=FIRST_COMPLETED)
+            self.poll()
+
+        in_flight = self.in_flight.get(cache_key)
+
+        if in_flight is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+            future = Future()
+            self.copies.setdefault(in_flight[0], []).append(
+                (in_flight[1], dest_path, future)
+            )
+            self.pending.append((future, on_done))
+            return
+
+        future = self.executor.submit(
+            self.convert_and_clean_up,
+            html_pdf_transform_command,
+            input_filename,
+            dest_path,
+            temp_dir,
+            cache_key,
+        )
+        self.pending.append((future, on_done))
+
+        if cache_key is not None:
+            self.in_flight[cache_key] = (future, dest_path)
+
+    def convert(
+        self,
+        html_pdf_transform_command: str,
+        input_filename: str,
+        dest_path: str,
+        cache_key: str | None = None,
+    ):
+        """Convert input_filename to dest_path, here and now."""
+        if self.__fetch__(cache_key, dest_path):
+            return
+
+        run_html_pdf_transform_command(
+            html_pdf_transform_command, input_filename, dest_path
+        )
+
+        if cache_key is not None and self.pdf_cache.enabled:
+            self.pdf_cache.store(cache_key, dest_path)
+
+    def convert_and_clean_up(
+        self,
+        html_pdf_transform_command: str,
+        input_filename: str,
+        dest_path: str,
+        temp_dir: str,
+        cache_key: str | None,
+    ):
+        try:
+            self.convert(
+                html_pdf_transform_command, input_filename, dest_path, cache_key
+            )
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    def __fetch__(self, cache_key: str | None, dest_path: str) -> bool:
+        return (
+            cache_key is not None
+            and self.pdf_cache.enabled
+            and self.pdf_cache.fetch(cache_key, dest_path)
+        )
+
+    def poll(self):
+        """Call on_done for each conversion that has finished."""
+        # copy finished conversions' PDFs for the conversions waiting on them
+        # first, as the converted conversion's on_done may move its PDF
+        for converted in [f for f, _ in self.pending if f.done()]:
+            for src_path, dest_path, future in self.copies.pop(converted, []):
+                copy_result(converted, src_path, dest_path, future)
+
+        done = {f for f, _ in self.pending if f.done()}
+        finished = [(f, on_done) for f, on_done in self.pending if f in done]
+        self.pending = [(f, on_done) for f, on_done in self.pending if f not in done]
+        self.in_flight = {
+            k: (f, dest_path)
+            for k, (f, dest_path) in self.in_flight.items()
+            if f not in done
+        }
+
+        for future, on_done in finished:
+            on_done(future.exception())
+
+    def wait(self):
+        """Wait for every queued conversion, calling on_done for each."""
+        while self.pending:
+            wait([f for f, _ in self.pending], return_when=FIRST_COMPLETED)
+            self.poll()
@@ -0,0 +1,209 @@
+from collections import defaultdict
+
+from save_message.matchers import AndMatcher
+from save_message.matchers import FromMatcher
+from save_message.matchers import Matcher
+from save_message.matchers import SubjectMatcher
+from save_message.matchers import ToMatcher
+from save_message.message import MessageView
+
+# the header matchers whose glob patterns we can index; each provides a
+# field_values() staticmethod giving the values it matches against
+INDEXED_MATCHER_TYPES = (SubjectMatcher, FromMatcher, ToMatcher)
+
+
+def literal_prefix(match_criteria: str) -> str:
+    """Return the literal part of a glob before its first wildcard. As globs
+    are applied with re.match(), a value can only match if it starts with
+    this prefix."""
+    for i, c in enumerate(match_criteria):
+        if c in "*?":
+            return match_criteria[:i]
+
+    return match_criteria
+
+
+def is_literal(match_criteria: str) -> bool:
+    return "*" not in match_criteria and "?" not in match_criteria
+
+
+def domain_of(match_criteria: str) -> str | None:
+    """Return the domain of a '*@domain' glob, or None if match_criteria is
+    not one."""
+    if match_criteria.startswith("*@") and is_literal(match_criteria[2:]):
+        return match_criteria[2:]
+
+    return None
+
+
+def is_indexable(matcher: Matcher) -> bool:
+    return (
+        type(matcher) in INDEXED_MATCHER_TYPES
+        and not matcher.is_regex
+        and not matcher.use_search
+        and not matcher.replacements
+    )
+
+
+def anchor_rank(matcher: Matcher) -> tuple[int, int]:
+    """How well matcher narrows down candidates if we file its conjunction
+    under it: literals are best, then domains, then the longest prefix."""
+    if is_literal(matcher.match_criteria):
+        return (2, len(matcher.match_criteria))
+
+    if domain_of(matcher.match_criteria) is not None:
+        return (1, 0)
+
+    return (0, len(literal_prefix(matcher.match_criteria)))
+
+
+class PrefixTable:
+    """A dict of literal strings -> conjunction ids, with the distinct key
+    lengths kept alongside so we can find every key a value starts with (at
+    a given offset) in one dict lookup per length."""
+
+    def __init__(self):
+        self.entries: dict[str, list[int]] = defaultdict(list)
+        self.lengths: list[int] = []
+
+    def add(self, key: str, conj_id: int):
+        self.entries[key].append(conj_id)
+
+        if len(key) not in self.lengths:
+            self.lengths.append(len(key))
+            self.lengths.sort()
+
+    def lookup(self, value: str, result: set[int], start: int = 0):
+        """Add the ids filed under every key value[start:] starts with."""
+        available = len(value) - start
+
+        for length in self.lengths:
+            if length > available:
+                break
+
+            conj_ids = self.entries.get(value[start : start + length])
+            if conj_ids:
+                result.update(conj_ids)
+
+
+class FieldIndex:
+    """All the glob patterns used on one header field (e.g. From) across the
+    whole rule set.
+
+    Globs are applied with re.match(), i.e. a value matches if it *starts*
+    with something matching the glob, so:
+
+      - a literal pattern (no wildcards) matches a value iff the value starts
+        with it; literals are held in a PrefixTable, and a hit is a match
+      - '*@domain' matches a value iff '@domain' appears in the value after
+        the first character; domains are held in a PrefixTable looked up at
+        each '@', and a hit is a match
+      - any other glob can only match a value that starts with its literal
+        prefix (the text before the first wildcard); prefixes are held in a
+        PrefixTable, and a hit is only a candidate, to be checked with the
+        glob's own regex
+
+    Lookups cost one dict lookup per distinct key length, however many
+    patterns there are."""
+
+    def __init__(self, field_values):
+        self.field_values = field_values
+        self.literals = PrefixTable()
+        self.domains = PrefixTable()
+        self.prefixes = PrefixTable()
+
+    def add(self, matcher: Matcher, conj_id: int):
+        """File conj_id under matcher's pattern. Returns True if a hit for
+        this pattern means the pattern matched (i.e. it need not be
+        checked again)."""
+        domain = domain_of(matcher.match_criteria)
+
+        if is_literal(matcher.match_criteria):
+            self.literals.add(matcher.match_criteria, conj_id)
+            return True
+
+        elif domain is not None:
+            self.domains.add(domain, conj_id)
+            return True
+
+        else:
+            self.prefixes.add(literal_prefix(matcher.match_criteria), conj_id)
+            return False
+
+    def lookup(self, view: MessageView, matched: set[int], candidates: set[int]):
+        """Add the ids of conjunctions whose pattern matches view to matched,
+        and those whose pattern may match to candidates."""
+        for value in self.field_values(view):
+            if value is None:
+                continue
+
+            if type(value) is not str:
+                value = str(value)  # e.g. a Header
+
+            self.literals.lookup(value, matched)
+            self.prefixes.lookup(value, candidates)
+
+            if self.domains.lengths:
+                at = value.find("@", 1)
+                while at != -1:
+                    self.domains.lookup(value, matched, start=at + 1)
+                    at = value.find("@", at + 1)
+
+
+class RuleIndex:
+    """Finds the rule conjunctions (AndMatchers) that may match a message,
+    without running every rule's matchers.
+
+    Each conjunction with at least one indexable header glob is filed under
+    one of them (see anchor_rank()) in the FieldIndex for that field; every
+    other conjunction is always a candidate. Conjunctions are identified by
+    the position they were added in, so sorting candidate ids gives rule
+    priority order."""
+
+    def __init__(self):
+        self.fields: dict[type, FieldIndex] = {}
+        self.always: set[int] = set()
+
+        # conj_id -> the matcher to check for a candidate conjunction, and
+        # for one whose anchor is known to have matched (i.e. the rest of the
+        # conjunction, without the anchor)
+        self.full: dict[int, Matcher] = {}
+        self.rest: dict[int, Matcher] = {}
+
+    def add(self, conj: Matcher, conj_id: int):
+        self.full[conj_id] = conj
+
+        leaves = (
+            [m for m in conj.matchers if is_indexable(m)]
+            if isinstance(conj, AndMatcher)
+            else []
+        )
+
+        if not leaves:
+            self.always.add(conj_id)
+            return
+
+        anchor = max(leaves, key=anchor_rank)
+
+        field_index = self.fields.get(type(anchor))
+        if field_index is None:
+            field_index = FieldIndex(anchor.field_values)
+            self.fields[type(anchor)] = field_index
+
+        if field_index.add(anchor, conj_id):
+            self.rest[conj_id] = conj.without(anchor)
+
+    def candidates(self, msg) -> list[tuple[int, Matcher]]:
+        """Return (conj_id, matcher) for each conjunction that may match msg,
+        in order, where matcher decides whether the conjunction matches."""
+        view = MessageView.of(msg)
+        matched = set()
+        candidates = set(self.always)
+
+        for field_index in self.fields.values():
+            field_index.lookup(view, matched, candidates)
+
+        result = {conj_id: self.full[conj_id] for conj_id in candidates}
+        result.update((conj_id, self.rest[conj_id]) for conj_id in matched)
+
+        return sorted(result.items(), key=lambda item: item[0])
@@ -9,17 +9,97 @@ import ruamel.yaml
 
 from save_message.config import Config
 from save_message.config import DEFAULT_SAVE_TO
+from save_message.matchers import AdaptiveAndMatcher
+from save_message.matchers import AndMatcher
+from save_message.matchers import Matcher
+from save_message.matchers import OrMatcher
+from save_message.matchers import is_time_dependent
+from save_message.matchers import order_by_cost
 from save_message.matchers import rule_matches_to_matcher
+from save_message.model import MessageAction
 from save_message.model import SaveRule
+from save_message.rule_index import RuleIndex
 
 logger = logging.getLogger(__name__)
 
 
+class CompiledRuleSet:
+    """An ordered set of save rules, with the matcher for each built once up
+    front (compiling wildcard regexes, parsing dates and so on) rather than
+    every time a message is matched. It is not modified after construction.
+
+    Every conjunction (each RuleMatch of each rule) is also filed in a
+    RuleIndex, so matching a message only evaluates the conjunctions whose
+    header patterns could match it, rather than every rule in turn.
+
+    The matchers within each conjunction are ordered cheapest first, so that
+    header checks reject a message before its body is decoded or its date
+    parsed. If adaptive is True, conjunctions also reorder themselves at
+    runtime based on how often each matcher rejects messages (see
+    AdaptiveAndMatcher)."""
+
+    def __init__(self, save_rules: list[SaveRule], adaptive: bool = False):
+        self.matchers: tuple[Matcher, ...] = tuple(
+            rule_matches_to_matcher(save_rule.matches) for save_rule in save_rules
+        )
+        and_matcher_type = AdaptiveAndMatcher if adaptive else AndMatcher
+
+        # the first rule a message could come to match as it ages, if any
+        self.first_time_dependent: int | None = next(
+            (i for i, m in enumerate(self.matchers) if is_time_dependent(m)), None
+        )
+
+        # conjunction id -> (rule ordinal, conjunction)
+        self.conjunctions: list[tuple[int, Matcher]] = []
+        self.index = RuleIndex()
+
+        for ordinal, matcher in enumerate(self.matchers):
+            conjs = matcher.matchers if type(matcher) is OrMatcher else [matcher]
+
+            for conj in conjs:
+                if type(conj) is AndMatcher:
+                    conj = and_matcher_type(order_by_cost(conj.matchers))
+
+                self.index.add(conj, len(self.conjunctions))
+                self.conjunctions.append((ordinal, conj))
+
+    def __repr__(self):
+        return f"CompiledRuleSet(matchers={self.matchers})"
+
+    def match_ordinal(self, msg: EmailMessage) -> int | None:
+        """Return the index of the first rule matching msg, or None."""
+        for conj_id, matcher in self.index.candidates(msg):
+            if matcher.matches(msg):
+                return self.conjunctions[conj_id][0]
+
+        return None
+
+
 class RulesMatcher:
     """Manages matching messages to the loaded rules"""
 
     def __init__(self, config: Config):
         self.config = config
+        self.rule_set = CompiledRuleSet(
+            config.save_rules, adaptive=config.adaptive_match_ordering
+        )
+
+        # the rule for messages no save_rule matches, built on first use;
+        # returning the same instance each time lets callers (see
+        # MessageSaver.get_effective_settings()) cache things per rule
+        self.default_rule: SaveRule | None = None
+
+    def needs_delete_confirmation(self) -> bool:
+        """Return True if any rule (or the default settings) would ask
+        before deleting a message."""
+        return any(
+            settings.action in (MessageAction.DELETE, MessageAction.SAVE_AND_DELETE)
+            and settings.delete_confirmation
+            for settings in [
+                self.config.default_settings,
+                *(save_rule.settings for save_rule in self.config.save_rules),
+            ]
+        )
 
     def match_save_rule(self, msg: EmailMessage) -> SaveRule:
         """Find the first save_rule in the config that matches the given
@@ -57,12 +137,40 @@ class RulesMatcher:
         #                 )
         #             )
         #
-        for save_rule in self.config.save_rules:
-            save_rule_matcher = rule_matches_to_matcher(save_rule.matches)
-            if save_rule_matcher.matches(msg):
-                return save_rule
-
-        return SaveRule(settings=self.config.default_settings, matches=[])
+        return self.get_save_rule(self.match_save_rule_ordinal(msg))
+
+    def match_save_rule_ordinal(self, msg: EmailMessage) -> int | None:
+        """As for match_save_rule(), but return the index of the matching
+        rule in the config's save_rules, or None if no rule matches. Unlike
+        the SaveRule itself, this is cheap to pass between processes."""
+        return self.rule_set.match_ordinal(msg)
+
+    @property
+    def has_time_dependent_rules(self) -> bool:
+        """True if any rule has an age matcher."""
+        return self.rule_set.first_time_dependent is not None
+
+    def is_final(self, ordinal: int | None) -> bool:
+        """Return True if a message that matches the rule at ordinal (or no
+        rule, if ordinal is None) now will always match it. That holds
+        unless an earlier rule has an age matcher, which the message could
+        come to match as it ages."""
+        first = self.rule_set.first_time_dependent
+
+        return first is None or (ordinal is not None and ordinal <= first)
+
+    def get_save_rule(self, ordinal: int | None) -> SaveRule:
+        """Return the save_rule at the given index in the config, or a rule
+        with the default settings if ordinal is None."""
+        if ordinal is None:
+            if self.default_rule is None:
+                self.default_rule = SaveRule(
+                    settings=self.config.default_settings, matches=[]
+                )
+
+            return self.default_rule
+
+        return self.config.save_rules[ordinal]
 
 
 class RulesAdder:
@@ -1,23 +1,37 @@
+import base64
+import binascii
 import contextlib
-from datetime import datetime
+import hashlib
 from email.message import EmailMessage
 from email.message import MIMEPart
-import email
-import email.policy
-from fnmatch import fnmatch
+import fnmatch
+import functools
+import itertools
 import mimetypes
 import logging
 import os
 import re
-import shlex
 import shutil
-import subprocess
+import string
 import tempfile
-
+from typing import Callable
+from typing import Generator
+from typing import Iterator
+
+from save_message.attachment_store import AttachmentStore
+from save_message.attachment_store import move_link
+from save_message.fileops import DestinationNames
+from save_message.fileops import link_or_copy
+from save_message.message import MessageView
+from save_message.ledger import SaveLedger
+from save_message.ledger import content_hash
+from save_message.ledger import ledger_key
 from save_message.model import Config
 from save_message.model import RuleSaveSettings
 from save_message.model import SaveRule
 from save_message.model import merge_models
+from save_message.pdf import PdfConverter
+from save_message.pdf import pdf_cache_key
 
 logger = logging.getLogger(__name__)
 
@@ -28,6 +42,57 @@ class MessageSaveException(Exception):
         self.message_name = message_name
 
 
+class PendingSave:
+    """The end of a message's save (finish), waiting on the message's queued
+    PDF conversions. One more than the number of conversions is outstanding
+    until release() is called, once every part has been written or queued,
+    so the save cannot finish before that."""
+
+    def __init__(
+        self,
+        message_name: str,
+        finish: Callable[[], None],
+        on_failed: Callable[[MessageSaveException], None] | None,
+    ):
+        self.message_name = message_name
+        self.finish = finish
+        self.on_failed = on_failed
+        self.outstanding = 1
+        self.error = None
+
+    def queue(self) -> Callable[[Exception | None], None]:
+        """Count another conversion, and return its on_done callback."""
+        self.outstanding += 1
+        return self.conversion_done
+
+    def conversion_done(self, ex: Exception | None):
+        self.error = self.error or ex
+        self.outstanding -= 1
+
+        if self.outstanding == 0:
+            try:
+                self.complete()
+
+            except Exception as ex:
+                save_ex = MessageSaveException(self.message_name)
+                save_ex.__cause__ = ex
+                self.on_failed(save_ex)
+
+    def release(self):
+        """Finish now (raising any error) if no conversions are outstanding,
+        otherwise leave it to the last to be done."""
+        self.outstanding -= 1
+
+        if self.outstanding == 0:
+            self.complete()
+
+    def complete(self):
+        if self.error is not None:
+            raise self.error
+
+        self.finish()
+
+
 def get_header_preamble(message: EmailMessage, html: bool = False) -> str:
     if html:
         lines = [
@@ -42,12 +107,114 @@ def get_header_preamble(message: EmailMessage, html: bool = False) -> str:
     return "\n".join(lines) + "\n"
 
 
+# how much of an encoded payload to decode at a time
+DECODE_CHUNK_SIZE = 1024 * 1024
+
+# bytes that are not part of the base64 alphabet, which decoders skip
+NON_BASE64_BYTES = bytes(
+    set(range(256))
+    - set(b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/")
+)
+
+
+def iter_decoded_payload(
+    part: MIMEPart, chunk_size: int = DECODE_CHUNK_SIZE
+) -> Generator[bytes, None, None]:
+    """Yield the decoded payload of part (as for get_payload(decode=True)) a
+    chunk at a time, so that decoding a large attachment only needs about
+    chunk_size of memory on top of the encoded payload, rather than a
+    complete decoded copy.
+
+    base64 and quoted-printable payloads are decoded incrementally; anything
+    else (7bit, 8bit, binary and oddities such as uuencode) is decoded by the
+    email package in one go, as those are nearly always small text parts."""
+    cte = str(part.get("content-transfer-encoding", "")).lower()
+
+    # not get_payload(), which makes an encoded copy of the whole payload
+    # just to check it for undecodable bytes
+    payload = part._payload
+
+    if (
+        cte not in ["base64", "quoted-printable"]
+        or not isinstance(payload, str)
+        or not payload.isascii()
+    ):
+        yield part.get_payload(decode=True)
+        return
+
+    if cte == "base64":
+        carry = b""
+
+        for i in range(0, len(payload), chunk_size):
+            chunk = carry + payload[i : i + chunk_size].encode("ascii").translate(
+                None, NON_BASE64_BYTES
+            )
+
+            # decode whole 4-character groups, and carry the rest over
+            whole = len(chunk) - len(chunk) % 4
+            yield base64.b64decode(chunk[:whole])
+            carry = chunk[whole:]
+
+        if len(carry) > 1:
+            # missing padding; be as lenient as the email package
+            yield base64.b64decode(carry + b"=" * (4 - len(carry)))
+
+    else:
+        start = 0
+
+        while start < len(payload):
+            # decode whole lines, as escapes and soft line breaks don't span
+            # them
+            end = payload.find("\n", start + chunk_size)
+            end = len(payload) if end == -1 else end + 1
+
+            yield binascii.a2b_qp(payload[start:end].encode("ascii"))
+            start = end
+
+
+class FilenameTable(dict):
+    """A str.translate() table that keeps word characters (as for \\w) and
+    hyphens, and maps everything else to a space. Entries are worked out the
+    first time each character is seen, then remembered."""
+
+    def __missing__(self, codepoint: int) -> str:
+        c = chr(codepoint)
+        result = c if c.isalnum() or c in "_-" else " "
+
+        self[codepoint] = result
+        return result
+
+
+FILENAME_TABLE = FilenameTable()
+
+MULTIPLE_SPACES = re.compile(" {2,}")
+
+# path components that would not name a file or directory of their own, and
+# what sanitize_path_component() gives in their place
+UNSAFE_COMPONENTS = ("", ".", "..")
+UNKNOWN_COMPONENT = "unknown"
+
+
 def sanitize_to_filename(s):
     """Really simple string sanitizer that strips all non-alphanumerics/spaces
     from the string before saving, so it is very filesystem safe."""
-    result = re.sub(r"[^\w\s-]", " ", s)
-    result = re.sub(r"\s+", " ", result)
-    return result
+    return MULTIPLE_SPACES.sub(" ", s.translate(FILENAME_TABLE))
+
+
+def replace_path_separators(s: str) -> str:
+    for sep in filter(None, (os.sep, os.altsep, "\0")):
+        s = s.replace(sep, " ")
+
+    return s
+
+
+def sanitize_path_component(s: str) -> str:
+    """Make s safe to use as one component of a path: path separators are
+    replaced with spaces, and if nothing (or only '.' or '..') is left, the
+    result is UNKNOWN_COMPONENT."""
+    s = replace_path_separators(s)
+
+    return UNKNOWN_COMPONENT if s.strip() in UNSAFE_COMPONENTS else s
 
 
 def guess_ext_for_part(part):
@@ -90,29 +257,161 @@ def get_filename_for_part(
     return filename, ext
 
 
+# the fields available in message_name, and how to work each one out from a
+# MessageView (which remembers parsed addresses and dates between calls)
+NAME_FIELDS: dict[str, Callable[[MessageView], str]] = {
+    "subject": lambda view: sanitize_to_filename(view["subject"]),
+    "from_name": lambda view: view.from_parts[0] or view.from_parts[1],
+    "from_addr": lambda view: view.from_parts[1],
+    "to_name": lambda view: view.to_parts[0] or view.to_parts[1],
+    "to_addr": lambda view: view.to_parts[1],
+    "month_year": lambda view: view.date.strftime("%b%y"),
+    "date": lambda view: view.date.strftime("%d%b%y"),
+    "year": lambda view: view.date.strftime("%Y"),
+    "month": lambda view: view.date.strftime("%m"),
+    "sender_domain": lambda view: (
+        view.from_parts[1].partition("@")[2].lower() or UNKNOWN_COMPONENT
+    ),
+}
+
+# the names of the numbered subdirectories messages are saved in, if
+# shard_size is set
+SHARD_NAME = re.compile("[0-9]+")
+
+
+class NameTemplate:
+    """A message_name format string, parsed once. Rendering a message's name
+    only works out the fields the template uses (so, for instance, the Date
+    header isn't parsed unless it is needed)."""
+
+    formatter = string.Formatter()
+
+    def __init__(self, fmt: str):
+        self.fmt = fmt
+
+        # (literal text, field name, format spec, conversion), as for
+        # str.format()
+        self.parts = list(self.formatter.parse(fmt))
+
+        # the top-level fields used, e.g. 'subject' for '{subject[0]}'
+        self.fields = {
+            re.match(r"[^.[]*", field_name).group()
+            for _, field_name, _, _ in self.parts
+            if field_name is not None
+        }
+
+        # the literal text before the first field
+        self.prefix = ""
+        for literal, field_name, _, _ in self.parts:
+            self.prefix += literal
+
+            if field_name is not None:
+                break
+
+    def render(self, view: MessageView, path: bool = False) -> str:
+        """Render the template for the message in view, as a name, or if path
+        is True, as a whole path. Field values come from the message's
+        headers, so are not trusted: path separators in them are replaced,
+        and in a path, each is made a safe component by itself (see
+        sanitize_path_component()). A name that comes out empty, '.' or '..'
+        is replaced with UNKNOWN_COMPONENT."""
+        values = {field: NAME_FIELDS[field](view) for field in self.fields}
+        sanitize = sanitize_path_component if path else replace_path_separators
+        result = []
+
+        for literal, field_name, format_spec, conversion in self.parts:
+            result.append(literal)
+
+            if field_name is not None:
+                value, _ = self.formatter.get_field(field_name, (), values)
+                value = self.formatter.convert_field(value, conversion)
+                result.append(sanitize(self.formatter.format_field(value, format_spec)))
+
+        result = "".join(result)
+
+        if not path and result.strip() in UNSAFE_COMPONENTS:
+            return UNKNOWN_COMPONENT
+
+        return result
+
+
+@functools.lru_cache(maxsize=None)
+def compile_name_template(fmt: str) -> NameTemplate:
+    return NameTemplate(fmt)
+
+
 def get_message_name(msg, fmt: str):
-    subject = sanitize_to_filename(msg["subject"])
-
-    from_parts = email.utils.parseaddr(msg["from"])
-    to_parts = email.utils.parseaddr(msg["to"])
-    date = datetime.strptime(msg["date"], "%a, %d %b %Y %H:%M:%S %z")
-
-    from_name = from_parts[0] or from_parts[1]
-    from_addr = from_parts[1]
-    to_name = to_parts[0] or to_parts[1]
-    to_addr = to_parts[1]
-    month_year = date.strftime("%b%y")
-    day_month_year = date.strftime("%d%b%y")
-
-    return fmt.format(
-        subject=subject,
-        from_name=from_name,
-        from_addr=from_addr,
-        to_name=to_name,
-        to_addr=to_addr,
-        month_year=month_year,
-        date=day_month_year,
-    )
+    return compile_name_template(fmt).render(MessageView.of(msg))
+
+
+def numbered_names(name: str, ext: str) -> Iterator[str]:
+    """Yield name + ext, then "name (2)" + ext, "name (3)" + ext, and so
+    on, as candidates for a file's name."""
+    yield f"{name}{ext}"
+
+    for n in itertools.count(2):
+        yield f"{name} ({n}){ext}"
+
+
+class EffectiveSaveSettings:
+    """A rule's save settings merged with the default ones, along with the
+    parts that are the same for every message worked out up front: the save
+    path (with environment variables and ~ expanded), the save_attachments
+    glob (compiled) and the message_name template (parsed). It is not
+    modified after construction.
+
+    If the save path uses message_name fields (e.g. {year}), path is the
+    directory above the first of them, which is where the ledger and the
+    attachment store key things; get_save_dir() gives each message's
+    directory. Save paths with no such fields (including ones that just
+    have braces in) are used as they are."""
+
+    def __init__(self, settings: RuleSaveSettings):
+        self.settings = settings
+        self.name_template = compile_name_template(settings.message_name)
+
+        full_path = os.path.expanduser(os.path.expandvars(settings.path))
+        self.path_template = None
+
+        try:
+            path_template = compile_name_template(full_path)
+        except ValueError:
+            # unbalanced braces, so not a template
+            path_template = None
+
+        if (
+            path_template is not None
+            and path_template.fields
+            and path_template.fields <= NAME_FIELDS.keys()
+        ):
+            self.path_template = path_template
+            full_path = os.path.dirname(path_template.prefix)
+
+        self.path = full_path
+
+        # None matches every attachment
+        self.attachments_pattern = (
+            re.compile(fnmatch.translate(settings.save_attachments))
+            if settings.save_attachments and settings.save_attachments != "*"
+            else None
+        )
+
+    def __repr__(self):
+        return f"EffectiveSaveSettings(settings={self.settings!r})"
+
+    def matches_attachment(self, filename: str) -> bool:
+        return (
+            self.attachments_pattern is None
+            or self.attachments_pattern.match(filename) is not None
+        )
+
+    def get_save_dir(self, view: MessageView) -> str:
+        """Return the directory to save the message to (or in, unless
+        flattening), before any sharding."""
+        if self.path_template is None:
+            return self.path
+
+        return self.path_template.render(view, path=True)
 
 
 @contextlib.contextmanager
@@ -123,71 +422,157 @@ def temp_save_dir() -> str:
     shutil.rmtree(result)
 
 
+def write_html_input(
+    part: MIMEPart, temp_dir: str, html_pdf_transform_command: str
+) -> tuple[str, str]:
+    """Write an HTML part's payload to a file in temp_dir, as input for
+    html_pdf_transform_command. Returns the file's path, and the PdfCache key
+    for the conversion (see pdf_cache_key())."""
+    input_filename = os.path.join(temp_dir, "inputmsg")
+
+    if os.path.exists(input_filename):
+        raise ValueError(f"path {input_filename} exists, aborting")
+
+    def write_chunks():
+        with open(input_filename, "wb") as f:
+            for chunk in iter_decoded_payload(part):
+                f.write(chunk)
+                yield chunk
+
+    cache_key = pdf_cache_key(html_pdf_transform_command, write_chunks())
+
+    return input_filename, cache_key
+
+
 class MessagePartSaver:
     """Saves messages, optionally with some transformations, to a configured
     destination."""
 
-    def __init__(self, config: Config):
+    def __init__(
+        self,
+        config: Config,
+        attachment_store: AttachmentStore,
+        pdf_converter: PdfConverter,
+    ):
         self.config = config
+        self.attachment_store = attachment_store
+        self.pdf_converter = pdf_converter
 
     def save_part(
         self,
         msg: EmailMessage,
         part: MIMEPart,
         dest_path: str,
+        save_settings: EffectiveSaveSettings | None = None,
     ):
         """Save a message MIME part to a file.
 
         @param msg The EmailMessage the part came from
         @param part The part whose payload we are saving
-        @param dest_path The filename to write the payload to
+        @param dest_path The filename to write the payload to, which must not
+            exist
+        @param save_settings The settings the part is being saved with; if
+            these enable dedupe_attachments, attachments are saved via the
+            attachment store
         """
         # multipart/* are just containers
         if part.get_content_maintype() == "multipart":
             return
 
-        if os.path.exists(dest_path):
-            raise ValueError(f"path {dest_path} exists, aborting")
+        # if this part is not an attachment, it is the body of the message, so
+        # we prepend some headers to give context
+        is_body = not part.is_attachment() and part.get_content_maintype() == "text"
 
-        with open(dest_path, "wb") as fp2:
-            # if this part is not an attachment, it is the body of the message, so
-            # we prepend some headers to give context
-            if not part.is_attachment() and part.get_content_maintype() == "text":
+        if (
+            save_settings is not None
+            and save_settings.settings.dedupe_attachments
+            and not is_body
+        ):
+            self.save_attachment_deduped(part, dest_path, save_settings)
+            return
+
+        # "x" so as never to overwrite anything
+        with open(dest_path, "xb") as fp2:
+            if is_body:
                 preamble = get_header_preamble(
                     msg, html=part.get_content_type() == "text/html"
                 )
                 fp2.write(preamble.encode())
                 fp2.write("\n".encode())
 
-            fp2.write(part.get_payload(decode=True))
+            for chunk in iter_decoded_payload(part):
+                fp2.write(chunk)
 
             logger.debug("saved %s", os.path.basename(dest_path))
 
+    def save_attachment_deduped(
+        self, part: MIMEPart, dest_path: str, save_settings: EffectiveSaveSettings
+    ):
+        """Save an attachment as a link to its blob in the attachment store,
+        adding the blob first if the store doesn't have it yet. The payload
+        is hashed before anything is written, so a duplicate costs a link,
+        not a write."""
+        save_path = save_settings.path
+
+        digest = hashlib.sha256()
+        for chunk in iter_decoded_payload(part):
+            digest.update(chunk)
+
+        blob_path = self.attachment_store.find(save_path, digest.hexdigest())
+
+        if blob_path is None:
+            blob_path = self.attachment_store.add(
+                save_path, digest.hexdigest(), iter_decoded_payload(part)
+            )
+
+        self.attachment_store.link(
+            blob_path, dest_path, save_settings.settings.dedupe_attachments
+        )
+        logger.debug("saved %s (deduped)", os.path.basename(dest_path))
+
     def save_html_part_to_pdf(
         self,
         msg: EmailMessage,
         part: MIMEPart,
         dest_path: str,
         html_pdf_transform_command: str,
+        on_done: Callable[[Exception | None], None] | None = None,
     ):
+        """Convert an HTML part to a PDF at dest_path. If on_done is given,
+        the conversion is queued on the PdfConverter, which calls on_done
+        when it has finished (see PdfConverter.submit()); otherwise it is run
+        before returning."""
         assert part.get_content_type() == "text/html"
 
-        with temp_save_dir() as td:
-            input_filename = os.path.join(td, "inputmsg")
+        if on_done is None:
+            with temp_save_dir() as td:
+                input_filename, cache_key = write_html_input(
+                    part, td, html_pdf_transform_command
+                )
+                self.pdf_converter.convert(
+                    html_pdf_transform_command, input_filename, dest_path, cache_key
+                )
 
-            if os.path.exists(input_filename):
-                raise ValueError(f"path {input_filename} exists, aborting")
+        else:
+            td = tempfile.mkdtemp()
 
-            with open(input_filename, "wb") as f:
-                f.write(part.get_payload(decode=True))
+            try:
+                input_filename, cache_key = write_html_input(
+                    part, td, html_pdf_transform_command
+                )
 
-            subprocess.run(
-                shlex.split(
-                    html_pdf_transform_command.replace(
-                        "$in", f'"{input_filename}"'
-                    ).replace("$out", f'"{dest_path}"')
-                ),
-                check=True,
+            except Exception:
+                shutil.rmtree(td)
+                raise
+
+            # the converter removes td once the conversion has run
+            self.pdf_converter.submit(
+                html_pdf_transform_command,
+                input_filename,
+                dest_path,
+                td,
+                on_done,
+                cache_key=cache_key,
             )
 
 
@@ -199,14 +584,75 @@ class MessageSaver:
         self,
         config: Config,
         message_part_saver: MessagePartSaver,
+        save_ledger: SaveLedger,
     ):
         self.config = config
         self.message_part_saver = message_part_saver
+        self.save_ledger = save_ledger
+
+        # id(rule) -> (rule, its EffectiveSaveSettings); the rule is kept so
+        # its id can't be reused while it is cached
+        self.effective_settings: dict[int, tuple[SaveRule, EffectiveSaveSettings]] = {}
+
+        # the names taken in the directories we save to, this run
+        self.destination_names = DestinationNames()
+
+        # save directory -> the number of the shard in it being filled, if
+        # shard_size is set
+        self.current_shards: dict[str, int] = {}
+
+    def get_effective_settings(self, rule: SaveRule) -> EffectiveSaveSettings:
+        """Return the rule's save settings merged with the defaults (see
+        EffectiveSaveSettings), working them out the first time each rule is
+        seen."""
+        cached = self.effective_settings.get(id(rule))
+
+        if cached is None:
+            cached = (
+                rule,
+                EffectiveSaveSettings(
+                    merge_models(
+                        self.config.default_settings.save_settings,
+                        rule.settings.save_settings,
+                    )
+                ),
+            )
+            self.effective_settings[id(rule)] = cached
+
+        return cached[1]
+
+    def get_shard_dir(self, save_dir: str, shard_size: int) -> str:
+        """Return the numbered subdirectory of save_dir to save the next
+        message in, so that none holds more than shard_size entries. Shards
+        are filled in turn, so only the last one (and save_dir, once) is ever
+        listed."""
+        shard = self.current_shards.get(save_dir)
+
+        if shard is None:
+            shard = max(
+                (
+                    int(name)
+                    for name in self.destination_names.names(save_dir)
+                    if SHARD_NAME.fullmatch(name)
+                ),
+                default=1,
+            )
+
+        while (
+            len(self.destination_names.names(os.path.join(save_dir, f"{shard:04d}")))
+            >= shard_size
+        ):
+            shard += 1
+
+        self.current_shards[save_dir] = shard
+        return os.path.join(save_dir, f"{shard:04d}")
 
     def save_message(
         self,
         msg: EmailMessage,
         rule: SaveRule,
+        then: Callable[[], None] | None = None,
+        on_failed: Callable[[MessageSaveException], None] | None = None,
     ) -> tuple[str | None, list[str]]:
         """Save the message in `input_file`, using rules to determine
         where to save. The rule is the rule whose actions should
@@ -215,34 +661,119 @@ class MessageSaver:
 
         Returns ( body_filename, attachment_filenames ) as a tuple.
 
+        If the save ledger is enabled and records the message (with the same
+        content) as already saved under the same path, nothing is written,
+        and the filenames recorded then are returned.
+
+        then, if given, is called once the message is completely saved. If
+        on_failed is given, HTML to PDF conversions are queued on the
+        PdfConverter rather than waited for, and the rest of the save
+        (flattening, recording in the ledger, and then()) happens when they
+        have finished; if that fails, on_failed is called with the
+        exception. The filenames returned are as they were before
+        flattening.
         """
-        merged_save_settings = merge_models(
-            self.config.default_settings.save_settings, rule.settings.save_settings
-        )
-        message_name = get_message_name(msg, fmt=merged_save_settings.message_name)
+        effective_settings = self.get_effective_settings(rule)
+        merged_save_settings = effective_settings.settings
+        save_path = effective_settings.path
+
+        if self.save_ledger.enabled:
+            # the key alone is not enough, as some senders reuse Message-IDs
+            # for different messages, which must not be skipped (and deleted)
+            message_hash = content_hash(msg)
+            message_key = ledger_key(msg, message_hash)
+            saved = self.save_ledger.get(message_key, save_path, message_hash)
+            if saved is not None:
+                logger.info("already saved %s, skipping", message_key)
+
+                if then is not None:
+                    then()
+
+                return saved
+
+        view = MessageView.of(msg)
+        message_name = effective_settings.name_template.render(view)
         logger.debug("merged_save_settings=%s", merged_save_settings)
 
         body_filename = None
         attachment_filenames = []
+        save_dir = None
+        dest_dir = None
 
-        try:
-            dest_dir = os.path.join(merged_save_settings.path, message_name)
-            dest_dir = os.path.expanduser(os.path.expandvars(dest_dir))
-
-            if os.path.exists(dest_dir):
-                # to deal with scenarios where we already saved a message, or
-                # it has a collision, just construct a name that does not exist,
-                # as the objective is to save the message and be assured it is
-                # saved, even if we suffer duplicates
-                orig_dest_dir = dest_dir
-                counter = 0
-
-                while os.path.exists(dest_dir):
-                    counter += 1
-                    dest_dir = f"{orig_dest_dir}_{counter}"
+        def finish_save():
+            nonlocal body_filename, dest_dir
+
+            # nothing more is saved to dest_dir
+            self.destination_names.forget(dest_dir)
+
+            # Once all files are written we examine whether
+            # flatten_single_file_messages is enabled, and decide to flatten
+            # based on the contents of dest_dir.
+            if merged_save_settings.flatten_single_file_messages:
+                saved_files = os.listdir(dest_dir)
+                new_dest_dir = save_dir
+
+                if len(saved_files) == 1:
+                    logger.debug("flattening save dir into single file")
+                    # if a single file, then move to parent dir with same ext
+                    ext = saved_files[0][saved_files[0].rindex(".") :]
+
+                    src = os.path.join(dest_dir, saved_files[0])
+
+                    # the file may be a relative symlink into the
+                    # attachment store, which needs re-pointing
+                    dst = self.destination_names.create(
+                        new_dest_dir,
+                        numbered_names(message_name, ext),
+                        lambda dst: move_link(src, dst),
+                    )
+
+                    # update any filename refs to the correct name
+                    if body_filename == src:
+                        body_filename = dst
 
+                    for i in range(0, len(attachment_filenames)):
+                        if attachment_filenames[i] == src:
+                            attachment_filenames[i] = dst
+
+                    shutil.rmtree(dest_dir)
+                    self.destination_names.discard(dest_dir)
+                    dest_dir = dst
+
+            if self.save_ledger.enabled:
+                self.save_ledger.put(
+                    message_key,
+                    save_path,
+                    message_hash,
+                    dest_dir,
+                    body_filename,
+                    attachment_filenames,
+                )
+
+            if then is not None:
+                then()
+
+        pending_save = PendingSave(message_name, finish_save, on_failed)
+        queue_conversion = pending_save.queue if on_failed is not None else None
+
+        try:
+            save_dir = effective_settings.get_save_dir(view)
+
+            if merged_save_settings.shard_size:
+                save_dir = self.get_shard_dir(save_dir, merged_save_settings.shard_size)
+
+            # to deal with scenarios where we already saved a message, or
+            # it has a collision, just construct a name that does not exist,
+            # as the objective is to save the message and be assured it is
+            # saved, even if we suffer duplicates
+            dest_dir = self.destination_names.mkdir(
+                save_dir,
+                itertools.chain(
+                    [message_name],
+                    (f"{message_name}_{n}" for n in itertools.count(1)),
+                ),
+            )
             logger.info("dest_dir=%s", dest_dir)
-            os.makedirs(dest_dir, exist_ok=False)
 
             counter = 1
 
@@ -264,7 +795,9 @@ class MessageSaver:
                             part=body_parts[preferred_content_type],
                             dest_dir=dest_dir,
                             msg_name_as_filename=True,
-                            save_settings=merged_save_settings,
+                            save_settings=effective_settings,
+                            message_name=message_name,
+                            queue_conversion=queue_conversion,
                         )
                         saved = True
                         break
@@ -281,13 +814,9 @@ class MessageSaver:
                 # filename, even if it is not claiming to be an attachment
                 is_attachment = part.is_attachment() or part.get_filename()
 
-                if merged_save_settings.save_attachments == "*":
-                    result = is_attachment
-
-                else:
-                    result = is_attachment and fnmatch(
-                        part.get_filename(), merged_save_settings.save_attachments
-                    )
+                result = is_attachment and effective_settings.matches_attachment(
+                    part.get_filename()
+                )
 
                 # logger.debug(
                 #     "part_is_matching_attachment(save_attachments=%s"
@@ -313,7 +842,9 @@ class MessageSaver:
                             dest_dir=dest_dir,
                             counter=counter,
                             msg_name_as_filename=False,
-                            save_settings=merged_save_settings,
+                            save_settings=effective_settings,
+                            message_name=message_name,
+                            queue_conversion=queue_conversion,
                         )
                     )
                     counter += 1
@@ -322,56 +853,31 @@ class MessageSaver:
                 logger.debug("saving message EML")
                 # finally, write the entire message to a file in the new directory
                 message_file_name = f"{message_name}.eml"
-                message_path = os.path.join(dest_dir, message_file_name)
-
-                if os.path.exists(message_path):
-                    raise ValueError(f"path {message_path} exists, aborting")
-
-                with open(message_path, "wb") as f:
-                    f.write(msg.as_bytes())
-                    logger.debug("saved %s", message_file_name)
-
-            # Once all files are written we examine whether
-            # flatten_single_file_messages is enabled, and decide to flatten
-            # based on the contents of dest_dir.
-            if merged_save_settings.flatten_single_file_messages:
-                saved_files = os.listdir(dest_dir)
-                new_dest_dir = os.path.expanduser(
-                    os.path.expandvars(merged_save_settings.path)
+                message_path = self.destination_names.take(
+                    dest_dir, [message_file_name]
                 )
 
-                if len(saved_files) == 1:
-                    logger.debug("flattening save dir into single file")
-                    # if a single file, then move to parent dir with same ext
-                    ext = saved_files[0][saved_files[0].rindex(".") :]
-
-                    message_single_file_name = f"{message_name}{ext}"
-                    src = os.path.join(dest_dir, saved_files[0])
-                    dst = os.path.join(new_dest_dir, message_single_file_name)
+                # if the message came from a file (i.e. a maildir), link or
+                # copy that file as is, rather than re-serializing the message
+                source_path = getattr(msg, "path", None)
 
-                    counter = 2
-                    while os.path.exists(dst):
-                        counter_str = "%d" % (counter)
-                        message_single_file_name = (
-                            f"{message_name} ({counter_str}){ext}"
-                        )
-                        dst = os.path.join(new_dest_dir, message_single_file_name)
-
-                    shutil.move(src, dst)
+                if source_path is not None:
+                    link_or_copy(source_path, message_path)
 
-                    # update any filename refs to the correct name
-                    if body_filename == src:
-                        body_filename = dst
+                else:
+                    with open(message_path, "wb") as f:
+                        f.write(msg.as_bytes())
 
-                    for i in range(0, len(attachment_filenames)):
-                        if attachment_filenames[i] == src:
-                            attachment_filenames[i] = dst
+                logger.debug("saved %s", message_file_name)
 
-                    shutil.rmtree(dest_dir)
+            pending_save.release()
 
             return body_filename, attachment_filenames
 
         except Exception as ex:
+            if dest_dir is not None:
+                self.destination_names.forget(dest_dir)
+
             raise MessageSaveException(message_name) from ex
 
     def __save_part__(
@@ -380,35 +886,36 @@ class MessageSaver:
         part,
         dest_dir,
         msg_name_as_filename: bool,
-        save_settings: RuleSaveSettings,
+        save_settings: EffectiveSaveSettings,
+        message_name: str,
         counter=None,
+        queue_conversion: Callable[[], Callable] | None = None,
     ) -> str:
-        msg_name = get_message_name(msg, save_settings.message_name)
         filename, ext = get_filename_for_part(
-            msg_name, part, counter, msg_name_as_filename=msg_name_as_filename
+            message_name, part, counter, msg_name_as_filename=msg_name_as_filename
+        )
+        to_pdf = (
+            part.get_content_type() == "text/html"
+            and save_settings.settings.html_pdf_transform_command
         )
-        dest_path = os.path.join(dest_dir, f"{filename}{ext}")
 
-        counter = 2
-        while os.path.exists(dest_path):
-            counter_str = "%d" % (counter)
-            filename, ext = get_filename_for_part(
-                msg_name, part, counter, msg_name_as_filename=msg_name_as_filename
-            )
-            dest_path = os.path.join(dest_dir, f"{filename} ({counter_str}){ext}")
+        if to_pdf:
+            ext = ext[: ext.rindex(".")] + ".pdf"
 
-        if (
-            part.get_content_type() == "text/html"
-            and save_settings.html_pdf_transform_command
-        ):
-            dest_path = dest_path[: dest_path.rindex(".")] + ".pdf"
+        # dest_dir is new, and only we write to it, so names can be picked
+        # without looking at the filesystem
+        dest_path = self.destination_names.take(dest_dir, numbered_names(filename, ext))
 
+        if to_pdf:
             # ["prince", input_filename, "-o", dest_path]
             self.message_part_saver.save_html_part_to_pdf(
                 msg=msg,
                 part=part,
                 dest_path=dest_path,
-                html_pdf_transform_command=save_settings.html_pdf_transform_command,
+                html_pdf_transform_command=(
+                    save_settings.settings.html_pdf_transform_command
+                ),
+                on_done=None if queue_conversion is None else queue_conversion(),
             )
 
         else:
@@ -416,6 +923,7 @@ class MessageSaver:
                 msg=msg,
                 part=part,
                 dest_path=dest_path,
+                save_settings=save_settings,
             )
 
         return dest_path
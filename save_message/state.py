@@ -0,0 +1,105 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+from save_message.model import Config
+
+logger = logging.getLogger(__name__)
+
+
+def rules_hash(config: Config) -> str:
+    """Return a hash of the config's save_rules and default_settings, which
+    decide what happens to each message."""
+    rules = {
+        "save_rules": [rule.dict() for rule in config.save_rules],
+        "default_settings": config.default_settings and config.default_settings.dict(),
+    }
+    return hashlib.sha1(
+        json.dumps(rules, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+class MaildirState:
+    """The watermark left by the last apply-rules run over a maildir: the
+    mtimes of its new/ and cur/ directories, and the keys of the messages
+    rules have already been applied to.
+
+    Messages are only decided once the rule they match can't change (see
+    RulesMatcher.is_final()). Those that could still come to match an
+    earlier, age-based rule are instead kept in applied_ordinals, with the
+    ordinal of the rule applied to them, so that they are matched again on
+    later runs, but the rule is only applied again if it has changed.
+
+    dir_mtimes is only recorded once every message in the maildir has been
+    decided, so a maildir whose directories are unchanged since then can be
+    skipped without listing it.
+
+    The state also records the rules_hash() of the rules it was decided
+    under; state left under different rules is ignored, as if --full were
+    given, since the rule each message matches may have changed."""
+
+    def __init__(self, path: str, rules_hash: str | None = None):
+        self.path = path
+        self.rules_hash = rules_hash
+        self.dir_mtimes: dict[str, int] | None = None
+        self.decided_keys: set[str] = set()
+        self.applied_ordinals: dict[str, int | None] = {}
+
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                state = json.load(f)
+
+            if state.get("rules_hash") != rules_hash:
+                logger.info("%s: rules have changed, ignoring state", path)
+                return
+
+            self.dir_mtimes = state["dir_mtimes"]
+            self.decided_keys = set(state["decided_keys"])
+            self.applied_ordinals = state.get("applied_ordinals", {})
+
+    def is_unchanged(self, dir_mtimes: dict[str, int]) -> bool:
+        return self.dir_mtimes is not None and self.dir_mtimes == dir_mtimes
+
+    def update(self, dir_mtimes: dict[str, int], keys: set[str]):
+        """Record the end of a run: keys are the keys now in the maildir, and
+        dir_mtimes the mtimes of its directories taken *before* the run
+        started, so messages delivered mid-run are not missed next time."""
+        self.decided_keys &= keys
+        self.applied_ordinals = {
+            k: ordinal for k, ordinal in self.applied_ordinals.items() if k in keys
+        }
+        self.dir_mtimes = dir_mtimes if keys <= self.decided_keys else None
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        # write then rename, so an interrupted run never leaves a torn file
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(self.path))
+        with os.fdopen(fd, "w") as f:
+            json.dump(
+                {
+                    "rules_hash": self.rules_hash,
+                    "dir_mtimes": self.dir_mtimes,
+                    "decided_keys": sorted(self.decided_keys),
+                    "applied_ordinals": self.applied_ordinals,
+                },
+                f,
+            )
+
+        os.replace(temp_path, self.path)
+
+
+class MaildirStates:
+    """Loads MaildirStates from the configured state directory, one file per
+    maildir, for the configured rules."""
+
+    def __init__(self, config: Config):
+        self.config = config
+
+    def get_state(self, maildir_path: str) -> MaildirState:
+        state_dir = os.path.expanduser(os.path.expandvars(self.config.state.path))
+        filename = hashlib.sha1(maildir_path.encode()).hexdigest() + ".json"
+
+        return MaildirState(os.path.join(state_dir, filename), rules_hash(self.config))
@@ -0,0 +1,101 @@
+from email.message import EmailMessage
+import pytest
+from unittest.mock import MagicMock
+
+from .context import save_message  # noqa: F401
+
+from save_message.model import MessageAction
+from save_message.model import RuleSettings
+from save_message.model import SaveRule
+from save_message.rules import RulesMatcher
+from save_message.actions.actions import MessageActions
+from save_message.actions.copy_action import CopyRuleAction
+from save_message.actions.delete_action import DeleteRuleAction
+from save_message.actions.ignore_action import IgnoreRuleAction
+from save_message.actions.keep_action import KeepRuleAction
+from save_message.actions.move_action import MoveRuleAction
+from save_message.actions.save_and_delete_action import SaveAndDeleteRuleAction
+
+
+def new_non_matching_action(spec):
+    r = MagicMock(spec=spec)
+    r.matches_message_action.return_value = False
+    return r
+
+
+def new_message_actions(action: MessageAction):
+    rule = SaveRule(settings=RuleSettings(action=action), matches=[])
+
+    rules_matcher = MagicMock(spec=RulesMatcher)
+    rules_matcher.match_save_rule.return_value = rule
+
+    keep_rule_action = MagicMock(spec=KeepRuleAction)
+    keep_rule_action.matches_message_action.side_effect = (
+        lambda a: a == MessageAction.KEEP
+    )
+
+    message_actions = MessageActions(
+        save_and_delete_rule_action=new_non_matching_action(SaveAndDeleteRuleAction),
+        keep_rule_action=keep_rule_action,
+        ignore_rule_action=new_non_matching_action(IgnoreRuleAction),
+        delete_rule_action=new_non_matching_action(DeleteRuleAction),
+        move_rule_action=new_non_matching_action(MoveRuleAction),
+        copy_rule_action=new_non_matching_action(CopyRuleAction),
+        rules_matcher=rules_matcher,
+    )
+
+    return message_actions, keep_rule_action, rule
+
+
+def test_apply_rules_uses_given_message():
+    message_actions, keep_rule_action, rule = new_message_actions(MessageAction.KEEP)
+    maildir = MagicMock()
+    msg = EmailMessage()
+
+    message_actions.apply_rules(maildir, "key-1", msg)
+
+    maildir.get.assert_not_called()
+    message_actions.rules_matcher.match_save_rule.assert_called_with(msg)
+    keep_rule_action.perform_action.assert_called_with(
+        maildir, "key-1", msg, rule, on_failed=None
+    )
+
+
+def test_apply_rules_loads_message_if_not_given():
+    message_actions, keep_rule_action, rule = new_message_actions(MessageAction.KEEP)
+    maildir = MagicMock()
+    msg = EmailMessage()
+    maildir.get.return_value = msg
+
+    message_actions.apply_rules(maildir, "key-1")
+
+    maildir.get.assert_called_with("key-1")
+    keep_rule_action.perform_action.assert_called_with(
+        maildir, "key-1", msg, rule, on_failed=None
+    )
+
+
+def test_move_action(monkeypatch):
+    monkeypatch.setenv("MAIL", "/mail")
+    rule = SaveRule(
+        settings=RuleSettings(
+            action=MessageAction.MOVE, target_maildir="$MAIL/archive"
+        ),
+        matches=[],
+    )
+    maildir = MagicMock()
+    msg = EmailMessage()
+
+    MoveRuleAction().perform_action(maildir, "key-1", msg, rule)
+
+    maildir.move.assert_called_with("key-1", "/mail/archive", msg=msg)
+
+
+def test_copy_action_without_target_maildir():
+    rule = SaveRule(settings=RuleSettings(action=MessageAction.COPY), matches=[])
+    maildir = MagicMock()
+
+    with pytest.raises(ValueError):
+        CopyRuleAction().perform_action(maildir, "key-1", EmailMessage(), rule)
+
+    maildir.copy.assert_not_called()
@@ -0,0 +1,84 @@
+import os
+import pytest
+import shutil
+import tempfile
+from unittest.mock import patch
+
+from .context import save_message  # noqa: F401
+
+from save_message.attachment_store import AttachmentStore
+from save_message.attachment_store import move_link
+from save_message.model import DedupeLink
+
+
+@pytest.fixture
+def temp_save_dir() -> str:
+    result = tempfile.mkdtemp()
+    yield result
+
+    shutil.rmtree(result)
+
+
+def test_find_missing(temp_save_dir):
+    assert AttachmentStore().find(temp_save_dir, "abcdef") is None
+
+
+def test_add_and_find(temp_save_dir):
+    store = AttachmentStore()
+
+    blob_path = store.add(temp_save_dir, "abcdef", [b"foo", b"bar"])
+
+    with open(blob_path, "rb") as f:
+        assert f.read() == b"foobar"
+
+    assert blob_path.startswith(os.path.join(temp_save_dir, ".attachments"))
+    assert store.find(temp_save_dir, "abcdef") == blob_path
+    assert AttachmentStore().find(temp_save_dir, "abcdef") == blob_path
+
+
+def test_find_removed_blob(temp_save_dir):
+    store = AttachmentStore()
+    os.remove(store.add(temp_save_dir, "abcdef", [b"foo"]))
+
+    assert store.find(temp_save_dir, "abcdef") is None
+
+
+def test_link_hardlink(temp_save_dir):
+    store = AttachmentStore()
+    blob_path = store.add(temp_save_dir, "abcdef", [b"foo"])
+    dest_path = os.path.join(temp_save_dir, "foo.txt")
+
+    store.link(blob_path, dest_path, DedupeLink.HARDLINK)
+
+    assert os.path.samefile(blob_path, dest_path)
+    assert not os.path.islink(dest_path)
+
+
+@patch("save_message.attachment_store.os.link")
+def test_link_hardlink_falls_back_to_symlink(link, temp_save_dir):
+    link.side_effect = OSError(31, "too many links")  # EMLINK
+    store = AttachmentStore()
+    blob_path = store.add(temp_save_dir, "abcdef", [b"foo"])
+    dest_path = os.path.join(temp_save_dir, "foo.txt")
+
+    store.link(blob_path, dest_path, DedupeLink.HARDLINK)
+
+    assert os.path.islink(dest_path)
+
+
+def test_link_symlink_and_move(temp_save_dir):
+    store = AttachmentStore()
+    blob_path = store.add(temp_save_dir, "abcdef", [b"foo"])
+    os.mkdir(os.path.join(temp_save_dir, "msg"))
+    dest_path = os.path.join(temp_save_dir, "msg", "foo.txt")
+
+    store.link(blob_path, dest_path, DedupeLink.SYMLINK)
+
+    assert os.readlink(dest_path) == os.path.join("..", ".attachments", "ab", "abcdef")
+
+    moved_path = os.path.join(temp_save_dir, "foo.txt")
+    move_link(dest_path, moved_path)
+
+    assert os.readlink(moved_path) == os.path.join(".attachments", "ab", "abcdef")
+    with open(moved_path, "rb") as f:
+        assert f.read() == b"foo"
@@ -0,0 +1,146 @@
+from argparse import Namespace
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+import os
+import pytest
+import shutil
+import tempfile
+from unittest.mock import MagicMock
+from unittest.mock import patch
+
+from .context import save_message  # noqa: F401
+from tests.util import create_message_string
+
+from save_message._internal.cli_do import apply_rules_to_maildir
+from save_message.actions.actions import MessageActions
+from save_message.dates import pin_now
+from save_message.maildir import Maildir
+from save_message.model import Config
+from save_message.model import ConfigState
+from save_message.model import MessageAction
+from save_message.model import RuleMatch
+from save_message.model import RuleSettings
+from save_message.model import SaveRule
+from save_message.pdf import PdfCache
+from save_message.pdf import PdfConverter
+from save_message.rules import RulesMatcher
+from save_message.save import MessagePartSaver
+from save_message.state import MaildirStates
+
+
+@pytest.fixture
+def temp_maildir() -> str:
+    result = tempfile.mkdtemp()
+    for subdir in ["new", "cur", "tmp"]:
+        os.mkdir(os.path.join(result, subdir))
+
+    yield result
+
+    shutil.rmtree(result)
+    pin_now(None)
+
+
+def new_args(config: Config) -> Namespace:
+    """Return apply-rules args whose object graph provides what
+    apply_rules_to_maildir() needs (built for the now() pinned at the time)."""
+    provided = {
+        MaildirStates: MaildirStates(config),
+        MessagePartSaver: MagicMock(
+            pdf_converter=PdfConverter(Config(), PdfCache(Config()))
+        ),
+    }
+
+    og = MagicMock()
+    og.provide.side_effect = lambda cls: provided.get(cls) or RulesMatcher(config)
+
+    return Namespace(
+        og=og,
+        full=False,
+        shards=1,
+        subject=None,
+        from_=None,
+        to=None,
+        date=None,
+        since=None,
+        until=None,
+        force_deletes=False,
+    )
+
+
+def write_message(temp_maildir: str, date: datetime):
+    with open(os.path.join(temp_maildir, "cur", "1.M1P1.host:2,S"), "w") as f:
+        f.write(
+            create_message_string(
+                "simple_text_only", date=date.strftime("%a, %d %b %Y %H:%M:%S %z")
+            )
+        )
+
+
+def test_age_rule_applies_on_later_run(temp_maildir):
+    now0 = datetime(2022, 6, 20, 12, tzinfo=timezone.utc)
+    write_message(temp_maildir, now0 - timedelta(days=10))
+
+    delete_rule = SaveRule(
+        matches=[RuleMatch(age="90d")],
+        settings=RuleSettings(action=MessageAction.DELETE),
+    )
+    config = Config(
+        state=ConfigState(path=os.path.join(temp_maildir, "state")),
+        default_settings=RuleSettings(action=MessageAction.IGNORE),
+        save_rules=[delete_rule],
+    )
+    message_actions = MagicMock(spec=MessageActions)
+
+    def run() -> list:
+        args = new_args(config)
+        maildir = Maildir(
+            temp_maildir, args, args.og.provide(RulesMatcher), message_actions
+        )
+        message_actions.apply_rule.reset_mock()
+        assert apply_rules_to_maildir(args, maildir) == []
+
+        return [c.args[3] for c in message_actions.apply_rule.call_args_list]
+
+    pin_now(now0)
+    applied = run()
+    assert len(applied) == 1
+    assert applied[0].settings.action == MessageAction.IGNORE
+
+    # nothing has changed, so nothing is applied again
+    assert run() == []
+
+    # but once the message is old enough, the age rule applies to it
+    pin_now(now0 + timedelta(days=200))
+    assert run() == [delete_rule]
+
+
+def test_skipped_delete_not_decided(temp_maildir):
+    write_message(temp_maildir, datetime(2022, 6, 20, 12, tzinfo=timezone.utc))
+    config = Config(
+        state=ConfigState(path=os.path.join(temp_maildir, "state")),
+        default_settings=RuleSettings(action=MessageAction.DELETE),
+    )
+    message_actions = MagicMock(spec=MessageActions)
+    message_actions.apply_rule.side_effect = (
+        lambda maildir, k, m, rule, on_failed: maildir.delete(k, msg=m)
+    )
+
+    def run():
+        args = new_args(config)
+        maildir = Maildir(
+            temp_maildir, args, args.og.provide(RulesMatcher), message_actions
+        )
+        assert apply_rules_to_maildir(args, maildir) == []
+
+        return args.og.provide(MaildirStates).get_state(temp_maildir)
+
+    # as under cron, with no terminal to ask on
+    with patch("save_message.maildir.input", side_effect=EOFError):
+        assert run().decided_keys == set()
+
+    with patch("save_message.maildir.input", return_value="YES"):
+        assert run().decided_keys == set()
+
+    assert message_actions.apply_rule.call_count == 2
+    assert os.listdir(os.path.join(temp_maildir, "cur")) == []
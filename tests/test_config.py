@@ -108,3 +108,30 @@ def test_config(temp_save_dir):
             ),
         ],
     )
+
+
+def test_config_move_and_copy(temp_save_dir):
+    config = load_config_from_string(
+        temp_save_dir,
+        """
+        save_rules:
+            - matches:
+              - from_: "*@lists.example.com"
+              settings:
+                action: MOVE
+                target_maildir: ~/mail/lists
+
+            - matches:
+              - from_: boss@example.com
+              settings:
+                action: COPY
+                target_maildir: ~/mail/boss
+        """,
+    )
+
+    assert config.save_rules[0].settings == RuleSettings(
+        action=MessageAction.MOVE, target_maildir="~/mail/lists"
+    )
+    assert config.save_rules[1].settings == RuleSettings(
+        action=MessageAction.COPY, target_maildir="~/mail/boss"
+    )
@@ -0,0 +1,71 @@
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+import pytest
+from unittest.mock import patch
+
+from .context import save_message  # noqa: F401
+
+from save_message.dates import now
+from save_message.dates import parse_date
+from save_message.dates import parse_date_str
+from save_message.dates import pin_now
+
+
+@pytest.fixture
+def pinned():
+    when = datetime(2022, 6, 11, 13, 45, 43, tzinfo=timezone.utc)
+    pin_now(when)
+    yield when
+
+    pin_now(None)
+
+
+def test_parse_rfc_5322_date():
+    assert parse_date("Sat, 11 Jun 2022 13:45:43 +0000") == datetime(
+        2022, 6, 11, 13, 45, 43, tzinfo=timezone.utc
+    )
+
+
+def test_parse_rfc_5322_date_without_zone_is_aware():
+    for value in ["Mon, 1 Jan 2024 10:00:00 -0000", "Mon, 1 Jan 2024 10:00:00"]:
+        assert parse_date(value) == datetime(2024, 1, 1, 10, tzinfo=timezone.utc)
+
+
+def test_parse_non_rfc_5322_date_falls_back_to_dateutil():
+    assert parse_date("2022-06-11 13:45:43+01:00") == datetime(
+        2022, 6, 11, 13, 45, 43, tzinfo=timezone(timedelta(hours=1))
+    )
+
+
+def test_parse_invalid_date():
+    with pytest.raises(ValueError):
+        parse_date("not a date")
+
+
+def test_parse_none():
+    with pytest.raises(TypeError):
+        parse_date(None)
+
+
+@patch("save_message.dates.parsedate_to_datetime")
+def test_parse_date_is_memoized(parsedate_to_datetime):
+    parse_date_str.cache_clear()
+    parsedate_to_datetime.return_value = datetime(2022, 6, 11, tzinfo=timezone.utc)
+
+    for _ in range(3):
+        assert parse_date("Sat, 11 Jun 2022 00:00:00 +0000") == datetime(
+            2022, 6, 11, tzinfo=timezone.utc
+        )
+
+    parsedate_to_datetime.assert_called_once()
+    parse_date_str.cache_clear()
+
+
+def test_now_is_aware():
+    assert now().tzinfo is not None
+
+
+def test_now_pinned(pinned):
+    assert now() == pinned
+    assert now() == pinned
@@ -0,0 +1,169 @@
+import errno
+import os
+import pytest
+import shutil
+import tempfile
+from unittest.mock import patch
+
+from .context import save_message  # noqa: F401
+
+from save_message.fileops import DestinationNames
+from save_message.fileops import copy_file_contents
+from save_message.fileops import link_or_copy
+from save_message.fileops import move_no_replace
+
+
+@pytest.fixture
+def temp_save_dir() -> str:
+    result = tempfile.mkdtemp()
+    yield result
+
+    shutil.rmtree(result)
+
+
+def write_source(temp_save_dir, size: int = 3 * 1024 * 1024 + 17) -> str:
+    path = os.path.join(temp_save_dir, "src")
+    with open(path, "wb") as f:
+        f.write(os.urandom(size))
+
+    return path
+
+
+def assert_same_content(path1: str, path2: str):
+    with open(path1, "rb") as f1, open(path2, "rb") as f2:
+        assert f1.read() == f2.read()
+
+
+def test_link_or_copy_links(temp_save_dir):
+    src = write_source(temp_save_dir)
+    dest = os.path.join(temp_save_dir, "dest")
+
+    link_or_copy(src, dest)
+
+    assert os.path.samefile(src, dest)
+
+
+@patch("save_message.fileops.os.link")
+def test_link_or_copy_copies_across_filesystems(link, temp_save_dir):
+    link.side_effect = OSError(errno.EXDEV, "cross-device link")
+    src = write_source(temp_save_dir)
+    dest = os.path.join(temp_save_dir, "dest")
+
+    link_or_copy(src, dest)
+
+    assert not os.path.samefile(src, dest)
+    assert_same_content(src, dest)
+
+
+def test_copy_file_contents(temp_save_dir):
+    src = write_source(temp_save_dir)
+    dest = os.path.join(temp_save_dir, "dest")
+
+    copy_file_contents(src, dest)
+
+    assert_same_content(src, dest)
+
+
+@patch("save_message.fileops.try_reflink")
+@patch("save_message.fileops.os.copy_file_range")
+def test_copy_file_contents_buffered_fallback(
+    copy_file_range, try_reflink, temp_save_dir
+):
+    try_reflink.return_value = False
+    copy_file_range.side_effect = OSError(errno.EXDEV, "cross-device")
+    src = write_source(temp_save_dir)
+    dest = os.path.join(temp_save_dir, "dest")
+
+    copy_file_contents(src, dest)
+
+    assert_same_content(src, dest)
+
+
+def test_copy_file_contents_does_not_overwrite(temp_save_dir):
+    src = write_source(temp_save_dir)
+    dest = os.path.join(temp_save_dir, "dest")
+    with open(dest, "w") as f:
+        f.write("existing")
+
+    with pytest.raises(FileExistsError):
+        copy_file_contents(src, dest)
+
+
+def test_move_no_replace(temp_save_dir):
+    src = write_source(temp_save_dir, size=10)
+    dest = os.path.join(temp_save_dir, "dest")
+    with open(src, "rb") as f:
+        content = f.read()
+
+    move_no_replace(src, dest)
+
+    assert not os.path.exists(src)
+    with open(dest, "rb") as f:
+        assert f.read() == content
+
+
+@patch("save_message.fileops.os.link")
+def test_move_no_replace_without_links(link, temp_save_dir):
+    link.side_effect = OSError(errno.EPERM, "not permitted")
+    src = write_source(temp_save_dir, size=10)
+    dest = os.path.join(temp_save_dir, "dest")
+
+    move_no_replace(src, dest)
+
+    assert os.listdir(temp_save_dir) == ["dest"]
+
+
+def test_move_no_replace_does_not_overwrite(temp_save_dir):
+    src = write_source(temp_save_dir, size=10)
+    dest = os.path.join(temp_save_dir, "dest")
+    with open(dest, "w") as f:
+        f.write("existing")
+
+    with pytest.raises(FileExistsError):
+        move_no_replace(src, dest)
+
+    assert os.path.exists(src)
+
+
+def test_destination_names_lists_once(temp_save_dir):
+    os.mkdir(os.path.join(temp_save_dir, "Foo"))
+    destination_names = DestinationNames()
+    candidates = ["Foo", "Foo_1", "Foo_2"]
+
+    with patch("save_message.fileops.os.scandir", wraps=os.scandir) as scandir:
+        assert destination_names.mkdir(temp_save_dir, candidates) == os.path.join(
+            temp_save_dir, "Foo_1"
+        )
+        assert destination_names.mkdir(temp_save_dir, candidates) == os.path.join(
+            temp_save_dir, "Foo_2"
+        )
+
+    scandir.assert_called_once_with(temp_save_dir)
+    assert sorted(os.listdir(temp_save_dir)) == ["Foo", "Foo_1", "Foo_2"]
+
+    with pytest.raises(ValueError):
+        destination_names.mkdir(temp_save_dir, candidates)
+
+
+def test_destination_names_skips_names_taken_by_others(temp_save_dir):
+    destination_names = DestinationNames()
+    destination_names.mkdir(temp_save_dir, ["Bar"])
+
+    # made after the directory was listed
+    os.mkdir(os.path.join(temp_save_dir, "Foo"))
+
+    assert destination_names.mkdir(temp_save_dir, ["Foo", "Foo_1"]) == os.path.join(
+        temp_save_dir, "Foo_1"
+    )
+
+
+def test_destination_names_take(temp_save_dir):
+    destination_names = DestinationNames()
+    dest_dir = destination_names.mkdir(os.path.join(temp_save_dir, "a", "b"), ["c"])
+
+    with patch("save_message.fileops.os.scandir") as scandir:
+        assert destination_names.take(dest_dir, ["x", "y"]) == f"{dest_dir}/x"
+        assert destination_names.take(dest_dir, ["x", "y"]) == f"{dest_dir}/y"
+
+    scandir.assert_not_called()
+    assert os.listdir(dest_dir) == []
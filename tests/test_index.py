@@ -0,0 +1,71 @@
+import os
+import pytest
+import shutil
+import tempfile
+
+from .context import save_message  # noqa: F401
+from tests.util import create_message
+
+from save_message.index import HeaderIndex
+from save_message.model import Config
+from save_message.model import ConfigIndex
+
+
+@pytest.fixture
+def temp_save_dir() -> str:
+    result = tempfile.mkdtemp()
+    yield result
+
+    shutil.rmtree(result)
+
+
+@pytest.fixture
+def header_index(temp_save_dir) -> HeaderIndex:
+    return HeaderIndex(
+        Config(index=ConfigIndex(path=os.path.join(temp_save_dir, "index.sqlite")))
+    )
+
+
+def test_disabled_by_default():
+    assert not HeaderIndex(Config()).enabled
+
+
+def test_put_and_get(header_index):
+    msg = create_message(
+        "simple_text_only",
+        subject="Foo bar",
+        from_="Jonny T <jonny@example.com>",
+    )
+
+    header_index.put("/mail", "key-1", 100, 200, msg)
+
+    assert header_index.get("/mail", "key-1", 100, 200) == {
+        "subject": "Foo bar",
+        "from": "Jonny T <jonny@example.com>",
+        "to": "terftwminal@yahoo.com",
+        "date": "Sat, 11 Jun 2022 13:45:43 +0000",
+        "message-id": str(msg["message-id"]),
+    }
+
+
+def test_get_changed_file_returns_none(header_index):
+    header_index.put("/mail", "key-1", 100, 200, create_message("simple_text_only"))
+
+    assert header_index.get("/mail", "key-1", 101, 200) is None
+    assert header_index.get("/mail", "key-1", 100, 201) is None
+    assert header_index.get("/other-mail", "key-1", 100, 200) is None
+
+
+def test_scan_prunes_unseen_keys(header_index):
+    msg = create_message("simple_text_only")
+    header_index.put("/mail", "key-1", 100, 200, msg)
+    header_index.put("/mail", "key-2", 100, 200, msg)
+    header_index.put("/other-mail", "key-3", 100, 200, msg)
+
+    header_index.begin_scan("/mail")
+    header_index.seen("key-1")
+    header_index.end_scan("/mail")
+
+    assert header_index.get("/mail", "key-1", 100, 200) is not None
+    assert header_index.get("/mail", "key-2", 100, 200) is None
+    assert header_index.get("/other-mail", "key-3", 100, 200) is not None
@@ -0,0 +1,91 @@
+import os
+import pytest
+import shutil
+import tempfile
+
+from .context import save_message  # noqa: F401
+from tests.util import create_message
+from tests.util import create_message_string
+
+from save_message.ledger import SaveLedger
+from save_message.ledger import ledger_key
+from save_message.message import LazyEmailMessage
+from save_message.model import Config
+from save_message.model import ConfigLedger
+
+
+@pytest.fixture
+def temp_save_dir() -> str:
+    result = tempfile.mkdtemp()
+    yield result
+
+    shutil.rmtree(result)
+
+
+@pytest.fixture
+def save_ledger(temp_save_dir) -> SaveLedger:
+    return SaveLedger(
+        Config(ledger=ConfigLedger(path=os.path.join(temp_save_dir, "ledger.sqlite")))
+    )
+
+
+def test_disabled_by_default():
+    assert not SaveLedger(Config()).enabled
+
+
+def test_key_is_message_id():
+    msg = create_message("simple_text_only")
+
+    assert ledger_key(msg) == "message-id:" + str(msg["message-id"]).strip()
+
+
+def test_key_without_message_id_is_content_hash(temp_save_dir):
+    message_string = create_message_string("simple_text_only")
+    message_string = "\n".join(
+        line
+        for line in message_string.split("\n")
+        if not line.lower().startswith("message-id:")
+    )
+
+    path = os.path.join(temp_save_dir, "1.M1P1.host:2,S")
+    with open(path, "w") as f:
+        f.write(message_string)
+
+    msg = LazyEmailMessage(path)
+    key = ledger_key(msg)
+
+    assert key.startswith("sha256:")
+    assert key == ledger_key(LazyEmailMessage(path))
+
+
+def test_put_and_get(save_ledger, temp_save_dir):
+    dest = os.path.join(temp_save_dir, "Foo")
+    os.mkdir(dest)
+
+    save_ledger.put(
+        "message-id:<a@b>", "/save", "abc", dest, f"{dest}/Foo.txt", ["x.ics"]
+    )
+
+    assert save_ledger.get("message-id:<a@b>", "/save", "abc") == (
+        f"{dest}/Foo.txt",
+        ["x.ics"],
+    )
+    assert save_ledger.get("message-id:<a@b>", "/other-save", "abc") is None
+    assert save_ledger.get("message-id:<c@d>", "/save", "abc") is None
+
+
+def test_get_different_content_returns_none(save_ledger, temp_save_dir):
+    dest = os.path.join(temp_save_dir, "Foo")
+    os.mkdir(dest)
+
+    save_ledger.put("message-id:<a@b>", "/save", "abc", dest, None, [])
+
+    assert save_ledger.get("message-id:<a@b>", "/save", "def") is None
+
+
+def test_get_missing_dest_returns_none(save_ledger, temp_save_dir):
+    dest = os.path.join(temp_save_dir, "Foo")
+
+    save_ledger.put("message-id:<a@b>", "/save", "abc", dest, None, [])
+
+    assert save_ledger.get("message-id:<a@b>", "/save", "abc") is None
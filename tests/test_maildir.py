@@ -1,9 +1,16 @@
+from datetime import datetime
+from datetime import timezone
 from email.message import EmailMessage
+import errno
+import os
 import pytest
+import shutil
+import tempfile
 from unittest.mock import MagicMock
 from unittest.mock import patch
 
 from .context import save_message  # noqa: F401
+from tests.util import create_message_string
 
 from save_message.model import MessageAction
 from save_message.model import RuleSettings
@@ -121,10 +128,12 @@ def do_apply_rules_test(
     maildir_.delete = MagicMock()
 
     # when
-    maildir_.apply_rules(key)
+    maildir_.apply_rules(key, message)
 
     # then
-    maildir_.message_actions.apply_rules.assert_called_with(maildir_, key)
+    maildir_.message_actions.apply_rules.assert_called_with(
+        maildir_, key, message, on_failed=None
+    )
 
 
 def test_apply_rules(maildir_):
@@ -136,3 +145,182 @@ def test_apply_rules(maildir_):
     do_apply_rules_test(
         maildir_=maildir_, rule=rule, should_delete=False, should_save=True
     )
+
+
+def test_delete_with_prompt_uses_given_message(maildir_):
+    message = {
+        "date": "yesterday",
+        "from": "jonny@example.com",
+        "subject": "My test message",
+    }
+    maildir_.args.force_deletes = False
+
+    with patch("save_message.maildir.input", return_value="YES"):
+        maildir_.delete("key-123456abc", msg=message)
+
+    maildir_.maildir.get.assert_not_called()
+    maildir_.maildir.remove.assert_called_with("key-123456abc")
+
+
+def test_delete_without_terminal_is_skipped(maildir_):
+    maildir_.args.force_deletes = False
+
+    with patch("save_message.maildir.input", side_effect=EOFError):
+        assert not maildir_.delete("key-123456abc", msg=MagicMock())
+
+    maildir_.maildir.remove.assert_not_called()
+    assert maildir_.skipped_deletes == {"key-123456abc"}
+
+    assert maildir_.delete("key-123456abc", force=True)
+
+
+@pytest.fixture
+def temp_maildir() -> str:
+    result = tempfile.mkdtemp()
+    for subdir in ["new", "cur", "tmp"]:
+        os.mkdir(os.path.join(result, subdir))
+
+    yield result
+
+    shutil.rmtree(result)
+
+
+def write_maildir_message(temp_maildir, subdir: str, name: str, **msg_args) -> str:
+    path = os.path.join(temp_maildir, subdir, name)
+    with open(path, "w") as f:
+        f.write(create_message_string("simple_text_only", **msg_args))
+
+    return path
+
+
+def new_maildir(path: str, trust_delivery_time: bool = False) -> maildir.Maildir:
+    return maildir.Maildir(
+        path=path,
+        args=MagicMock(),
+        rules_matcher=MagicMock(spec=RulesMatcher),
+        message_actions=MagicMock(spec=MessageActions),
+        trust_delivery_time=trust_delivery_time,
+    )
+
+
+def test_search_since_until(temp_maildir):
+    for day in [1, 10, 20]:
+        delivered = datetime(2022, 6, day, 12, tzinfo=timezone.utc)
+        write_maildir_message(
+            temp_maildir,
+            "cur",
+            f"{int(delivered.timestamp())}.M1P1.host:2,S",
+            date=delivered.strftime("%a, %d %b %Y %H:%M:%S %z"),
+            subject=f"Day {day}",
+        )
+
+    result = new_maildir(temp_maildir).search(
+        since=datetime(2022, 6, 10, 12, tzinfo=timezone.utc),
+        until=datetime(2022, 6, 20, tzinfo=timezone.utc),
+    )
+
+    assert [m["subject"] for k, m in result] == ["Day 10"]
+
+
+def test_search_since_imported_message(temp_maildir):
+    # a 2015 message, synced into the maildir on 2022-06-20
+    synced = datetime(2022, 6, 20, 12, tzinfo=timezone.utc)
+    write_maildir_message(
+        temp_maildir,
+        "cur",
+        f"{int(synced.timestamp())}.M1P1.host:2,S",
+        date="Thu, 11 Jun 2015 12:00:00 +0000",
+    )
+    since = datetime(2022, 6, 10, 12, tzinfo=timezone.utc)
+
+    assert list(new_maildir(temp_maildir).search(since=since)) == []
+
+    # trusting the delivery time gets this wrong, which is why it is opt-in
+    assert len(list(new_maildir(temp_maildir, True).search(since=since))) == 1
+
+
+def test_scan(temp_maildir):
+    write_maildir_message(temp_maildir, "new", "1.M1P1.host")
+    write_maildir_message(temp_maildir, "cur", "2.M1P1.host:2,S")
+    os.mkdir(os.path.join(temp_maildir, "cur", "not-a-message"))
+
+    maildir_ = new_maildir(temp_maildir)
+
+    assert [(k, e.path) for k, e in maildir_.scan()] == [
+        ("1.M1P1.host", os.path.join(temp_maildir, "new", "1.M1P1.host")),
+        ("2.M1P1.host", os.path.join(temp_maildir, "cur", "2.M1P1.host:2,S")),
+    ]
+    assert set(maildir_.keys()) == set(maildir_.maildir.keys())
+
+
+def test_search_limit(temp_maildir):
+    for i in range(5):
+        write_maildir_message(temp_maildir, "cur", f"{i}.M1P1.host:2,S")
+
+    maildir_ = new_maildir(temp_maildir)
+
+    assert len(list(maildir_.search(limit=2))) == 2
+    assert len(list(maildir_.search())) == 5
+
+
+def test_delete_searched_message(temp_maildir):
+    path = write_maildir_message(temp_maildir, "cur", "1.M1P1.host:2,S")
+
+    maildir_ = new_maildir(temp_maildir)
+    for k, m in maildir_.search():
+        maildir_.delete(k, force=True, msg=m)
+
+    assert not os.path.exists(path)
+
+
+def test_move(temp_maildir):
+    path = write_maildir_message(temp_maildir, "cur", "1.M1P1.host:2,RS")
+    dest = os.path.join(temp_maildir, "archive")
+
+    maildir_ = new_maildir(temp_maildir)
+    for k, m in maildir_.search():
+        maildir_.move(k, dest, msg=m)
+
+    assert not os.path.exists(path)
+    assert os.listdir(os.path.join(dest, "cur")) == ["1.M1P1.host:2,RS"]
+    assert os.listdir(os.path.join(dest, "new")) == []
+
+
+def test_copy(temp_maildir):
+    path = write_maildir_message(temp_maildir, "new", "1.M1P1.host")
+    dest = os.path.join(temp_maildir, "archive")
+
+    maildir_ = new_maildir(temp_maildir)
+    for _ in range(2):  # copying again is a no-op
+        for k, m in maildir_.search():
+            maildir_.copy(k, dest, msg=m)
+
+    copied = os.path.join(dest, "new", "1.M1P1.host")
+    assert os.path.samefile(path, copied)
+
+
+@patch("save_message.maildir.os.link")
+def test_copy_across_filesystems(link, temp_maildir):
+    link.side_effect = OSError(errno.EXDEV, "cross-device link")
+    path = write_maildir_message(temp_maildir, "cur", "1.M1P1.host:2,S")
+    dest = os.path.join(temp_maildir, "archive")
+
+    copied = maildir.file_into_maildir(path, dest, move=False)
+
+    assert copied == os.path.join(dest, "cur", "1.M1P1.host:2,S")
+    assert not os.path.samefile(path, copied)
+    with open(path, "rb") as f1, open(copied, "rb") as f2:
+        assert f1.read() == f2.read()
+    assert os.stat(path).st_mtime == os.stat(copied).st_mtime
+    assert os.listdir(os.path.join(dest, "tmp")) == []
+
+
+def test_move_onto_existing_message_fails(temp_maildir):
+    path = write_maildir_message(temp_maildir, "cur", "1.M1P1.host:2,S")
+    dest = os.path.join(temp_maildir, "archive")
+    maildir.file_into_maildir(path, dest, move=False)
+
+    with pytest.raises(FileExistsError):
+        maildir.file_into_maildir(path, dest, move=True)
+
+    assert os.path.exists(path)
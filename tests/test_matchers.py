@@ -1,12 +1,16 @@
 from datetime import datetime
 from datetime import timedelta
+from datetime import timezone
 import pytest
 import shutil
 import tempfile
+from unittest.mock import MagicMock
 
 from .context import save_message  # noqa: F401
 from tests.util import create_message
 
+from save_message.dates import pin_now
+from save_message.matchers import AdaptiveAndMatcher
 from save_message.matchers import AndMatcher
 from save_message.matchers import OrMatcher
 from save_message.matchers import SubjectMatcher
@@ -16,6 +20,7 @@ from save_message.matchers import DateMatcher
 from save_message.matchers import AgeMatcher
 from save_message.matchers import ToMatcher
 from save_message.matchers import Matcher
+from save_message.matchers import order_by_cost
 from save_message.matchers import rule_matches_to_matcher
 from save_message.model import RuleMatch
 
@@ -146,6 +151,15 @@ def test_age_positive():
     )
 
 
+def test_date_in_unknown_zone():
+    # -0000 is UTC, with the sender's local zone unknown
+    do_or_matcher_test(
+        matchers=[DateMatcher(match_date="2024-01-01 10:00:00 +0000")],
+        date="Mon, 1 Jan 2024 10:00:00 -0000",
+        expected=True,
+    )
+
+
 def test_to_address_regex():
     do_or_matcher_test(
         to="Jonny T <jonny@example.com>",
@@ -203,3 +217,64 @@ def test_all_fields_save_rule(temp_save_dir):
             ]
         ),
     )
+
+
+def test_order_by_cost():
+    body = BodyMatcher(match_body="Thank you*")
+    date = DateMatcher(match_date="Sat, 11 Jun 2022 13:45:43 +0000")
+    from_ = FromMatcher(match_from="*@from.com")
+    subject = SubjectMatcher(match_subject="Foo*")
+    to = ToMatcher(match_to="test@example.com")
+
+    assert order_by_cost([body, date, to, from_, subject]) == [
+        subject,
+        to,
+        from_,
+        date,
+        body,
+    ]
+
+
+def new_counting_matcher(cost: int, result: bool) -> Matcher:
+    r = MagicMock(spec=Matcher)
+    r.cost = cost
+    r.matches.return_value = result
+    return r
+
+
+def test_adaptive_and_matcher_runs_rejecting_matcher_first():
+    rarely_rejects = new_counting_matcher(1, True)
+    always_rejects = new_counting_matcher(2, False)
+
+    matcher = AdaptiveAndMatcher([rarely_rejects, always_rejects])
+    msg = create_message(template="simple_text_only")
+
+    for _ in range(AdaptiveAndMatcher.REORDER_EVERY):
+        assert not matcher.matches(msg)
+
+    assert matcher.matchers == [always_rejects, rarely_rejects]
+
+    rarely_rejects.matches.reset_mock()
+    for _ in range(10):
+        assert not matcher.matches(msg)
+
+    rarely_rejects.matches.assert_not_called()
+
+
+def test_age_uses_pinned_now():
+    pin_now(datetime(2022, 6, 13, tzinfo=timezone.utc))
+
+    try:
+        do_or_matcher_test(
+            matchers=[AgeMatcher("1d")],
+            date="Sat, 11 Jun 2022 13:45:43 +0000",
+            expected=True,
+        )
+        do_or_matcher_test(
+            matchers=[AgeMatcher("3d")],
+            date="Sat, 11 Jun 2022 13:45:43 +0000",
+            expected=False,
+        )
+
+    finally:
+        pin_now(None)
@@ -0,0 +1,204 @@
+from datetime import datetime
+from datetime import timezone
+import email
+import os
+import pytest
+import shutil
+import tempfile
+from unittest.mock import patch
+
+from .context import save_message  # noqa: F401
+from tests.util import create_message
+from tests.util import create_message_string
+
+from save_message.message import LazyEmailMessage
+from save_message.message import MessageView
+from save_message.message import maildir_delivery_time
+from save_message.message import read_header_block
+
+
+@pytest.fixture
+def temp_save_dir() -> str:
+    result = tempfile.mkdtemp()
+    yield result
+
+    shutil.rmtree(result)
+
+
+def write_message(temp_save_dir, template: str, **msg_args) -> str:
+    path = os.path.join(temp_save_dir, template)
+    with open(path, "w") as f:
+        f.write(create_message_string(template, **msg_args))
+
+    return path
+
+
+def test_read_header_block_stops_at_blank_line(temp_save_dir):
+    path = write_message(temp_save_dir, "simple_text_only")
+
+    with open(path, "rb") as f:
+        header_block = read_header_block(f)
+        rest = f.read()
+
+    assert header_block.endswith(b"\n\n")
+    assert b"Thank you for using Amazon Web Services!" in rest
+    assert b"Thank you for using Amazon Web Services!" not in header_block
+
+
+def test_headers_available_without_loading_body(temp_save_dir):
+    path = write_message(
+        temp_save_dir,
+        "text_html_with_calendar_attachment",
+        subject="Foo bar",
+        from_="Jonny T <jonny@example.com>",
+    )
+
+    msg = LazyEmailMessage(path)
+
+    assert msg["subject"] == "Foo bar"
+    assert msg["from"] == "Jonny T <jonny@example.com>"
+    assert msg.get_content_type() == "multipart/mixed"
+    assert not msg._body_loaded
+
+
+def test_walk_loads_body(temp_save_dir):
+    path = write_message(temp_save_dir, "text_html_with_calendar_attachment")
+
+    msg = LazyEmailMessage(path)
+    with open(path, "rb") as f:
+        expected = email.message_from_binary_file(f, policy=email.policy.default)
+
+    assert [p.get_content_type() for p in msg.walk()] == [
+        p.get_content_type() for p in expected.walk()
+    ]
+    assert [p.get_payload(decode=True) for p in msg.walk()] == [
+        p.get_payload(decode=True) for p in expected.walk()
+    ]
+    assert msg._body_loaded
+
+
+def test_as_bytes_matches_eager_parse(temp_save_dir):
+    path = write_message(temp_save_dir, "simple_text_only")
+
+    msg = LazyEmailMessage(path)
+    with open(path, "rb") as f:
+        expected = email.message_from_binary_file(f, policy=email.policy.default)
+
+    assert msg.as_bytes() == expected.as_bytes()
+
+
+def test_known_headers_do_not_read_file(temp_save_dir):
+    path = os.path.join(temp_save_dir, "missing")
+
+    msg = LazyEmailMessage(path, headers={"subject": "Foo bar", "to": None})
+
+    assert msg["subject"] == "Foo bar"
+    assert msg["to"] is None
+
+
+def test_unknown_header_reads_header_block(temp_save_dir):
+    path = write_message(temp_save_dir, "simple_text_only", subject="Foo bar")
+
+    msg = LazyEmailMessage(path, headers={"subject": "Foo bar"})
+
+    assert msg.get_content_type() == "multipart/alternative"
+    assert msg["from"] == "Amazon Web Services <aws-verification@amazon.com>"
+    assert not msg._body_loaded
+
+
+def test_view_is_shared_per_message():
+    msg = create_message("simple_text_only")
+
+    assert MessageView.of(msg) is MessageView.of(msg)
+    assert MessageView.of(MessageView.of(msg)) is MessageView.of(msg)
+    assert MessageView.of(msg) is not MessageView.of(create_message("simple_text_only"))
+
+
+def test_view_fields():
+    msg = create_message(
+        "simple_text_only",
+        subject="Foo bar\nbaz",
+        from_="Jonny T <jonny@example.com>",
+    )
+
+    view = MessageView.of(msg)
+
+    assert view.subject == "Foo bar"
+    assert view.from_parts == ("Jonny T", "jonny@example.com")
+    assert view.to_parts == ("", "terftwminal@yahoo.com")
+    assert view.date.year == 2022
+    assert "Thank you for using Amazon Web Services!" in view.body_text
+    assert view["subject"] == msg["subject"]
+
+
+@patch("save_message.message.parseaddr")
+def test_view_fields_computed_once(parseaddr):
+    parseaddr.return_value = ("Jonny T", "jonny@example.com")
+    msg = create_message("simple_text_only")
+
+    for _ in range(3):
+        assert MessageView.of(msg).from_parts[1] == "jonny@example.com"
+
+    parseaddr.assert_called_once()
+
+
+def test_view_of_dict_is_not_shared():
+    msg = {"subject": "Foo bar"}
+
+    assert MessageView.of(msg).subject == "Foo bar"
+    assert MessageView.of(msg) is not MessageView.of(msg)
+
+
+def test_delivery_time_from_name():
+    assert maildir_delivery_time("/mail/cur/1654955143.M1P2.host:2,S") == 1654955143
+
+
+def test_delivery_time_from_mtime(temp_save_dir):
+    path = write_message(temp_save_dir, "simple_text_only")
+    os.utime(path, (1654955143, 1654955143))
+
+    assert maildir_delivery_time(path) == 1654955143
+
+
+def test_compare_date_from_delivery_time_does_not_read_file(temp_save_dir):
+    # delivered 2022-06-11 13:45:43 UTC, and the file doesn't exist
+    msg = LazyEmailMessage(
+        os.path.join(temp_save_dir, "1654955143.M1P2.host"), trust_delivery_time=True
+    )
+    view = MessageView.of(msg)
+
+    assert view.compare_date(datetime(2022, 6, 1, tzinfo=timezone.utc)) > 0
+    assert view.compare_date(datetime(2022, 6, 20, tzinfo=timezone.utc)) < 0
+
+
+def test_compare_date_near_delivery_time_uses_date_header(temp_save_dir):
+    path = os.path.join(temp_save_dir, "1654955143.M1P2.host")
+    with open(path, "w") as f:
+        f.write(
+            create_message_string(
+                "simple_text_only", date="Sat, 11 Jun 2022 12:00:00 +0000"
+            )
+        )
+
+    view = MessageView.of(LazyEmailMessage(path, trust_delivery_time=True))
+
+    assert view.compare_date(datetime(2022, 6, 11, 11, tzinfo=timezone.utc)) > 0
+    assert view.compare_date(datetime(2022, 6, 11, 12, tzinfo=timezone.utc)) == 0
+    assert view.compare_date(datetime(2022, 6, 11, 13, tzinfo=timezone.utc)) < 0
+
+
+def test_compare_date_imported_message_uses_date_header(temp_save_dir):
+    # a 2015 message, synced into the maildir on 2022-06-11
+    path = os.path.join(temp_save_dir, "1654955143.M1P2.host")
+    with open(path, "w") as f:
+        f.write(
+            create_message_string(
+                "simple_text_only", date="Thu, 11 Jun 2015 12:00:00 +0000"
+            )
+        )
+
+    view = MessageView.of(LazyEmailMessage(path))
+
+    assert view.delivery_time is None
+    assert view.compare_date(datetime(2020, 1, 1, tzinfo=timezone.utc)) < 0
+    assert view.compare_date(datetime(2015, 1, 1, tzinfo=timezone.utc)) > 0
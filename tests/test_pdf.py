@@ -0,0 +1,206 @@
+import os
+import pytest
+import shutil
+import tempfile
+
+from unittest.mock import MagicMock
+
+from .context import save_message  # noqa: F401
+
+from save_message.model import Config
+from save_message.model import ConfigPdf
+from save_message.model import ConfigPdfCache
+from save_message.pdf import PdfCache
+from save_message.pdf import PdfConverter
+from save_message.pdf import pdf_cache_key
+
+
+@pytest.fixture
+def temp_save_dir() -> str:
+    result = tempfile.mkdtemp()
+    yield result
+
+    shutil.rmtree(result)
+
+
+def submit_conversion(
+    pdf_converter: PdfConverter,
+    temp_save_dir: str,
+    command: str,
+    name: str,
+    html: str | None = None,
+) -> tuple[str, str, MagicMock]:
+    html = html or f"<p>{name}</p>"
+    temp_dir = tempfile.mkdtemp()
+    input_filename = os.path.join(temp_dir, "inputmsg")
+    with open(input_filename, "w") as f:
+        f.write(html)
+
+    dest_path = os.path.join(temp_save_dir, f"{name}.pdf")
+    on_done = MagicMock()
+    pdf_converter.submit(
+        command,
+        input_filename,
+        dest_path,
+        temp_dir,
+        on_done,
+        cache_key=pdf_cache_key(command, [html.encode()]),
+    )
+
+    return temp_dir, dest_path, on_done
+
+
+def test_wait_reports_each_conversion(temp_save_dir):
+    config = Config(pdf=ConfigPdf(jobs=2))
+    pdf_converter = PdfConverter(config, PdfCache(config))
+
+    conversions = [
+        submit_conversion(pdf_converter, temp_save_dir, "cp $in $out", str(i))
+        for i in range(10)
+    ]
+    failed = submit_conversion(pdf_converter, temp_save_dir, "false $in $out", "x")
+
+    pdf_converter.wait()
+
+    for temp_dir, dest_path, on_done in conversions:
+        on_done.assert_called_once_with(None)
+        assert os.path.exists(dest_path)
+        assert not os.path.exists(temp_dir)
+
+    assert failed[2].call_args.args[0] is not None
+    assert not os.path.exists(failed[0])
+    assert pdf_converter.pending == []
+
+
+def test_submit_bounds_queue(temp_save_dir):
+    config = Config(pdf=ConfigPdf(jobs=1))
+    pdf_converter = PdfConverter(config, PdfCache(config))
+
+    for i in range(20):
+        submit_conversion(pdf_converter, temp_save_dir, "cp $in $out", str(i))
+        assert len(pdf_converter.pending) <= 4
+
+    pdf_converter.wait()
+
+
+def new_cached_pdf_converter(temp_save_dir: str, max_size: int = 1024 * 1024):
+    config = Config(
+        pdf=ConfigPdf(
+            cache=ConfigPdfCache(
+                path=os.path.join(temp_save_dir, "cache"), max_size=max_size
+            )
+        )
+    )
+    return PdfConverter(config, PdfCache(config))
+
+
+def write_counting_command(temp_save_dir: str) -> str:
+    """Return a command that copies $in to $out, and logs a line to
+    'count' each time it is run."""
+    script = os.path.join(temp_save_dir, "convert.sh")
+    with open(script, "w") as f:
+        f.write(f'#!/bin/sh\necho >> "{temp_save_dir}/count"\ncp "$1" "$2"\n')
+
+    os.chmod(script, 0o755)
+    return f"{script} $in $out"
+
+
+def count_runs(temp_save_dir: str) -> int:
+    with open(os.path.join(temp_save_dir, "count")) as f:
+        return len(f.readlines())
+
+
+def test_cache_key():
+    assert pdf_cache_key("cmd", [b"<p>", b"a</p>"]) == pdf_cache_key(
+        "cmd", [b"<p>a</p>"]
+    )
+    assert pdf_cache_key("cmd", [b"<p>a</p>"]) != pdf_cache_key(
+        "other cmd", [b"<p>a</p>"]
+    )
+
+
+def test_cache_hits_skip_conversion(temp_save_dir):
+    command = write_counting_command(temp_save_dir)
+
+    pdf_converter = new_cached_pdf_converter(temp_save_dir)
+    submit_conversion(pdf_converter, temp_save_dir, command, "1", html="<p>a</p>")
+    pdf_converter.wait()
+
+    # a new converter (i.e. a later run), sharing the cache directory
+    pdf_converter = new_cached_pdf_converter(temp_save_dir)
+    _, dest_path, on_done = submit_conversion(
+        pdf_converter, temp_save_dir, command, "2", html="<p>a</p>"
+    )
+    pdf_converter.wait()
+
+    on_done.assert_called_once_with(None)
+    assert count_runs(temp_save_dir) == 1
+
+    with open(dest_path) as f:
+        assert f.read() == "<p>a</p>"
+
+
+def test_identical_conversions_in_flight_run_once(temp_save_dir):
+    command = write_counting_command(temp_save_dir)
+
+    config = Config(pdf=ConfigPdf(jobs=2))
+    pdf_converter = PdfConverter(config, PdfCache(config))
+    conversions = [
+        submit_conversion(
+            pdf_converter, temp_save_dir, command, str(i), html="<p>a</p>"
+        )
+        for i in range(5)
+    ]
+    pdf_converter.wait()
+
+    assert count_runs(temp_save_dir) == 1
+
+    for _, dest_path, on_done in conversions:
+        on_done.assert_called_once_with(None)
+
+        with open(dest_path) as f:
+            assert f.read() == "<p>a</p>"
+
+
+def test_identical_conversion_copied_before_original_moved(temp_save_dir):
+    config = Config(pdf=ConfigPdf(jobs=2))
+    pdf_converter = PdfConverter(config, PdfCache(config))
+
+    _, first_path, first_on_done = submit_conversion(
+        pdf_converter, temp_save_dir, "cp $in $out", "1", html="<p>a</p>"
+    )
+    moved_path = os.path.join(temp_save_dir, "moved.pdf")
+
+    # as flattening does, in finish_save()
+    first_on_done.side_effect = lambda ex: os.rename(first_path, moved_path)
+
+    _, second_path, second_on_done = submit_conversion(
+        pdf_converter, temp_save_dir, "cp $in $out", "2", html="<p>a</p>"
+    )
+    pdf_converter.wait()
+
+    first_on_done.assert_called_once_with(None)
+    second_on_done.assert_called_once_with(None)
+    assert pdf_converter.copies == {}
+
+    for path in [moved_path, second_path]:
+        with open(path) as f:
+            assert f.read() == "<p>a</p>"
+
+
+def test_cache_evicts_least_recently_used(temp_save_dir):
+    pdf_cache = new_cached_pdf_converter(temp_save_dir, max_size=2500).pdf_cache
+
+    for i, key in enumerate(["aa01", "bb02", "cc03"]):
+        pdf_path = os.path.join(temp_save_dir, f"{key}.pdf")
+        with open(pdf_path, "wb") as f:
+            f.write(b"x" * 1000)
+
+        pdf_cache.store(key, pdf_path)
+
+        # make each file's mtime distinct, oldest first
+        os.utime(pdf_cache.__path__(key), (i, i))
+
+    assert not pdf_cache.fetch("aa01", os.path.join(temp_save_dir, "out1.pdf"))
+    assert pdf_cache.fetch("bb02", os.path.join(temp_save_dir, "out2.pdf"))
+    assert pdf_cache.fetch("cc03", os.path.join(temp_save_dir, "out3.pdf"))
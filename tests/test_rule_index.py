@@ -0,0 +1,107 @@
+from .context import save_message  # noqa: F401
+from tests.util import create_message
+
+from save_message.matchers import AndMatcher
+from save_message.matchers import BodyMatcher
+from save_message.matchers import FromMatcher
+from save_message.matchers import SubjectMatcher
+from save_message.matchers import ToMatcher
+from save_message.rule_index import RuleIndex
+from save_message.rule_index import literal_prefix
+
+
+def new_rule_index(*conjs) -> RuleIndex:
+    index = RuleIndex()
+    for conj_id, conj in enumerate(conjs):
+        index.add(conj, conj_id)
+
+    return index
+
+
+def candidate_ids(index: RuleIndex, msg) -> list[int]:
+    return [conj_id for conj_id, _ in index.candidates(msg)]
+
+
+def test_literal_prefix():
+    assert literal_prefix("foo@example.com") == "foo@example.com"
+    assert literal_prefix("foo*@example.com") == "foo"
+    assert literal_prefix("fo?@example.com") == "fo"
+    assert literal_prefix("*@example.com") == ""
+
+
+def test_candidates_by_prefix():
+    msg = create_message(
+        "simple_text_only",
+        subject="Your invoice",
+        from_="Foo <foo@example.com>",
+    )
+
+    index = new_rule_index(
+        AndMatcher([FromMatcher("bar@example.com")]),
+        AndMatcher([FromMatcher("foo@*")]),
+        AndMatcher([SubjectMatcher("Your invoice*")]),
+        AndMatcher([SubjectMatcher("Your order*")]),
+        AndMatcher([FromMatcher("Foo <*")]),
+        AndMatcher([ToMatcher("*@yahoo.com")]),
+    )
+
+    assert candidate_ids(index, msg) == [1, 2, 4, 5]
+
+
+def test_unindexable_conjunctions_always_candidates():
+    msg = create_message("simple_text_only", from_="foo@example.com")
+
+    index = new_rule_index(
+        AndMatcher([FromMatcher("/bar@.*/")]),
+        AndMatcher([BodyMatcher("Thank you*")]),
+        AndMatcher([]),
+        AndMatcher([FromMatcher("bar@example.com")]),
+    )
+
+    assert candidate_ids(index, msg) == [0, 1, 2]
+
+
+def test_conjunction_filed_under_longest_prefix():
+    msg = create_message("simple_text_only", subject="Foo bar", from_="foo@example.com")
+
+    index = new_rule_index(
+        AndMatcher([SubjectMatcher("F*"), FromMatcher("bar@example.com")]),
+        AndMatcher([SubjectMatcher("Foo*"), FromMatcher("*@example.com")]),
+    )
+
+    assert candidate_ids(index, msg) == [1]
+
+
+def test_literal_and_domain_hits_need_no_further_check():
+    msg = create_message(
+        "simple_text_only",
+        from_="Foo <foo@example.com>",
+        to="Bar <bar@example.org>",
+    )
+
+    from_literal = FromMatcher("foo@example.com")
+    to_domain = ToMatcher("*@example.org")
+    subject = SubjectMatcher("Your*")
+
+    index = new_rule_index(
+        AndMatcher([from_literal]),
+        AndMatcher([to_domain, subject]),
+        AndMatcher([ToMatcher("*@example.com")]),
+        AndMatcher([FromMatcher("foo@example.co")]),
+        AndMatcher([FromMatcher("*@example")]),
+    )
+
+    candidates = index.candidates(msg)
+
+    # literals and domains match as prefixes, as re.match() would
+    assert [conj_id for conj_id, _ in candidates] == [0, 1, 3, 4]
+    assert candidates[0][1] == AndMatcher([])
+    assert candidates[1][1] == AndMatcher([subject])
+
+
+def test_domain_needs_something_before_at():
+    msg = create_message("simple_text_only", from_="@example.com")
+
+    index = new_rule_index(AndMatcher([FromMatcher("*@example.com")]))
+
+    assert candidate_ids(index, msg) == []
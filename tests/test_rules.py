@@ -4,9 +4,13 @@ from unittest.mock import patch
 from .context import save_message  # noqa: F401
 from tests.util import create_message
 
+from save_message.matchers import AdaptiveAndMatcher
 from save_message.matchers import Matcher
 from save_message.matchers import OrMatcher
+from save_message.message import MessageView
 from save_message.model import Config
+from save_message.model import MessageAction
+from save_message.model import RuleMatch
 from save_message.model import RuleSettings
 from save_message.model import SaveRule
 from save_message.rules import RulesMatcher
@@ -24,13 +28,19 @@ def new_non_matching_matcher():
     return r
 
 
+def new_config():
+    config = MagicMock(spec=Config)
+    config.adaptive_match_ordering = False
+    return config
+
+
 def do_match_save_rule_test(
     mock_rule_matches_to_matcher,
     rule_matchers_result,
     default_settings=None,
     expected_save_rule=None,
 ):
-    config = MagicMock(spec=Config)
+    config = new_config()
     save_rule = sr()
     config.save_rules = [save_rule]
 
@@ -82,6 +92,91 @@ def test_no_match_returns_default_settings(
     )
 
 
+@patch("save_message.rules.rule_matches_to_matcher")
+def test_match_ordinal(mock_rule_matches_to_matcher):
+    config = new_config()
+    config.save_rules = [sr(), sr(), sr()]
+
+    mock_rule_matches_to_matcher.side_effect = [
+        new_non_matching_matcher(),
+        new_matching_matcher(),
+        new_matching_matcher(),
+    ]
+
+    rules_matcher = RulesMatcher(config)
+    ordinal = rules_matcher.match_save_rule_ordinal(
+        create_message(template="simple_text_only")
+    )
+
+    assert ordinal == 1
+    assert rules_matcher.get_save_rule(ordinal) is config.save_rules[1]
+
+
+@patch("save_message.rules.rule_matches_to_matcher")
+def test_matchers_built_once(mock_rule_matches_to_matcher):
+    config = new_config()
+    config.save_rules = [sr(), sr()]
+
+    mock_rule_matches_to_matcher.return_value = new_non_matching_matcher()
+
+    rules_matcher = RulesMatcher(config)
+    for _ in range(3):
+        rules_matcher.match_save_rule_ordinal(
+            create_message(template="simple_text_only")
+        )
+
+    assert mock_rule_matches_to_matcher.call_count == 2
+
+
+def test_get_save_rule_none_returns_default_settings():
+    config = new_config()
+    config.save_rules = [sr()]
+    config.default_settings = MagicMock(spec=RuleSettings)
+
+    assert RulesMatcher(config).get_save_rule(None) == SaveRule(
+        settings=config.default_settings, matches=[]
+    )
+
+
+def test_needs_delete_confirmation():
+    config = new_config()
+    config.default_settings = RuleSettings(action=MessageAction.KEEP)
+    config.save_rules = [
+        SaveRule(settings=RuleSettings(action=MessageAction.IGNORE), matches=[]),
+        SaveRule(
+            settings=RuleSettings(
+                action=MessageAction.DELETE, delete_confirmation=False
+            ),
+            matches=[],
+        ),
+    ]
+
+    assert not RulesMatcher(config).needs_delete_confirmation()
+
+    config.save_rules.append(
+        SaveRule(
+            settings=RuleSettings(action=MessageAction.SAVE_AND_DELETE), matches=[]
+        )
+    )
+
+    assert RulesMatcher(config).needs_delete_confirmation()
+
+    config.save_rules.pop()
+    config.default_settings = RuleSettings(action=MessageAction.DELETE)
+
+    assert RulesMatcher(config).needs_delete_confirmation()
+
+
+def test_get_save_rule_none_returns_same_rule():
+    config = new_config()
+    config.save_rules = [sr()]
+    config.default_settings = RuleSettings(action=MessageAction.KEEP)
+
+    rules_matcher = RulesMatcher(config)
+
+    assert rules_matcher.get_save_rule(None) is rules_matcher.get_save_rule(None)
+
+
 # @patch("subprocess.run")
 # def test_match_with_prompt(subprocess_run: MagicMock):
 #     config = MagicMock(spec=Config)
@@ -165,3 +260,117 @@ def test_no_match_returns_default_settings(
 #
 #     except ValueError as ex:
 #         assert str(ex) == "no output returned from prompt_save_dir_command"
+
+
+def test_match_uses_rule_priority_across_fields():
+    config = new_config()
+    config.save_rules = [
+        SaveRule.construct(matches=[RuleMatch(from_="bar@example.com")]),
+        SaveRule.construct(
+            matches=[
+                RuleMatch(subject="Nope*"),
+                RuleMatch(to="*@yahoo.com", subject="Foo*"),
+            ]
+        ),
+        SaveRule.construct(matches=[RuleMatch(from_="foo@*")]),
+    ]
+
+    rules_matcher = RulesMatcher(config)
+    msg = create_message(
+        template="simple_text_only", subject="Foo bar", from_="foo@example.com"
+    )
+
+    assert rules_matcher.match_save_rule_ordinal(msg) == 1
+
+
+def test_match_same_as_linear_scan():
+    config = new_config()
+    config.save_rules = [
+        SaveRule.construct(matches=[RuleMatch(from_=f"user{i}@example.com")])
+        for i in range(200)
+    ] + [
+        SaveRule.construct(matches=[RuleMatch(from_="/user1[0-9]@.*/")]),
+        SaveRule.construct(matches=[RuleMatch(from_="*@example.com")]),
+    ]
+
+    rules_matcher = RulesMatcher(config)
+
+    for from_ in ["user150@example.com", "user15@other.com", "x@example.com", "y@z"]:
+        msg = create_message(template="simple_text_only", from_=from_)
+
+        expected = next(
+            (
+                i
+                for i, m in enumerate(rules_matcher.rule_set.matchers)
+                if m.matches(msg)
+            ),
+            None,
+        )
+        assert rules_matcher.match_save_rule_ordinal(msg) == expected
+
+
+def test_literal_and_domain_rules_same_as_linear_scan():
+    config = new_config()
+    config.save_rules = [
+        SaveRule.construct(matches=[RuleMatch(to="*@yahoo.com", subject="Nope")]),
+        SaveRule.construct(matches=[RuleMatch(from_="user1@example.com")]),
+        SaveRule.construct(matches=[RuleMatch(from_="*@example.com")]),
+        SaveRule.construct(matches=[RuleMatch(from_="*@example.co")]),
+        SaveRule.construct(matches=[RuleMatch(from_="user1@example.co")]),
+    ]
+
+    rules_matcher = RulesMatcher(config)
+
+    for from_ in [
+        "user1@example.com",
+        "User 1 <user1@example.com>",
+        "user10@example.com",
+        "user1@example.co.uk",
+        "@example.com",
+        "user1@other.com",
+    ]:
+        msg = create_message(template="simple_text_only", from_=from_)
+
+        expected = next(
+            (
+                i
+                for i, m in enumerate(rules_matcher.rule_set.matchers)
+                if m.matches(msg)
+            ),
+            None,
+        )
+        assert rules_matcher.match_save_rule_ordinal(msg) == expected
+
+
+def test_header_matchers_run_before_body():
+    config = new_config()
+    config.save_rules = [
+        SaveRule.construct(
+            matches=[RuleMatch(body="Thank you*", subject="Nope*", from_="/.*/")]
+        ),
+    ]
+
+    rules_matcher = RulesMatcher(config)
+    msg = create_message(template="simple_text_only")
+
+    assert rules_matcher.match_save_rule_ordinal(msg) is None
+    assert "body_text" not in vars(MessageView.of(msg))
+
+
+def test_adaptive_match_ordering():
+    config = new_config()
+    config.adaptive_match_ordering = True
+    config.save_rules = [
+        SaveRule.construct(matches=[RuleMatch(subject="Nope*", body="/.*/")]),
+        SaveRule.construct(matches=[RuleMatch(body="/Thank you/", from_="/.*/")]),
+    ]
+
+    rules_matcher = RulesMatcher(config)
+
+    assert all(
+        type(conj) is AdaptiveAndMatcher
+        for _, conj in rules_matcher.rule_set.conjunctions
+    )
+    assert rules_matcher.match_save_rule_ordinal(
+        create_message(template="simple_text_only")
+    ) == 1
@@ -0,0 +1,118 @@
+import re
+from unittest.mock import patch
+
+from .context import save_message  # noqa: F401
+from tests.util import create_message
+
+from save_message.message import MessageView
+from save_message.save import compile_name_template
+from save_message.save import get_message_name
+from save_message.save import sanitize_to_filename
+
+
+def test_get_message_name():
+    message = create_message(
+        "simple_text_only",
+        subject="Your invoice: #123/456",
+        from_="Jonny T <jonny@example.com>",
+        to="bob@example.org",
+        date="Sat, 11 Jun 2022 13:45:43 +0000",
+    )
+
+    assert (
+        get_message_name(
+            message,
+            "{from_name}|{from_addr}|{to_name}|{to_addr}|{subject}|{month_year}|{date}",
+        )
+        == "Jonny T|jonny@example.com|bob@example.org|bob@example.org"
+        + "|Your invoice 123 456|Jun22|11Jun22"
+    )
+
+
+def test_get_message_name_date_and_domain_fields():
+    message = create_message(
+        "simple_text_only",
+        from_="Jonny T <jonny@Mail.Example.com>",
+        date="Sat, 11 Jun 2022 13:45:43 +0000",
+    )
+
+    assert (
+        get_message_name(message, "{year}/{month}/{sender_domain}")
+        == "2022/06/mail.example.com"
+    )
+
+
+def test_sender_domain_without_domain():
+    for from_ in ["Jonny T <jonny>", ""]:
+        message = create_message("simple_text_only", from_=from_)
+
+        assert get_message_name(message, "{sender_domain}") == "unknown"
+
+
+def new_hostile_message():
+    message = create_message("simple_text_only")
+
+    # as parseaddr("../../etc <a@../../etc>") gives
+    MessageView.of(message).from_parts = ("../../etc", "a@../../etc")
+    MessageView.of(message).to_parts = ("", ".")
+
+    return message
+
+
+def test_get_message_name_fields_cannot_add_path_components():
+    message = new_hostile_message()
+
+    assert get_message_name(message, "{from_name} {sender_domain}") == (
+        ".. .. etc .. .. etc"
+    )
+    assert get_message_name(message, "{to_name}") == "unknown"
+
+
+def test_render_path_sanitizes_each_field():
+    template = compile_name_template("/save/{sender_domain}/{to_name}/{from_name}")
+
+    assert template.render(MessageView.of(new_hostile_message()), path=True) == (
+        "/save/.. .. etc/unknown/.. .. etc"
+    )
+
+
+def test_get_message_name_format_specs():
+    message = create_message("simple_text_only", from_="Jonny T <jonny@example.com>")
+
+    assert get_message_name(message, "{from_name!r:>10} {from_name[0]}") == (
+        " 'Jonny T' J"
+    )
+
+
+def test_get_message_name_only_works_out_fields_used():
+    message = create_message("simple_text_only", from_="Jonny T <jonny@example.com>")
+
+    with patch("save_message.message.parse_date") as parse_date:
+        assert get_message_name(message, "{from_name}") == "Jonny T"
+
+    parse_date.assert_not_called()
+    assert compile_name_template("{from_name} {subject}").fields == {
+        "from_name",
+        "subject",
+    }
+
+
+def test_get_message_name_shares_message_view():
+    message = create_message("simple_text_only", from_="Jonny T <jonny@example.com>")
+
+    get_message_name(message, "{from_name}")
+    MessageView.of(message).from_parts = ("Someone Else", "else@example.com")
+
+    assert get_message_name(message, "{from_name}") == "Someone Else"
+
+
+def test_sanitize_to_filename_matches_regexes():
+    for s in [
+        "Your invoice: #123/456",
+        "  tabs\tand\nnewlines  ",
+        "Ünïcödé – dashes — and ✓ marks",
+        "under_score and-hyphen",
+        "",
+    ]:
+        expected = re.sub(r"\s+", " ", re.sub(r"[^\w\s-]", " ", s))
+        assert sanitize_to_filename(s) == expected
@@ -0,0 +1,52 @@
+from email.message import EmailMessage
+import os
+import pytest
+
+from .context import save_message  # noqa: F401
+from tests.util import create_message
+
+from save_message.save import iter_decoded_payload
+
+
+def new_part(content: bytes, cte: str) -> EmailMessage:
+    part = EmailMessage()
+    part.set_content(content, maintype="application", subtype="octet-stream", cte=cte)
+    return part
+
+
+def do_iter_decoded_payload_test(part: EmailMessage, chunk_size: int):
+    chunks = list(iter_decoded_payload(part, chunk_size=chunk_size))
+
+    assert b"".join(chunks) == part.get_payload(decode=True)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 76, 1000, 1024 * 1024])
+def test_base64(chunk_size):
+    do_iter_decoded_payload_test(new_part(os.urandom(10001), "base64"), chunk_size)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 76, 1000, 1024 * 1024])
+def test_quoted_printable(chunk_size):
+    content = ("café = über long line " * 50 + "\n").encode() * 20
+    do_iter_decoded_payload_test(new_part(content, "quoted-printable"), chunk_size)
+
+
+def test_base64_missing_padding():
+    part = new_part(b"ab", "base64")
+    part.set_payload("YWI")
+
+    assert b"".join(iter_decoded_payload(part, chunk_size=2)) == b"ab"
+
+
+def test_base64_chunks_are_bounded():
+    part = new_part(os.urandom(100000), "base64")
+
+    assert max(len(c) for c in iter_decoded_payload(part, chunk_size=1000)) <= 1000
+
+
+def test_message_parts():
+    msg = create_message(template="text_html_with_calendar_attachment")
+
+    for part in msg.walk():
+        if not part.is_multipart():
+            do_iter_decoded_payload_test(part, chunk_size=10)
@@ -2,6 +2,7 @@ import email
 from email.message import EmailMessage
 import os
 import pytest
+import shutil
 import tempfile
 
 from unittest.mock import MagicMock
@@ -9,15 +10,26 @@ from unittest.mock import MagicMock
 from .context import save_message  # noqa: F401
 from tests.util import assert_file_has_content
 from tests.util import create_message
+from tests.util import create_message_string
 
+from save_message.attachment_store import AttachmentStore
+from save_message.ledger import SaveLedger
+from save_message.message import LazyEmailMessage
+from save_message.message import MessageView
 from save_message.model import Config
+from save_message.model import ConfigLedger
+from save_message.model import DedupeLink
 from save_message.model import MessageAction
 from save_message.model import RuleSaveSettings
 from save_message.model import RuleSettings
 from save_message.model import SaveRule
+from save_message.pdf import PdfCache
+from save_message.pdf import PdfConverter
+from save_message.rules import RulesMatcher
 from save_message.save import get_header_preamble
 from save_message.save import get_message_name
 from save_message.save import MessagePartSaver
+from save_message.save import MessageSaveException
 from save_message.save import MessageSaver
 
 
@@ -29,6 +41,14 @@ def temp_save_dir() -> str:
     # shutil.rmtree(result)
 
 
+def new_message_part_saver(config) -> MessagePartSaver:
+    return MessagePartSaver(
+        config=config,
+        attachment_store=AttachmentStore(),
+        pdf_converter=PdfConverter(Config(), PdfCache(Config())),
+    )
+
+
 def do_test_message_saver(
     temp_save_dir: str,
     message: EmailMessage,
@@ -56,7 +76,7 @@ def do_test_message_saver(
     # given
     # use real MessagePartSaver - we consciously test both here,
     # as comparing Message/EmailMessage instances in mocks is hard
-    message_part_saver = MessagePartSaver(config=Config)
+    message_part_saver = new_message_part_saver(Config)
 
     config = MagicMock(spec=Config)
     default_settings = default_settings or RuleSettings(
@@ -68,7 +88,7 @@ def do_test_message_saver(
     rule = SaveRule(settings=rule_settings or default_settings, matches=[])
 
     # when
-    message_saver = MessageSaver(config, message_part_saver)
+    message_saver = MessageSaver(config, message_part_saver, SaveLedger(Config()))
     message_saver.save_message(message, rule)
 
     # then
@@ -139,6 +159,29 @@ def do_test_message_saver(
         )
 
 
+def new_message_saver(
+    save_settings: RuleSaveSettings,
+    action: MessageAction = MessageAction.KEEP,
+    ledger_path: str = None,
+) -> tuple[MessageSaver, SaveRule]:
+    """Return a MessageSaver (with a real MessagePartSaver) whose default
+    settings use the given action and save_settings, and a rule with those
+    same settings to save messages with.
+
+    If ledger_path is specified, the MessageSaver records saves in a ledger
+    there.
+    """
+    config = MagicMock(spec=Config)
+    config.default_settings = RuleSettings(action=action, save_settings=save_settings)
+
+    ledger = ConfigLedger(path=ledger_path) if ledger_path else None
+    message_saver = MessageSaver(
+        config, new_message_part_saver(config), SaveLedger(Config(ledger=ledger))
+    )
+
+    return message_saver, SaveRule(settings=config.default_settings, matches=[])
+
+
 def test_simple_text_body_no_atts(temp_save_dir):
     message = create_message(template="simple_text_only")
     message_parts = list(message.walk())
@@ -577,3 +620,349 @@ def test_flatten_single_file_messages_for_body_custom_message_name(temp_save_dir
         rule_settings=rule_settings,
         files_in_temp_save_dir=True,
     )
+
+
+def test_save_eml_links_message_file(temp_save_dir):
+    source_dir = tempfile.mkdtemp()
+    source_path = os.path.join(source_dir, "1.M1P1.host:2,S")
+    with open(source_path, "w") as f:
+        f.write(create_message_string("simple_text_only"))
+
+    message = LazyEmailMessage(source_path)
+
+    message_saver, rule = new_message_saver(
+        RuleSaveSettings(
+            path=temp_save_dir, save_eml=True, save_body=False, save_attachments=None
+        )
+    )
+    message_saver.save_message(message, rule)
+
+    message_name = get_message_name(
+        message, fmt=rule.settings.save_settings.message_name
+    )
+    eml_path = os.path.join(temp_save_dir, message_name, f"{message_name}.eml")
+
+    assert os.path.samefile(source_path, eml_path)
+    assert not message._body_loaded
+
+
+@pytest.mark.parametrize("dedupe", [DedupeLink.HARDLINK, DedupeLink.SYMLINK])
+def test_dedupe_attachments(temp_save_dir, dedupe):
+    message_saver, rule = new_message_saver(
+        RuleSaveSettings(path=temp_save_dir, save_body=False, dedupe_attachments=dedupe)
+    )
+
+    saved = [
+        message_saver.save_message(
+            create_message(
+                template="text_html_with_calendar_attachment", subject=subject
+            ),
+            rule,
+        )[1]
+        for subject in ["Foo", "Bar"]
+    ]
+
+    assert len(saved[0]) == 1
+    assert os.path.samefile(saved[0][0], saved[1][0])
+    assert os.path.islink(saved[0][0]) == (dedupe == DedupeLink.SYMLINK)
+
+    with open(saved[0][0], "rb") as f:
+        attachment = [
+            p
+            for p in create_message(
+                template="text_html_with_calendar_attachment"
+            ).walk()
+            if p.get_filename()
+        ][0]
+        assert f.read() == attachment.get_payload(decode=True)
+
+
+def test_ledger_skips_saved_messages(temp_save_dir):
+    message_saver, rule = new_message_saver(
+        RuleSaveSettings(path=temp_save_dir),
+        ledger_path=os.path.join(tempfile.mkdtemp(), "ledger.sqlite"),
+    )
+    message_part_saver = message_saver.message_part_saver
+
+    message = create_message(template="simple_text_only")
+    first = message_saver.save_message(message, rule)
+
+    message_part_saver.save_part = MagicMock()
+    second = message_saver.save_message(message, rule)
+
+    assert second == first
+    assert os.listdir(temp_save_dir) == [os.path.basename(os.path.dirname(first[0]))]
+    message_part_saver.save_part.assert_not_called()
+
+    # once the saved files are gone, the message is saved again
+    shutil.rmtree(os.path.dirname(first[0]))
+    message_saver.save_message(message, rule)
+
+    message_part_saver.save_part.assert_called_once()
+
+
+def test_ledger_does_not_skip_other_message_with_same_message_id(temp_save_dir):
+    message_saver, rule = new_message_saver(
+        RuleSaveSettings(path=temp_save_dir),
+        action=MessageAction.SAVE_AND_DELETE,
+        ledger_path=os.path.join(tempfile.mkdtemp(), "ledger.sqlite"),
+    )
+    message_part_saver = message_saver.message_part_saver
+
+    first = create_message(template="simple_text_only", subject="Hello 1")
+    second = create_message(template="simple_text_only", subject="Hello 2")
+    assert first["message-id"] == second["message-id"]
+
+    message_saver.save_message(first, rule)
+
+    then = MagicMock()
+    message_part_saver.save_part = MagicMock()
+    message_saver.save_message(second, rule, then=then)
+
+    message_part_saver.save_part.assert_called_once()
+    then.assert_called_once()
+
+
+def test_queued_pdf_conversion_finishes_save_later(temp_save_dir):
+    message_saver, rule = new_message_saver(
+        RuleSaveSettings(
+            path=temp_save_dir,
+            save_attachments=None,
+            html_pdf_transform_command="cp $in $out",
+            flatten_single_file_messages=True,
+        ),
+        action=MessageAction.SAVE_AND_DELETE,
+    )
+
+    then = MagicMock()
+    on_failed = MagicMock()
+    message = create_message(template="text_html_with_calendar_attachment")
+    body_filename, _ = message_saver.save_message(
+        message, rule, then=then, on_failed=on_failed
+    )
+
+    # flattening waits for the conversion
+    assert os.path.dirname(body_filename) != temp_save_dir
+    then.assert_not_called()
+
+    message_saver.message_part_saver.pdf_converter.wait()
+
+    message_name = get_message_name(
+        message, fmt=rule.settings.save_settings.message_name
+    )
+    assert os.listdir(temp_save_dir) == [f"{message_name}.pdf"]
+    then.assert_called_once()
+    on_failed.assert_not_called()
+
+
+def test_queued_pdf_conversion_failure(temp_save_dir):
+    message_saver, rule = new_message_saver(
+        RuleSaveSettings(
+            path=temp_save_dir, html_pdf_transform_command="false $in $out"
+        ),
+        action=MessageAction.SAVE_AND_DELETE,
+    )
+
+    then = MagicMock()
+    on_failed = MagicMock()
+    message_saver.save_message(
+        create_message(template="text_html_with_calendar_attachment"),
+        rule,
+        then=then,
+        on_failed=on_failed,
+    )
+    message_saver.message_part_saver.pdf_converter.wait()
+
+    then.assert_not_called()
+    on_failed.assert_called_once()
+    assert isinstance(on_failed.call_args.args[0], MessageSaveException)
+
+
+def test_effective_settings_worked_out_once_per_rule(temp_save_dir):
+    message_saver, other_rule = new_message_saver(
+        RuleSaveSettings(path="$HOME/save", save_attachments="*.ics")
+    )
+    rule = SaveRule(
+        settings=RuleSettings(
+            action=MessageAction.KEEP,
+            save_settings=RuleSaveSettings(path=temp_save_dir),
+        ),
+        matches=[],
+    )
+
+    effective = message_saver.get_effective_settings(rule)
+
+    assert message_saver.get_effective_settings(rule) is effective
+    assert message_saver.get_effective_settings(other_rule) is not effective
+    assert effective.path == temp_save_dir
+    assert effective.matches_attachment("invite.ics")
+    assert not effective.matches_attachment("invite.pdf")
+    assert message_saver.get_effective_settings(other_rule).path == os.path.join(
+        os.environ["HOME"], "save"
+    )
+
+    message_saver.save_message(
+        create_message(template="text_html_with_calendar_attachment"), rule
+    )
+    message_saver.save_message(create_message(template="simple_text_only"), rule)
+
+    assert message_saver.get_effective_settings(rule) is effective
+    assert len(os.listdir(temp_save_dir)) == 2
+
+
+def test_repeated_collisions_get_numbered_names(temp_save_dir):
+    message_saver, rule = new_message_saver(
+        RuleSaveSettings(
+            path=temp_save_dir,
+            save_attachments=None,
+            flatten_single_file_messages=True,
+        )
+    )
+
+    message = create_message(template="simple_text_only")
+    message_name = get_message_name(
+        message, fmt=rule.settings.save_settings.message_name
+    )
+
+    for _ in range(3):
+        message_saver.save_message(message, rule)
+
+    assert sorted(os.listdir(temp_save_dir)) == [
+        f"{message_name} (2).txt",
+        f"{message_name} (3).txt",
+        f"{message_name}.txt",
+    ]
+
+
+def test_path_fields(temp_save_dir):
+    message_saver, rule = new_message_saver(
+        RuleSaveSettings(
+            path=os.path.join(temp_save_dir, "{year}", "{sender_domain}"),
+            save_attachments=None,
+            flatten_single_file_messages=True,
+        )
+    )
+    message = create_message(
+        template="simple_text_only",
+        from_="Jonny T <jonny@example.com>",
+        date="Sat, 11 Jun 2022 13:45:43 +0000",
+    )
+
+    body_filename, _ = message_saver.save_message(message, rule)
+
+    assert message_saver.get_effective_settings(rule).path == temp_save_dir
+    assert body_filename == os.path.join(
+        temp_save_dir,
+        "2022",
+        "example.com",
+        get_message_name(message, fmt=rule.settings.save_settings.message_name)
+        + ".txt",
+    )
+    assert os.path.exists(body_filename)
+
+
+def test_path_fields_stay_under_save_path(temp_save_dir):
+    save_path = os.path.join(temp_save_dir, "a", "b")
+    message_saver, rule = new_message_saver(
+        RuleSaveSettings(
+            path=os.path.join(save_path, "{sender_domain}"),
+            message_name="{from_name}",
+            save_attachments=None,
+        )
+    )
+    message = create_message(template="simple_text_only")
+    MessageView.of(message).from_parts = ("../..", "a@../..")
+
+    body_filename, _ = message_saver.save_message(message, rule)
+
+    assert body_filename == os.path.join(save_path, ".. ..", ".. ..", ".. ...txt")
+    assert os.listdir(temp_save_dir) == ["a"]
+
+
+def test_path_with_braces_but_no_fields(temp_save_dir):
+    for path in ["{work}", "{work", "{{year}}"]:
+        message_saver, rule = new_message_saver(
+            RuleSaveSettings(
+                path=os.path.join(temp_save_dir, path),
+                save_attachments=None,
+                flatten_single_file_messages=True,
+            )
+        )
+
+        body_filename, _ = message_saver.save_message(
+            create_message(template="simple_text_only"), rule
+        )
+
+        assert os.path.dirname(body_filename) == os.path.join(temp_save_dir, path)
+
+
+def test_path_fields_after_escaped_braces(temp_save_dir):
+    message_saver, rule = new_message_saver(
+        RuleSaveSettings(
+            path=os.path.join(temp_save_dir, "{{mail}}", "{year}"),
+            save_attachments=None,
+            flatten_single_file_messages=True,
+        )
+    )
+    message = create_message(
+        template="simple_text_only", date="Sat, 11 Jun 2022 13:45:43 +0000"
+    )
+
+    body_filename, _ = message_saver.save_message(message, rule)
+
+    save_path = os.path.join(temp_save_dir, "{mail}")
+    assert message_saver.get_effective_settings(rule).path == save_path
+    assert os.path.dirname(body_filename) == os.path.join(save_path, "2022")
+
+
+def test_shard_size(temp_save_dir):
+    save_settings = RuleSaveSettings(
+        path=temp_save_dir,
+        save_attachments=None,
+        flatten_single_file_messages=True,
+        shard_size=2,
+    )
+
+    def save_messages(count: int):
+        message_saver, rule = new_message_saver(save_settings)
+
+        for i in range(count):
+            message_saver.save_message(
+                create_message(template="simple_text_only", subject=f"Hello {i}"),
+                rule,
+            )
+
+    save_messages(3)
+
+    assert sorted(os.listdir(temp_save_dir)) == ["0001", "0002"]
+    assert len(os.listdir(os.path.join(temp_save_dir, "0001"))) == 2
+    assert len(os.listdir(os.path.join(temp_save_dir, "0002"))) == 1
+
+    # a new run carries on filling the last shard
+    save_messages(2)
+
+    assert sorted(os.listdir(temp_save_dir)) == ["0001", "0002", "0003"]
+    assert len(os.listdir(os.path.join(temp_save_dir, "0002"))) == 2
+    assert len(os.listdir(os.path.join(temp_save_dir, "0003"))) == 1
+
+
+def test_default_rule_effective_settings_reused(temp_save_dir):
+    config = Config(
+        default_settings=RuleSettings(
+            action=MessageAction.KEEP,
+            save_settings=RuleSaveSettings(path=temp_save_dir),
+        )
+    )
+    rules_matcher = RulesMatcher(config)
+    message_saver = MessageSaver(
+        config, new_message_part_saver(config), SaveLedger(Config())
+    )
+
+    for i in range(2):
+        message_saver.save_message(
+            create_message(template="simple_text_only", subject=f"Hello {i}"),
+            rules_matcher.get_save_rule(None),
+        )
+
+    assert len(message_saver.effective_settings) == 1
+    assert len(os.listdir(temp_save_dir)) == 2
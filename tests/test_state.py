@@ -0,0 +1,94 @@
+import os
+import pytest
+import shutil
+import tempfile
+
+from .context import save_message  # noqa: F401
+
+from save_message.model import Config
+from save_message.model import ConfigState
+from save_message.model import MessageAction
+from save_message.model import RuleMatch
+from save_message.model import RuleSettings
+from save_message.model import SaveRule
+from save_message.state import MaildirState
+from save_message.state import MaildirStates
+
+
+@pytest.fixture
+def temp_save_dir() -> str:
+    result = tempfile.mkdtemp()
+    yield result
+
+    shutil.rmtree(result)
+
+
+def test_new_state_is_empty(temp_save_dir):
+    state = MaildirState(os.path.join(temp_save_dir, "state.json"))
+
+    assert state.dir_mtimes is None
+    assert state.decided_keys == set()
+    assert not state.is_unchanged({"new": 1, "cur": 2})
+
+
+def test_update_all_decided_records_mtimes(temp_save_dir):
+    state = MaildirState(os.path.join(temp_save_dir, "state.json"))
+    state.decided_keys = {"a", "b", "gone"}
+
+    state.update({"new": 1, "cur": 2}, {"a", "b"})
+
+    assert state.decided_keys == {"a", "b"}
+    assert state.is_unchanged({"new": 1, "cur": 2})
+    assert not state.is_unchanged({"new": 1, "cur": 3})
+
+
+def test_update_some_undecided_does_not_record_mtimes(temp_save_dir):
+    state = MaildirState(os.path.join(temp_save_dir, "state.json"))
+    state.decided_keys = {"a"}
+
+    state.update({"new": 1, "cur": 2}, {"a", "b"})
+
+    assert state.decided_keys == {"a"}
+    assert not state.is_unchanged({"new": 1, "cur": 2})
+
+
+def test_save_and_load(temp_save_dir):
+    states = MaildirStates(
+        Config(state=ConfigState(path=os.path.join(temp_save_dir, "state")))
+    )
+
+    state = states.get_state("/mail")
+    state.decided_keys = {"a", "b"}
+    state.update({"new": 1, "cur": 2}, {"a", "b"})
+    state.save()
+
+    loaded = states.get_state("/mail")
+    assert loaded.decided_keys == {"a", "b"}
+    assert loaded.is_unchanged({"new": 1, "cur": 2})
+
+    assert states.get_state("/other-mail").decided_keys == set()
+
+
+def test_state_ignored_when_rules_change(temp_save_dir):
+    config = Config(
+        state=ConfigState(path=os.path.join(temp_save_dir, "state")),
+        default_settings=RuleSettings(action=MessageAction.KEEP),
+    )
+
+    state = MaildirStates(config).get_state("/mail")
+    state.decided_keys = {"a", "b"}
+    state.update({"new": 1, "cur": 2}, {"a", "b"})
+    state.save()
+
+    assert MaildirStates(config).get_state("/mail").decided_keys == {"a", "b"}
+
+    config.save_rules = [
+        SaveRule(
+            matches=[RuleMatch(subject="Hello")],
+            settings=RuleSettings(action=MessageAction.DELETE),
+        )
+    ]
+    changed = MaildirStates(config).get_state("/mail")
+
+    assert changed.decided_keys == set()
+    assert not changed.is_unchanged({"new": 1, "cur": 2})